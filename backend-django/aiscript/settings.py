@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 
 from pathlib import Path
 from corsheaders.defaults import default_methods
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 from os import getenv
 
@@ -59,6 +60,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "api.middleware.RequestTraceMiddleware",
 ]
 
 # CORS settings
@@ -98,12 +100,71 @@ WSGI_APPLICATION = "aiscript.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+# "sqlite" (a file next to the project) or "postgresql" (the compose `database` service)
+DATABASE_ENGINE = getenv("DATABASE_ENGINE", "sqlite")
+# Seconds a connection is kept open for the next requests of its thread (0 = closed
+# after every request), checked before it is reused. Under ASGI the views run in
+# threads of their own (sync_to_async) whose connections are not closed at the end of
+# the requests, they would pile up: the pool below is the way to reuse connections.
+DATABASE_CONN_MAX_AGE = int(getenv("DATABASE_CONN_MAX_AGE", 0))
+# Connections pooled by each process (PostgreSQL), shared by its threads instead of
+# one persistent connection per thread (0 = no pool)
+DATABASE_POOL_MAX_SIZE = int(getenv("DATABASE_POOL_MAX_SIZE", 10))
+DATABASE_POOL_MIN_SIZE = int(getenv("DATABASE_POOL_MIN_SIZE", 2))
+# Seconds to wait for a free connection of the pool before failing
+DATABASE_POOL_TIMEOUT = float(getenv("DATABASE_POOL_TIMEOUT", 30))
+
+if DATABASE_ENGINE == "postgresql":
+    pool = DATABASE_POOL_MAX_SIZE > 0
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": getenv("POSTGRES_DB"),
+            "USER": getenv("POSTGRES_USER"),
+            "PASSWORD": getenv("POSTGRES_PASSWORD"),
+            "HOST": getenv("POSTGRES_HOST", "database"),
+            "PORT": getenv("POSTGRES_PORT", "5432"),
+            # Pooled connections go back to the pool after every request instead
+            "CONN_MAX_AGE": 0 if pool else DATABASE_CONN_MAX_AGE,
+            "CONN_HEALTH_CHECKS": True,
+            "OPTIONS": {
+                "pool": {
+                    "min_size": DATABASE_POOL_MIN_SIZE,
+                    "max_size": DATABASE_POOL_MAX_SIZE,
+                    "timeout": DATABASE_POOL_TIMEOUT,
+                }
+            }
+            if pool
+            else {},
+        }
     }
-}
+elif DATABASE_ENGINE == "sqlite":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": getenv("SQLITE_PATH") or BASE_DIR / "db.sqlite3",
+            "CONN_MAX_AGE": DATABASE_CONN_MAX_AGE,
+            "CONN_HEALTH_CHECKS": True,
+            "OPTIONS": {
+                # Wait for the write lock instead of failing when the workers write concurrently
+                "timeout": 20,
+                # Take the write lock when a transaction starts: a transaction that reads
+                # first then writes could not get it while another one is writing
+                "transaction_mode": "IMMEDIATE",
+                # Readers no longer block the writer and are not blocked by it (WAL),
+                # commits only sync at checkpoints, and more of the database is cached
+                "init_command": (
+                    "PRAGMA journal_mode=WAL;"
+                    "PRAGMA synchronous=NORMAL;"
+                    "PRAGMA cache_size=-20000;"
+                    "PRAGMA temp_store=MEMORY;"
+                    "PRAGMA mmap_size=134217728"
+                ),
+            },
+        }
+    }
+else:
+    raise ImproperlyConfigured(f"Unknown DATABASE_ENGINE: {DATABASE_ENGINE}")
 
 
 # Password validation
@@ -142,7 +203,78 @@ USE_TZ = True
 
 STATIC_URL = "static/"
 
+# Media files (covers, documents, PDFs and exports), only this directory is served
+MEDIA_URL = "media/"
+MEDIA_ROOT = BASE_DIR / "media"
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+
+# Book generation jobs
+# Run the workers with `python manage.py runworkers`
+
+# Number of jobs processed concurrently by each `runworkers` process
+BOOK_JOB_WORKERS = int(getenv("BOOK_JOB_WORKERS", 2))
+# Seconds an idle worker waits before polling the queue again
+BOOK_JOB_POLL_INTERVAL = float(getenv("BOOK_JOB_POLL_INTERVAL", 1))
+# Seconds without progress after which a running job is considered abandoned
+BOOK_JOB_STALE_AFTER = int(getenv("BOOK_JOB_STALE_AFTER", 3600))
+# Number of times an abandoned job is retried before being marked as failed
+BOOK_JOB_MAX_ATTEMPTS = int(getenv("BOOK_JOB_MAX_ATTEMPTS", 3))
+# Number of books of the bulk creations (/book-create-bulk/) generated at once, shared by
+# all the bulk requests of a process, and the most books a bulk request may ask for
+BOOK_BULK_CONCURRENCY = int(getenv("BOOK_BULK_CONCURRENCY", 4))
+BOOK_BULK_MAX_BOOKS = int(getenv("BOOK_BULK_MAX_BOOKS", 100))
+# Number of worker processes building the documents (CPU-bound) of the books when
+# they are requested, shared by the process (0 = build them in the request's thread)
+BOOK_RENDER_PROCESSES = int(getenv("BOOK_RENDER_PROCESSES", 2))
+
+
+# Files of the books
+# The document (DOCX) and PDF of a book are rendered from its text the first time they
+# are requested ("lazy"), or as soon as the book is generated ("eager")
+BOOK_ARTIFACTS = getenv("BOOK_ARTIFACTS", "lazy")
+# Size cap (in bytes) of the rendered files kept under media/ (documents, PDFs and
+# exports), the least recently requested are removed beyond it (0 = no cap)
+ARTIFACT_CACHE_MAX_BYTES = int(getenv("ARTIFACT_CACHE_MAX_BYTES", 2 * 1024**3))
+
+
+# Reuse of similar books
+# What a new book reuses from the most similar existing books by default: "none",
+# "sections" (subsections with the same headings), "outline" (the table of contents,
+# and sections) or "book" (the whole text), overridden by the `reuse` of a request.
+# Reusing changes the text generated, it is off unless asked for.
+BOOK_REUSE = getenv("BOOK_REUSE", "none")
+# Cosine similarity (0 to 1) of the title, topic and audience of two books above which
+# they are similar, and of the headings of two subsections of similar books
+BOOK_SIMILARITY_THRESHOLD = float(getenv("BOOK_SIMILARITY_THRESHOLD", 0.8))
+SECTION_SIMILARITY_THRESHOLD = float(getenv("SECTION_SIMILARITY_THRESHOLD", 0.9))
+# Number of similar books looked up (and offered by /book-similar/)
+BOOK_SIMILARITY_TOP_K = int(getenv("BOOK_SIMILARITY_TOP_K", 5))
+
+
+# Observability
+# Metrics are served on /metrics (see model/metrics.py, PROMETHEUS_MULTIPROC_DIR)
+
+# Add a Server-Timing header to every response, not only to those asked with
+# `X-Trace: 1` or `?trace=1`
+REQUEST_TRACE = getenv("REQUEST_TRACE", "false").lower() in ("1", "true")
+
+# Events (failed conversions, finished jobs with the timings of their stages...) are
+# logged as JSON lines by the "aiscript" logger
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {"plain": {"format": "%(asctime)s %(levelname)s %(message)s"}},
+    "handlers": {"console": {"class": "logging.StreamHandler", "formatter": "plain"}},
+    "loggers": {
+        "aiscript": {
+            "handlers": ["console"],
+            "level": getenv("LOG_LEVEL", "INFO"),
+            "propagate": False,
+        }
+    },
+}
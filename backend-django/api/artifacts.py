@@ -0,0 +1,144 @@
+from concurrent.futures import Future
+from os import path, remove, scandir, stat, utime, walk
+from shutil import rmtree
+from threading import Lock
+from time import time
+from typing import Callable
+from django.conf import settings
+
+
+from model.files import building, is_building
+from model.settings import DOCUMENT_PARTS_ROOT
+from .metrics import ARTIFACTS, ARTIFACT_EVICTIONS
+
+
+class ArtifactStore:
+    # Files rendered from the text of the books, kept under media/ as a cache: a file is
+    # rendered on its first request, then served until its book changes (the file is
+    # older than the version, the book's updated_at). Concurrent requests of a file
+    # share a single render, and once the files weigh more than `max_bytes` the least
+    # recently requested are removed. The last request of a file is its access time,
+    # set on every hit, so that the other processes see it too. A directory (the
+    # cached parts of a document) is stored and removed as a whole. Files being built,
+    # by any process, are never removed (see model/files.py).
+    def __init__(self, directories: list, max_bytes: int) -> None:
+        self.directories = directories
+        self.max_bytes = max_bytes
+
+        self._lock = Lock()
+        self._renders = {}
+
+    def get(
+        self, kind: str, target: str, version: float, render: Callable[[], None]
+    ) -> str:
+        # The path of the file, rendered by `render` if it is missing or outdated
+        if self.fresh(target, version) and self.touch(target):
+            ARTIFACTS.labels(kind, "hit").inc()
+            return target
+
+        # The first request renders the file, the others wait for it
+        with self._lock:
+            future = self._renders.get(target)
+            if future is None:
+                future = self._renders[target] = Future()
+                leader = True
+            else:
+                leader = False
+        if not leader:
+            return future.result()
+
+        try:
+            # The render that was in progress may have ended since the file was checked
+            if not self.fresh(target, version):
+                with building(target):
+                    render()
+                ARTIFACTS.labels(kind, "render").inc()
+                self.evict(keep=target)
+            future.set_result(target)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._renders[target]
+        return target
+
+    @staticmethod
+    def fresh(target: str, version: float) -> bool:
+        try:
+            return path.getmtime(target) >= version
+        except FileNotFoundError:
+            return False
+
+    @staticmethod
+    def touch(target: str) -> bool:
+        # Record a request of the file, its modification time (its version) is kept
+        try:
+            utime(target, (time(), path.getmtime(target)))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def files(self) -> list:
+        # (last request, size, path) of the stored files, not those being written
+        files = []
+        for directory in self.directories:
+            if not path.isdir(directory):
+                continue
+            for entry in scandir(directory):
+                if entry.name.startswith(".") or ".part" in entry.name:
+                    continue
+                stats = tree_stats(entry.path) if entry.is_dir() else [entry.stat()]
+                files.append(
+                    (
+                        max((s.st_atime for s in stats), default=0),
+                        sum(s.st_size for s in stats),
+                        entry.path,
+                    )
+                )
+        return files
+
+    def evict(self, keep: str = None) -> int:
+        # Remove the least recently requested files until they fit in `max_bytes`
+        if self.max_bytes <= 0:
+            return 0
+
+        files = self.files()
+        total = sum(size for _, size, _ in files)
+        evicted = 0
+        for _, size, file in sorted(files):
+            if total <= self.max_bytes:
+                break
+            if file == keep or is_building(file):
+                continue
+            if path.isdir(file):
+                rmtree(file, ignore_errors=True)
+            else:
+                try:
+                    remove(file)
+                except FileNotFoundError:
+                    pass
+            total -= size
+            evicted += 1
+
+        ARTIFACT_EVICTIONS.inc(evicted)
+        return evicted
+
+
+def tree_stats(directory: str) -> list:
+    # Stats of the files under a directory, skipping those removed meanwhile
+    stats = []
+    for root, _, names in walk(directory):
+        for name in names:
+            try:
+                stats.append(stat(path.join(root, name)))
+            except FileNotFoundError:
+                pass
+    return stats
+
+
+# Shared by the requests and the jobs of the process
+artifacts = ArtifactStore(
+    ["media/docs", "media/pdfs", "media/exports", DOCUMENT_PARTS_ROOT],
+    settings.ARTIFACT_CACHE_MAX_BYTES,
+)
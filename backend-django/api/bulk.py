@@ -0,0 +1,119 @@
+from concurrent.futures import Executor, ThreadPoolExecutor, wait
+from json import dumps
+from threading import Lock
+from typing import Callable
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+
+from base.models import BOOK_TEXT, Book, BookJob
+from .checkpoints import Checkpoints
+from .dtos import BookCreateDto
+from .jobs import run_job, start_job
+from .pipeline import seed_checkpoints
+from .similarity import metrics
+
+
+# Bulk creation of books: the books of all the bulk requests of a process are generated
+# by one pool of BOOK_BULK_CONCURRENCY threads, their API calls at the bulk priority, so
+# that the throughput follows the size of the pool and not the number of clients.
+# The requests of a batch with the same prompt are generated once: the first book of
+# such a group is generated, the others are copies of it saved under their own names.
+
+_pool = None
+_pool_lock = Lock()
+
+
+def get_bulk_pool() -> Executor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(
+                max_workers=max(1, settings.BOOK_BULK_CONCURRENCY),
+                thread_name_prefix="bulk",
+            )
+        return _pool
+
+
+def prompt_key(data: BookCreateDto) -> str:
+    # What the text and the cover of a book depend on: its request but the name
+    return dumps(
+        {key: value for key, value in vars(data).items() if key != "name"},
+        sort_keys=True,
+    )
+
+
+def copy_book(job: BookJob, source: Book) -> None:
+    # Seed the job with the text and the cover of a book generated from the same prompt,
+    # it then only saves them like a resumed job
+    checkpoints = Checkpoints(job)
+    seed_checkpoints(checkpoints, source, text=True)
+    checkpoints.save("cover", source.cover)
+    job.reuse = {"book": source.id, "score": 1.0, "mode": "duplicate"}
+    metrics.record("duplicates_reused")
+
+
+def create_group(
+    group: list, on_result: Callable[[int, BookJob], None]
+) -> None:
+    # Run the jobs of a group (position, job) in turn, copying the first book generated
+    try:
+        source = None
+        for index, job in group:
+            if source is not None:
+                copy_book(job, source)
+            run_job(job)
+
+            if source is None and job.status == BookJob.Status.DONE:
+                source = Book.objects.prefetch_related(BOOK_TEXT).get(id=job.book_id)
+            on_result(index, job)
+    finally:
+        # The thread outlives the group, give its connection back
+        connections.close_all()
+
+
+def create_books(
+    requests: list,
+    on_job: Callable[[int, BookJob], None],
+    on_result: Callable[[int, BookJob], None],
+) -> None:
+    # Generate the books of a bulk request, calling `on_job` with the position and the
+    # job of every request once they are all created, then `on_result` as soon as each
+    # one is done (from the threads of the pool)
+    jobs = [
+        start_job(data, worker="bulk", priority=BookJob.Priority.BULK)
+        for data in requests
+    ]
+    for index, job in enumerate(jobs):
+        on_job(index, job)
+
+    groups = {}
+    for index, data in enumerate(requests):
+        groups.setdefault(prompt_key(data), []).append((index, jobs[index]))
+
+    waiting = {job.id for job in jobs}
+    lock = Lock()
+
+    def done(index: int, job: BookJob) -> None:
+        with lock:
+            waiting.discard(job.id)
+        on_result(index, job)
+
+    pool = get_bulk_pool()
+    futures = [pool.submit(create_group, group, done) for group in groups.values()]
+
+    # The jobs waiting for the pool make no progress, keep them from being taken for
+    # abandoned jobs (and run again by the workers) while the request lasts
+    while True:
+        _, running = wait(futures, timeout=settings.BOOK_JOB_STALE_AFTER / 4)
+        if not running:
+            break
+        with lock:
+            ids = list(waiting)
+        BookJob.objects.filter(id__in=ids, status=BookJob.Status.RUNNING).update(
+            updated_at=timezone.now()
+        )
+
+    for future in futures:
+        future.result()
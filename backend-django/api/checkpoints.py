@@ -0,0 +1,48 @@
+from django.db import IntegrityError
+from django.utils import timezone
+
+
+from base.models import BookJob, BookCheckpoint
+
+
+class Checkpoints:
+    # Stage outputs of a job, loaded once and persisted as soon as they are produced.
+    # Without a job nothing is persisted and every stage runs.
+    def __init__(self, job: BookJob = None) -> None:
+        self.job = job
+        self.saved = {}
+
+        if job is not None:
+            for checkpoint in job.checkpoints.all():
+                self.saved[(checkpoint.stage, checkpoint.unit)] = checkpoint.data
+
+    def get(self, stage: str, unit: int = 0):
+        return self.saved.get((stage, unit))
+
+    def units(self, stage: str) -> dict:
+        return {unit: data for (s, unit), data in self.saved.items() if s == stage}
+
+    def save(self, stage: str, data, unit: int = 0) -> None:
+        self.saved[(stage, unit)] = data
+        if self.job is None:
+            return
+
+        # Single statement writes, the stages of a job save their checkpoints from
+        # concurrent threads, and SQLite fails a read transaction upgraded to a write
+        # instead of waiting for the lock
+        checkpoint = BookCheckpoint.objects.filter(job=self.job, stage=stage, unit=unit)
+        if not checkpoint.update(data=data):
+            try:
+                BookCheckpoint.objects.create(
+                    job=self.job, stage=stage, unit=unit, data=data
+                )
+            except IntegrityError:
+                checkpoint.update(data=data)
+
+        # Every saved unit is also a heartbeat for the stale jobs detection
+        BookJob.objects.filter(id=self.job.id).update(updated_at=timezone.now())
+
+    def clear(self) -> None:
+        self.saved.clear()
+        if self.job is not None:
+            self.job.checkpoints.all().delete()
@@ -1,6 +1,10 @@
 # The Data Transfer Objects (DTOs) are used to define the structure of the data that is being sent between the client and the server.
 
 
+# Every mode reuses what the previous ones do, and more
+REUSE_MODES = ("none", "sections", "outline", "book")
+
+
 # The BookCreateDto is used to define the structure of the data that is being sent to the server when creating a new book.
 class BookCreateDto:
     def __init__(self, data: dict) -> None:
@@ -12,3 +16,8 @@ class BookCreateDto:
         self.num_chapters: int = data["num_chapters"]
         self.num_subsections: int = data["num_subsections"]
         self.cover: str = data["cover"]
+        # What may be reused from similar existing books: "none", "sections", "outline"
+        # or "book" (None = the BOOK_REUSE setting)
+        self.reuse: str | None = data.get("reuse")
+        if self.reuse not in (None, *REUSE_MODES):
+            raise ValueError(f"Unknown reuse mode: {self.reuse}")
@@ -0,0 +1,33 @@
+from asyncio import Queue, create_task, get_running_loop
+from json import dumps
+from typing import AsyncIterator, Callable
+from asgiref.sync import sync_to_async
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class EventStream:
+    # Bridges events emitted by a worker thread to an async Server-Sent Events response,
+    # must be created from the event loop serving the response
+    def __init__(self) -> None:
+        self.loop = get_running_loop()
+        self.queue = Queue()
+        self.task = None
+
+    def start(self, fn: Callable[[], None]) -> None:
+        # Run the producer in a worker thread, the event loop only relays its events
+        self.task = create_task(sync_to_async(fn, thread_sensitive=False)())
+
+    def emit(self, event: str, data: dict = None) -> None:
+        # Thread-safe, can be called from any thread
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, (event, data))
+
+    def close(self) -> None:
+        self.emit(None)
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        while True:
+            event, data = await self.queue.get()
+            if event is None:
+                return
+
+            yield f"event: {event}\ndata: {dumps(data, cls=JSONEncoder)}\n\n"
@@ -0,0 +1,130 @@
+from model.docx_parts import build_document, missing_chapters
+from model.pdf_converter import get_converter
+from model.renderers import export_path, render_export
+from base.models import Book, Chapter, Paragraph, Subsection
+from .artifacts import artifacts
+from .scheduler import run_in_process
+
+
+def book_content(book: Book, chapter_ids: list = None) -> list:
+    # The text of a book (or of some of its chapters) as the nested lists of the
+    # generator, read as plain rows: a long book has thousands of paragraphs, too many
+    # to build model instances of
+    chapters = Chapter.objects.filter(book=book)
+    subsections = Subsection.objects.filter(chapter__book=book)
+    paragraphs = Paragraph.objects.filter(subsection__chapter__book=book)
+    if chapter_ids is not None:
+        chapters = chapters.filter(id__in=chapter_ids)
+        subsections = subsections.filter(chapter_id__in=chapter_ids)
+        paragraphs = paragraphs.filter(subsection__chapter_id__in=chapter_ids)
+
+    chapters = {
+        id: {"chapter": title, "subsections": []}
+        for id, title in chapters.values_list("id", "title")
+    }
+    sections = {}
+    for id, chapter, title in subsections.values_list("id", "chapter_id", "title"):
+        sections[id] = {"subsection": title, "paragraphs": []}
+        chapters[chapter]["subsections"].append(sections[id])
+    for subsection, text in paragraphs.values_list("subsection_id", "text"):
+        sections[subsection]["paragraphs"].append(text)
+    return list(chapters.values())
+
+
+def book_document(book: Book) -> dict:
+    # The book as the dict of the generator, which the renderers read
+    content = book_content(book)
+    return {
+        "id": book.id,
+        "author": book.author,
+        "title": book.title,
+        "cover": book.cover,
+        "table_of_contents": [
+            {
+                "chapter": chapter["chapter"],
+                "subsections": [s["subsection"] for s in chapter["subsections"]],
+            }
+            for chapter in content
+        ],
+        "content": content,
+        "modified": book.updated_at.strftime("%Y-%m-%dT%H:%M:%SZ"),
+    }
+
+
+# The files of a book are rendered on their first request, then served from media/
+# until the book changes (see api/artifacts.py)
+
+
+def export_book(book: Book, format: str) -> str:
+    return artifacts.get(
+        format,
+        export_path(book.id, format),
+        book.updated_at.timestamp(),
+        lambda: render_export(book_document(book), format),
+    )
+
+
+def document_path(name: str) -> str:
+    return f"media/docs/{name}.docx"
+
+
+def pdf_path(name: str) -> str:
+    return f"media/pdfs/{name}.pdf"
+
+
+def document_parts(book: Book) -> dict:
+    # What the document of a book is built from (see model/docx_parts.py): its table of
+    # contents and the hashes of its chapters, and the text of the chapters that were
+    # never rendered only, an update of a chapter costs that chapter whatever the book
+    chapters = list(
+        Chapter.objects.filter(book=book).values_list("id", "title", "content_hash")
+    )
+    subsections = {}
+    for chapter, title in Subsection.objects.filter(chapter__book=book).values_list(
+        "chapter_id", "title"
+    ):
+        subsections.setdefault(chapter, []).append(title)
+
+    missing = missing_chapters(book.name, {content_hash for _, _, content_hash in chapters})
+    rendered = [
+        (id, content_hash) for id, _, content_hash in chapters if content_hash in missing
+    ]
+    content = book_content(
+        book, None if len(rendered) == len(chapters) else [id for id, _ in rendered]
+    )
+    return {
+        "id": book.name,
+        "author": book.author,
+        "title": book.title,
+        "cover": book.cover,
+        "table_of_contents": [
+            {"chapter": title, "subsections": subsections.get(id, [])}
+            for id, title, _ in chapters
+        ],
+        "hashes": [content_hash for _, _, content_hash in chapters],
+        "chapters": {
+            content_hash: chapter for (_, content_hash), chapter in zip(rendered, content)
+        },
+    }
+
+
+def book_docx(book: Book) -> str:
+    # The document is named after the book's files and built on its print cover,
+    # in a render process (it is CPU-bound)
+    return artifacts.get(
+        "docx",
+        document_path(book.name),
+        book.updated_at.timestamp(),
+        lambda: run_in_process(build_document, document_parts(book)),
+    )
+
+
+def book_pdf(book: Book) -> str:
+    # Converted from the document, which is rendered first if needed. Raises a
+    # ConversionError when the converter fails.
+    return artifacts.get(
+        "pdf",
+        pdf_path(book.name),
+        book.updated_at.timestamp(),
+        lambda: get_converter().convert(book_docx(book), pdf_path(book.name)),
+    )
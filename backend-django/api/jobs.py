@@ -0,0 +1,181 @@
+from datetime import timedelta
+from logging import ERROR, INFO, WARNING
+from threading import Event, Lock
+from time import monotonic
+from typing import Callable
+from traceback import format_exc
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F
+from django.utils import timezone
+
+
+from model.metrics import event
+from model.throttle import prioritized
+from base.models import BookJob
+from .dtos import BookCreateDto
+from .pipeline import generate_book
+from .checkpoints import Checkpoints
+from .metrics import JOB_SECONDS
+
+
+def enqueue_book(
+    data: BookCreateDto, priority: int = BookJob.Priority.INTERACTIVE
+) -> BookJob:
+    # Store the validated payload, the workers pick it up from the database
+    return BookJob.objects.create(payload=vars(data), priority=priority)
+
+
+def start_job(
+    data: BookCreateDto, worker: str, priority: int = BookJob.Priority.INTERACTIVE
+) -> BookJob:
+    # Create a job that is run right away by the caller instead of a worker
+    return BookJob.objects.create(
+        payload=vars(data),
+        priority=priority,
+        status=BookJob.Status.RUNNING,
+        worker=worker,
+        attempts=1,
+        started_at=timezone.now(),
+    )
+
+
+def resume_job(job: BookJob) -> bool:
+    # Put a failed job back in the queue, it restarts from its last checkpoints
+    return bool(
+        BookJob.objects.filter(id=job.id, status=BookJob.Status.FAILED).update(
+            status=BookJob.Status.PENDING,
+            error="",
+            worker="",
+            finished_at=None,
+            updated_at=timezone.now(),
+        )
+    )
+
+
+def claim_job(worker: str) -> BookJob | None:
+    while True:
+        job = (
+            BookJob.objects.filter(status=BookJob.Status.PENDING)
+            .order_by("priority", "id")
+            .first()
+        )
+        if job is None:
+            return None
+
+        # Compare-and-set on the status so that two workers never claim the same job,
+        # this works on SQLite as well since it does not need row locks
+        claimed = BookJob.objects.filter(
+            id=job.id, status=BookJob.Status.PENDING
+        ).update(
+            status=BookJob.Status.RUNNING,
+            worker=worker,
+            attempts=F("attempts") + 1,
+            started_at=timezone.now(),
+            updated_at=timezone.now(),
+        )
+        if claimed:
+            job.refresh_from_db()
+            return job
+
+
+def requeue_stale_jobs() -> int:
+    # Jobs left running by a crashed worker are retried, or failed once out of attempts
+    stale = BookJob.objects.filter(
+        status=BookJob.Status.RUNNING,
+        updated_at__lt=timezone.now()
+        - timedelta(seconds=settings.BOOK_JOB_STALE_AFTER),
+    )
+    failed = stale.filter(attempts__gte=settings.BOOK_JOB_MAX_ATTEMPTS).update(
+        status=BookJob.Status.FAILED,
+        error="Worker stopped responding",
+        finished_at=timezone.now(),
+    )
+    return failed + stale.update(status=BookJob.Status.PENDING, worker="")
+
+
+_stale_checked_at = None
+_stale_lock = Lock()
+
+
+def check_stale_jobs() -> int:
+    # Requeue the stale jobs at most every BOOK_JOB_STALE_AFTER / 2 seconds per process,
+    # called by the workers as they poll so that the job of a worker that crashed is
+    # picked up again while the others keep running
+    global _stale_checked_at
+    with _stale_lock:
+        now = monotonic()
+        if (
+            _stale_checked_at is not None
+            and now - _stale_checked_at < settings.BOOK_JOB_STALE_AFTER / 2
+        ):
+            return 0
+        _stale_checked_at = now
+
+    requeued = requeue_stale_jobs()
+    if requeued:
+        event("stale_jobs_requeued", level=WARNING, jobs=requeued)
+    return requeued
+
+
+def run_job(job: BookJob, on_event: Callable[[str, dict], None] = None) -> None:
+    def on_stage(stage: str) -> None:
+        # Record the progress, this also acts as the worker's heartbeat
+        job.stage = stage
+        job.save(update_fields=["stage", "updated_at"])
+        if on_event:
+            on_event("stage", {"stage": stage})
+
+    def on_trace(trace: list) -> None:
+        job.trace = trace
+
+    def on_reuse(reuse: dict) -> None:
+        job.reuse = reuse
+
+    try:
+        with prioritized(job.priority):
+            job.book = generate_book(
+                BookCreateDto(job.payload),
+                Checkpoints(job),
+                on_stage,
+                on_event,
+                on_trace,
+                on_reuse,
+            )
+        job.status = BookJob.Status.DONE
+    except Exception:
+        job.error = format_exc()
+        job.status = BookJob.Status.FAILED
+
+    job.finished_at = timezone.now()
+    job.save()
+
+    # One structured line per job, with the timings of its stages
+    seconds = (job.finished_at - job.started_at).total_seconds()
+    JOB_SECONDS.labels(job.status).observe(seconds)
+    event(
+        f"job_{job.status}",
+        level=INFO if job.status == BookJob.Status.DONE else ERROR,
+        job=job.id,
+        attempts=job.attempts,
+        seconds=round(seconds, 3),
+        trace=job.trace,
+        error=job.error or None,
+    )
+
+
+def work(worker: str, stop: Event) -> None:
+    # Worker loop: run jobs until asked to stop, polling the queue when it is empty
+    try:
+        while not stop.is_set():
+            close_old_connections()
+
+            check_stale_jobs()
+            job = claim_job(worker)
+            if job is None:
+                stop.wait(settings.BOOK_JOB_POLL_INTERVAL)
+                continue
+
+            run_job(job)
+    finally:
+        close_old_connections()
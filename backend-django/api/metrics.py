@@ -0,0 +1,63 @@
+from django.db.models import Count
+from prometheus_client import (
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.multiprocess import MultiProcessCollector
+
+
+from model.metrics import BUCKETS, MULTIPROCESS_DIR
+from base.models import BookJob
+
+
+JOB_SECONDS = Histogram(
+    "aiscript_job_seconds",
+    "Duration of the book generation jobs, by final status",
+    ["status"],
+    buckets=BUCKETS,
+)
+REUSE = Counter(
+    "aiscript_reuse",
+    "Lookups of the similarity index and what they allowed to reuse",
+    ["name"],
+)
+ARTIFACTS = Counter(
+    "aiscript_artifacts",
+    "Requests of the rendered files of the books, by kind and result (hit or render)",
+    ["kind", "result"],
+)
+ARTIFACT_EVICTIONS = Counter(
+    "aiscript_artifact_evictions", "Rendered files removed from the artifact store"
+)
+
+
+class JobQueueCollector:
+    # Book jobs by status, read from the database when the metrics are scraped, so that
+    # the queue depth is right whatever process queued or runs the jobs
+    def collect(self):
+        counts = dict(
+            BookJob.objects.values_list("status").annotate(count=Count("id"))
+        )
+        jobs = GaugeMetricFamily(
+            "aiscript_jobs", "Book generation jobs by status", labels=["status"]
+        )
+        for status in BookJob.Status.values:
+            jobs.add_metric([status], counts.get(status, 0))
+        yield jobs
+
+
+def render_metrics() -> bytes:
+    # The metrics of every process when they share a directory, else of this process
+    if MULTIPROCESS_DIR:
+        registry = CollectorRegistry()
+        MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+
+    jobs = CollectorRegistry()
+    jobs.register(JobQueueCollector())
+    return generate_latest(registry) + generate_latest(jobs)
@@ -0,0 +1,52 @@
+from time import perf_counter
+from typing import Callable
+from django.conf import settings
+from django.db import connection
+from django.http import HttpRequest, HttpResponse
+
+
+class QueryTimer:
+    # Database wrapper counting the queries of a request and the time spent in them
+    def __init__(self) -> None:
+        self.queries = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.seconds += perf_counter() - start
+
+
+class RequestTraceMiddleware:
+    # Adds a Server-Timing header (shown by the browsers' developer tools) with the
+    # duration of the request and of its database queries, for every request when
+    # REQUEST_TRACE is set, else for those sent with `X-Trace: 1` or `?trace=1`.
+    # Streamed responses only time the start of the stream.
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]) -> None:
+        self.get_response = get_response
+
+    def __call__(self, req: HttpRequest) -> HttpResponse:
+        if not (
+            settings.REQUEST_TRACE
+            or req.headers.get("X-Trace") == "1"
+            or req.GET.get("trace") == "1"
+        ):
+            return self.get_response(req)
+
+        timer = QueryTimer()
+        start = perf_counter()
+        with connection.execute_wrapper(timer):
+            response = self.get_response(req)
+        total = perf_counter() - start
+
+        response["Server-Timing"] = ", ".join(
+            [
+                f'db;dur={timer.seconds * 1000:.1f};desc="{timer.queries} queries"',
+                f"app;dur={(total - timer.seconds) * 1000:.1f}",
+                f"total;dur={total * 1000:.1f}",
+            ]
+        )
+        return response
@@ -0,0 +1,21 @@
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class BookCursorPagination(CursorPagination):
+    # Newest books first, ordered by id so that pages stay stable while books are added
+    ordering = "-id"
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
+
+
+class JobCursorPagination(BookCursorPagination):
+    # Most recent jobs first, like the books
+    pass
+
+
+class BookSearchPagination(PageNumberPagination):
+    # Search results are ranked by relevance, which has no cursor to resume from
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
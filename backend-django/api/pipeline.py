@@ -0,0 +1,215 @@
+from os import path
+from typing import Callable
+
+
+from model.book_generator import BookGenerator
+from model.cover_generator import CoverGenerator
+from model.metrics import event, timed
+from model.pdf_converter import ConversionError
+
+
+from django.conf import settings
+
+
+from base.models import BOOK_TEXT, Book
+from .serializers import BookSerializer
+from .dtos import BookCreateDto
+from .checkpoints import Checkpoints
+from .exports import book_docx, book_pdf, document_path, pdf_path
+from .scheduler import StageScheduler
+from .similarity import find_reusable_book, metrics, section_reuser
+
+
+# Runs the whole book generation pipeline and stores the resulting book.
+# Every unit of work is saved to `checkpoints` as soon as it is done, and the units
+# found there (from a previous, failed run) are reused instead of being regenerated.
+# `on_stage` is called with the name of each stage before it starts, `on_event`
+# (when given) receives the results of the stages as soon as they are ready,
+# `on_trace` (when given) receives the timing of the stages once the pipeline is over,
+# and `on_reuse` (when given) what was reused from similar books.
+def generate_book(
+    data: BookCreateDto,
+    checkpoints: Checkpoints = None,
+    on_stage: Callable[[str], None] = lambda _: None,
+    on_event: Callable[[str, dict], None] = None,
+    on_trace: Callable[[list], None] = None,
+    on_reuse: Callable[[dict], None] = None,
+) -> Book:
+    checkpoints = checkpoints or Checkpoints()
+    emit = on_event or (lambda *_: None)
+
+    # Start from the outline (or text) of a similar book, and reuse the subsections
+    # written for similar books
+    mode = data.reuse or settings.BOOK_REUSE
+    reused = reuse_similar_book(data, checkpoints, mode)
+    sections = section_reuser(data) if mode != "none" else None
+
+    def reuse(chapter: str, subsection: str) -> list | None:
+        paragraphs = sections(chapter, subsection)
+        if paragraphs:
+            reused["sections"] = reused.get("sections", 0) + 1
+        return paragraphs
+
+    # Create a new book instance
+    book = BookGenerator(data, reuse=sections and reuse)
+
+    # Save and announce the cover once it is generated
+    def on_done(stage: str, result) -> None:
+        if stage == "cover":
+            checkpoints.save(stage, result)
+            emit(stage, {stage: result})
+
+    # The cover only depends on the request, so it is generated while the text is
+    # written. The document and the PDF are rendered from the saved book.
+    scheduler = StageScheduler(on_start=on_stage, on_done=on_done)
+    scheduler.add("outline", generate_text, book, checkpoints, on_stage, on_event)
+    scheduler.add("cover", generate_cover, book, checkpoints)
+
+    try:
+        scheduler.run()
+    finally:
+        if on_trace:
+            on_trace(scheduler.trace)
+        emit("trace", {"trace": scheduler.trace})
+        if reused:
+            if on_reuse:
+                on_reuse(reused)
+            emit("reuse", reused)
+
+    # Serialize the data, save it and return the book
+    on_stage("save")
+    with timed("save"):
+        serializer = BookSerializer(data=book.book)
+        serializer.is_valid(raise_exception=True)
+        book = serializer.save(name=book.book["id"])
+
+    # The book holds everything now, the checkpoints are not needed anymore
+    checkpoints.clear()
+
+    # Its files are served from these paths, rendered on their first request
+    # unless they are wanted right away
+    if settings.BOOK_ARTIFACTS == "eager":
+        generate_files(book, on_stage)
+    emit("document", {"document": document_path(book.name)})
+    emit("pdf", {"pdf": pdf_path(book.name)})
+    return book
+
+
+# Seeds the checkpoints with the outline (mode "outline") or the whole text (mode "book")
+# of the most similar existing book, the text is then resumed from them like after a
+# failed run. Returns what was reused.
+def reuse_similar_book(data: BookCreateDto, checkpoints: Checkpoints, mode: str) -> dict:
+    if mode not in ("outline", "book") or checkpoints.get("outline") is not None:
+        return {}
+
+    match = find_reusable_book(data)
+    source = match and (
+        Book.objects.prefetch_related(BOOK_TEXT).filter(id=match[0]).first()
+    )
+    if not source:
+        return {}
+
+    seed_checkpoints(checkpoints, source, text=mode == "book")
+    metrics.record(f"{mode}s_reused")
+    return {"book": source.id, "score": round(match[1], 3), "mode": mode}
+
+
+# Saves the outline of a book (prefetched with `BOOK_TEXT`) to the checkpoints, and its
+# subsections with `text`
+def seed_checkpoints(checkpoints: Checkpoints, source: Book, text: bool) -> None:
+    checkpoints.save("outline", source.table_of_contents)
+    if text:
+        paragraphs = [
+            subsection["paragraphs"]
+            for chapter in source.content
+            for subsection in chapter["subsections"]
+        ]
+        for index, unit in enumerate(paragraphs):
+            checkpoints.save("subsection", unit, unit=index)
+
+
+# Generates the outline and the content of the book
+def generate_text(
+    book: BookGenerator,
+    checkpoints: Checkpoints,
+    on_stage: Callable[[str], None],
+    on_event: Callable[[str, dict], None] = None,
+) -> None:
+    emit = on_event or (lambda *_: None)
+
+    def on_outline() -> None:
+        checkpoints.save("outline", book.book["table_of_contents"])
+        emit("outline", {"table_of_contents": book.book["table_of_contents"]})
+        on_stage("chapters")
+
+    def on_subsection(index: int, entry: dict) -> None:
+        checkpoints.save("subsection", entry["paragraphs"], unit=index)
+        emit("subsection", {"index": index, **entry})
+
+    # Stream the text only when someone listens
+    on_token = on_event and (
+        lambda index, token: emit("token", {"index": index, "token": token})
+    )
+
+    # Generate the table of contents
+    table_of_contents = checkpoints.get("outline")
+    if table_of_contents is None:
+        # Generate the chapters and content as the outline streams in
+        book.generate_outline_and_chapters(
+            on_token=on_token,
+            on_subsection=on_subsection,
+            on_chapter=lambda chapter: emit("chapter", chapter),
+            on_outline=on_outline,
+        )
+        return
+
+    # Resume from the outline of a previous run
+    book.book["table_of_contents"] = table_of_contents
+    emit("outline", {"table_of_contents": table_of_contents})
+
+    # Replay the subsections generated by the previous run
+    completed = checkpoints.units("subsection")
+    titles = [
+        subsection
+        for chapter in table_of_contents
+        for subsection in chapter["subsections"]
+    ]
+    for index in sorted(completed):
+        emit(
+            "subsection",
+            {
+                "index": index,
+                "subsection": titles[index],
+                "paragraphs": completed[index],
+            },
+        )
+
+    # Generate the missing chapters and content
+    on_stage("chapters")
+    book.generate_chapters(
+        on_token=on_token, on_subsection=on_subsection, completed=completed
+    )
+
+
+# Generates the cover, unless it was generated by a previous run
+def generate_cover(book: BookGenerator, checkpoints: Checkpoints) -> str:
+    cover = checkpoints.get("cover")
+    if cover is None or not path.exists(cover):
+        cover = CoverGenerator(book.book).generate_cover()
+    book.book["cover"] = cover
+    return cover
+
+
+# Renders the document and the PDF of a saved book, a failed conversion does not
+# fail the book (its PDF is converted again when it is requested)
+def generate_files(book: Book, on_stage: Callable[[str], None]) -> None:
+    on_stage("document")
+    with timed("document"):
+        book_docx(book)
+
+    on_stage("pdf")
+    with timed("pdf"):
+        try:
+            book_pdf(book)
+        except ConversionError as e:
+            event("pdf_conversion_failed", book=book.id, error=str(e))
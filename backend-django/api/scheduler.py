@@ -0,0 +1,134 @@
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Executor,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from concurrent.futures.process import BrokenProcessPool
+from contextvars import copy_context
+from multiprocessing import get_context
+from threading import Lock
+from time import perf_counter
+from typing import Callable
+from django.conf import settings
+from django.db import connections
+
+
+from model.metrics import STAGE_SECONDS
+
+
+class StageScheduler:
+    # Runs the stages of a pipeline as a dependency graph: every stage starts as soon
+    # as the stages it comes after are done, so independent stages overlap. The stages
+    # run in threads, they wait on the API; the CPU-bound rendering of the files of a
+    # book runs in the worker processes of run_in_process, when they are requested.
+    def __init__(
+        self,
+        on_start: Callable[[str], None] = lambda _: None,
+        on_done: Callable[[str, object], None] = lambda *_: None,
+    ) -> None:
+        self.on_start = on_start
+        self.on_done = on_done
+
+        self.stages = {}
+        self.results = {}
+        # Timing of every stage, in seconds since the start of the run
+        self.trace = []
+
+    def add(self, name: str, fn: Callable, *args, after: tuple = ()) -> None:
+        for dependency in after:
+            if dependency not in self.stages:
+                raise ValueError(f"Stage {name} comes after unknown stage {dependency}")
+        self.stages[name] = {"fn": fn, "args": args, "after": set(after)}
+
+    def run(self) -> dict:
+        start = perf_counter()
+        pending = dict(self.stages)
+        running = {}
+        error = None
+
+        def run_stage(name: str, stage: dict):
+            started = perf_counter()
+            try:
+                self.on_start(name)
+                result = stage["fn"](*stage["args"])
+                self.on_done(name, result)
+                return result
+            finally:
+                # The thread ends with the run, give its connection back (to the pool)
+                connections.close_all()
+                STAGE_SECONDS.labels(name).observe(perf_counter() - started)
+                self.trace.append(
+                    {
+                        "stage": name,
+                        "start": round(started - start, 3),
+                        "end": round(perf_counter() - start, 3),
+                        "seconds": round(perf_counter() - started, 3),
+                    }
+                )
+
+        with ThreadPoolExecutor(max_workers=max(1, len(pending))) as executor:
+            while pending or running:
+                # Start every stage whose dependencies are done, unless a stage failed
+                if error is None:
+                    for name, stage in list(pending.items()):
+                        if stage["after"] <= self.results.keys():
+                            del pending[name]
+                            # In the caller's context (the priority of its API calls)
+                            running[
+                                executor.submit(copy_context().run, run_stage, name, stage)
+                            ] = name
+                elif not running:
+                    break
+
+                if not running:
+                    raise ValueError(f"Stages with circular dependencies: {list(pending)}")
+
+                # Wait for the next stage to finish
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        self.results[name] = future.result()
+                    except Exception as e:
+                        error = error or e
+
+        self.trace.sort(key=lambda entry: entry["start"])
+        if error is not None:
+            raise error
+        return self.results
+
+
+_processes = None
+_processes_lock = Lock()
+
+
+def get_process_pool() -> Executor:
+    # Worker processes shared by every render of the process, they are kept alive so
+    # that their imports and caches (parsed templates...) stay warm between books
+    global _processes
+    with _processes_lock:
+        if _processes is None:
+            _processes = ProcessPoolExecutor(
+                max_workers=settings.BOOK_RENDER_PROCESSES,
+                mp_context=get_context("spawn"),
+            )
+        return _processes
+
+
+def run_in_process(fn: Callable, *args):
+    # Without render processes, the renders run in the calling thread
+    if settings.BOOK_RENDER_PROCESSES <= 0:
+        return fn(*args)
+
+    pool = get_process_pool()
+    try:
+        return pool.submit(fn, *args).result()
+    except BrokenProcessPool:
+        # A worker process died, replace the pool for the next renders
+        global _processes
+        with _processes_lock:
+            if _processes is pool:
+                _processes = None
+        raise
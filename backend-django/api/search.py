@@ -0,0 +1,238 @@
+from html import escape
+from re import findall
+from django.db import NotSupportedError, connection
+
+
+from base.models import Book, Chapter, SearchEntry, Subsection
+
+
+# Marks around the matched terms in the snippets, replaced by <mark> once the rest of
+# the snippet is escaped (the text of the books is not HTML)
+MATCH_START, MATCH_END = "\ue000", "\ue001"
+
+# Words of context around the matches in a snippet
+SNIPPET_WORDS = 24
+
+
+# Indexing: the entries of a book are written along with its text, the database keeps
+# its full-text index in sync with them (see base/migrations/0010_search_index.py)
+
+
+def headings(chapters) -> str:
+    # The table of contents of a book, its chapter and subsection titles
+    return "\n".join(
+        title
+        for chapter in chapters
+        for title in (chapter.title, *(s.title for s in chapter.subsections.all()))
+    )
+
+
+def section_entry(chapter: Chapter, subsection: Subsection) -> dict:
+    return {
+        "headings": f"{chapter.title}\n{subsection.title}",
+        "text": "\n\n".join(p.text for p in subsection.paragraphs.all()),
+    }
+
+
+def index_book(book: Book) -> None:
+    # (Re)index the whole book, after it is created or its text replaced
+    chapters = book.chapters.prefetch_related("subsections__paragraphs")
+
+    entries = [
+        SearchEntry(
+            book=book, title=book.title, topic=book.topic, headings=headings(chapters)
+        )
+    ]
+    entries += [
+        SearchEntry(book=book, subsection=subsection, **section_entry(chapter, subsection))
+        for chapter in chapters
+        for subsection in chapter.subsections.all()
+    ]
+
+    SearchEntry.objects.filter(book=book).delete()
+    SearchEntry.objects.bulk_create(entries)
+
+
+def index_chapters(book: Book, chapters: list) -> None:
+    # Reindex the book itself and the given chapters only, after its text was updated
+    # (the entries of the replaced chapters were deleted along with them)
+    entry = {
+        "title": book.title,
+        "topic": book.topic,
+        "headings": headings(book.chapters.prefetch_related("subsections")),
+    }
+    if not SearchEntry.objects.filter(book=book, subsection=None).update(**entry):
+        SearchEntry.objects.create(book=book, **entry)
+
+    chapters = Chapter.objects.filter(
+        id__in=[chapter.id for chapter in chapters]
+    ).prefetch_related("subsections__paragraphs")
+    SearchEntry.objects.bulk_create(
+        SearchEntry(book=book, subsection=subsection, **section_entry(chapter, subsection))
+        for chapter in chapters
+        for subsection in chapter.subsections.all()
+    )
+
+
+def index_section(subsection: Subsection) -> None:
+    # Reindex a subsection edited on its own, and the table of contents of its book
+    chapter = subsection.chapter
+    entry = section_entry(chapter, subsection)
+    if not SearchEntry.objects.filter(subsection=subsection).update(**entry):
+        SearchEntry.objects.create(
+            book_id=chapter.book_id, subsection=subsection, **entry
+        )
+
+    chapters = Chapter.objects.filter(book_id=chapter.book_id).prefetch_related(
+        "subsections"
+    )
+    SearchEntry.objects.filter(book_id=chapter.book_id, subsection=None).update(
+        headings=headings(chapters)
+    )
+
+
+# Searching: the books are ranked by their best matching entry, and the snippets are
+# only computed for the entries of the page returned
+
+
+SQLITE_HITS = """
+    WITH hits AS (
+        SELECT e.book_id, e.id AS entry,
+               bm25(base_searchentry_fts, 10.0, 5.0, 3.0, 1.0) AS score
+        FROM base_searchentry_fts f JOIN base_searchentry e ON e.id = f.rowid
+        WHERE base_searchentry_fts MATCH %s
+    ), best AS (
+        SELECT book_id, entry, score,
+               ROW_NUMBER() OVER (PARTITION BY book_id ORDER BY score) AS n
+        FROM hits
+    )
+    SELECT book_id, entry, -score FROM best WHERE n = 1
+    ORDER BY score, book_id LIMIT %s OFFSET %s
+"""
+SQLITE_COUNT = """
+    SELECT COUNT(DISTINCT e.book_id)
+    FROM base_searchentry_fts f JOIN base_searchentry e ON e.id = f.rowid
+    WHERE base_searchentry_fts MATCH %s
+"""
+SQLITE_SNIPPETS = """
+    SELECT rowid, snippet(base_searchentry_fts, -1, %s, %s, '…', %s)
+    FROM base_searchentry_fts
+    WHERE base_searchentry_fts MATCH %s AND rowid IN ({entries})
+"""
+
+POSTGRESQL_HITS = """
+    WITH hits AS (
+        SELECT e.book_id, e.id AS entry, ts_rank_cd(e.document, q) AS score
+        FROM base_searchentry e, websearch_to_tsquery('english', %s) q
+        WHERE e.document @@ q
+    ), best AS (
+        SELECT book_id, entry, score,
+               ROW_NUMBER() OVER (PARTITION BY book_id ORDER BY score DESC) AS n
+        FROM hits
+    )
+    SELECT book_id, entry, score FROM best WHERE n = 1
+    ORDER BY score DESC, book_id LIMIT %s OFFSET %s
+"""
+POSTGRESQL_COUNT = """
+    SELECT COUNT(DISTINCT e.book_id)
+    FROM base_searchentry e, websearch_to_tsquery('english', %s) q
+    WHERE e.document @@ q
+"""
+POSTGRESQL_SNIPPETS = """
+    SELECT e.id, ts_headline(
+        'english', concat_ws(E'\\n', e.title, e.topic, e.headings, e.text), q,
+        'StartSel=' || %s || ', StopSel=' || %s || ', MaxWords=' || %s
+        || ', MinWords=' || %s || ', MaxFragments=1'
+    )
+    FROM base_searchentry e, websearch_to_tsquery('english', %s) q
+    WHERE e.id IN ({entries})
+"""
+
+
+def fts5_query(query: str) -> str:
+    # Every word of the query must match, quoted so that the FTS5 syntax (AND, NEAR,
+    # column filters, quotes...) typed by a user is matched as plain words
+    return " ".join(f'"{word}"' for word in findall(r"\w+", query))
+
+
+class SearchResults:
+    # Ranked books matching a query, counted and sliced by the paginator: only the page
+    # requested is ranked and given snippets. Items are {book, entry, score, snippet}.
+    def __init__(self, query: str) -> None:
+        self.vendor = connection.vendor
+        if self.vendor == "sqlite":
+            self.query = fts5_query(query)
+        elif self.vendor == "postgresql":
+            self.query = query
+        else:
+            raise NotSupportedError(f"Full-text search is not supported on {self.vendor}")
+
+        self._count = None
+
+    def count(self) -> int:
+        if not self.query:
+            return 0
+        if self._count is None:
+            sql = SQLITE_COUNT if self.vendor == "sqlite" else POSTGRESQL_COUNT
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [self.query])
+                self._count = cursor.fetchone()[0]
+        return self._count
+
+    def __len__(self) -> int:
+        return self.count()
+
+    def __getitem__(self, page: slice) -> list:
+        if not self.query:
+            return []
+        offset = page.start or 0
+        limit = (page.stop if page.stop is not None else self.count()) - offset
+
+        with connection.cursor() as cursor:
+            if self.vendor == "sqlite":
+                cursor.execute(SQLITE_HITS, [self.query, limit, offset])
+            else:
+                cursor.execute(POSTGRESQL_HITS, [self.query, limit, offset])
+            hits = [
+                {"book": book, "entry": entry, "score": score}
+                for book, entry, score in cursor.fetchall()
+            ]
+
+            snippets = self.snippets(cursor, [hit["entry"] for hit in hits])
+        for hit in hits:
+            hit["snippet"] = snippets.get(hit["entry"], "")
+        return hits
+
+    def snippets(self, cursor, entries: list) -> dict:
+        if not entries:
+            return {}
+
+        placeholders = ", ".join(["%s"] * len(entries))
+        if self.vendor == "sqlite":
+            cursor.execute(
+                SQLITE_SNIPPETS.format(entries=placeholders),
+                [MATCH_START, MATCH_END, SNIPPET_WORDS, self.query, *entries],
+            )
+        else:
+            cursor.execute(
+                POSTGRESQL_SNIPPETS.format(entries=placeholders),
+                [
+                    MATCH_START,
+                    MATCH_END,
+                    SNIPPET_WORDS,
+                    SNIPPET_WORDS // 2,
+                    self.query,
+                    *entries,
+                ],
+            )
+
+        return {
+            entry: escape(snippet)
+            .replace(MATCH_START, "<mark>")
+            .replace(MATCH_END, "</mark>")
+            for entry, snippet in cursor.fetchall()
+        }
+
+
+def search_books(query: str) -> SearchResults:
+    return SearchResults(query)
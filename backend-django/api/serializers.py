@@ -1,9 +1,184 @@
+from django.db import transaction
+from django.utils import timezone
 from rest_framework import serializers
-from base.models import Book
+from base.models import Book, BookJob, Chapter, Paragraph, Subsection, chapter_hash
+from model.cover_generator import cover_paths
+from .dtos import REUSE_MODES
+from .search import index_book, index_chapters, index_section
 
 
-class BookSerializer(serializers.ModelSerializer):
+class FieldsMixin:
+    # Only serialize the fields listed in `fields` (all of them by default)
+    def __init__(self, *args, fields: list = None, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class BookListSerializer(FieldsMixin, serializers.ModelSerializer):
+    # Books without their text, which weighs megabytes for a long book
+    covers = serializers.SerializerMethodField()
+
     class Meta:
         model = Book
         fields = '__all__'
-        
\ No newline at end of file
+
+    def get_covers(self, book: Book) -> dict:
+        # Every size of the cover (print, web, thumbnail)
+        return cover_paths(book.cover)
+
+
+class BookSerializer(BookListSerializer):
+    # Books with their text, read and written as the nested lists of the generator.
+    # The table of contents is read from the text, it is ignored when writing.
+    table_of_contents = serializers.JSONField(read_only=True)
+    content = serializers.JSONField()
+
+    def validate_content(self, content) -> list:
+        try:
+            valid = all(
+                isinstance(chapter["chapter"], str)
+                and all(
+                    isinstance(subsection["subsection"], str)
+                    and all(isinstance(p, str) for p in subsection["paragraphs"])
+                    for subsection in chapter["subsections"]
+                )
+                for chapter in content
+            )
+        except (KeyError, TypeError):
+            valid = False
+
+        if not valid or not isinstance(content, list):
+            raise serializers.ValidationError(
+                "Expected [{chapter, subsections: [{subsection, paragraphs: [...]}]}]"
+            )
+        return content
+
+    def create(self, validated_data: dict) -> Book:
+        content = validated_data.pop("content")
+        with transaction.atomic():
+            book = super().create(validated_data)
+            book.set_content(content)
+            index_book(book)
+        return book
+
+    def update(self, book: Book, validated_data: dict) -> Book:
+        content = validated_data.pop("content", None)
+        with transaction.atomic():
+            book = super().update(book, validated_data)
+            # Only the chapters that changed are written and indexed again,
+            # the title and topic are indexed too
+            chapters = book.set_content(content) if content is not None else []
+            index_chapters(book, chapters)
+        return book
+
+
+class BookCreateSerializer(serializers.ModelSerializer):
+    # A request to generate a book (BookCreateDto), checked against the fields of the
+    # book it is saved as before anything is generated
+    # Files are named after `name` (media/covers/{name}.png fits Book.cover)
+    name = serializers.RegexField(r"^[\w-]+$", max_length=150)
+    # "ai" or the URL of an image, the book stores the path of its own copy
+    cover = serializers.CharField()
+    reuse = serializers.ChoiceField(REUSE_MODES, required=False, allow_null=True)
+
+    class Meta:
+        model = Book
+        fields = [
+            'name',
+            'author',
+            'title',
+            'topic',
+            'target_audience',
+            'num_chapters',
+            'num_subsections',
+            'cover',
+            'reuse',
+        ]
+        extra_kwargs = {
+            'num_chapters': {'min_value': 1},
+            'num_subsections': {'min_value': 1},
+        }
+
+
+class BookSearchSerializer(BookListSerializer):
+    # A book found by the search, with its relevance and the best matching passage
+    score = serializers.FloatField(read_only=True)
+    snippet = serializers.CharField(read_only=True)
+
+
+class BookSimilarSerializer(BookListSerializer):
+    # A book similar to a request, reused by the generation when `reusable`
+    score = serializers.FloatField(read_only=True)
+    reusable = serializers.BooleanField(read_only=True)
+
+
+class ParagraphsField(serializers.ListField):
+    child = serializers.CharField(allow_blank=True, trim_whitespace=False)
+
+    def to_representation(self, paragraphs) -> list:
+        return [paragraph.text for paragraph in paragraphs.all()]
+
+
+class SectionSerializer(serializers.ModelSerializer):
+    # A subsection of a book with its paragraphs, read and written on its own
+    number = serializers.SerializerMethodField()
+    chapter = serializers.CharField(source="chapter.title", read_only=True)
+    subsection = serializers.CharField(source="title", required=False)
+    paragraphs = ParagraphsField(required=False)
+
+    class Meta:
+        model = Subsection
+        fields = ['id', 'number', 'chapter', 'subsection', 'paragraphs']
+
+    def get_number(self, subsection: Subsection) -> str:
+        return f"{subsection.chapter.position + 1}.{subsection.position + 1}"
+
+    def update(self, subsection: Subsection, validated_data: dict) -> Subsection:
+        paragraphs = validated_data.pop("paragraphs", None)
+        with transaction.atomic():
+            subsection = super().update(subsection, validated_data)
+
+            # Replace the paragraphs of this subsection only
+            if paragraphs is not None:
+                subsection.paragraphs.all().delete()
+                Paragraph.objects.bulk_create(
+                    Paragraph(subsection=subsection, position=p, text=text)
+                    for p, text in enumerate(paragraphs)
+                )
+
+            index_section(subsection)
+
+            # The text of its chapter changed, so did its hash
+            chapter = Chapter.objects.prefetch_related("subsections__paragraphs").get(
+                id=subsection.chapter_id
+            )
+            Chapter.objects.filter(id=chapter.id).update(
+                content_hash=chapter_hash(chapter.content)
+            )
+
+            # The book changed too (its ETag and Last-Modified)
+            Book.objects.filter(id=subsection.chapter.book_id).update(
+                updated_at=timezone.now()
+            )
+        return subsection
+
+
+class JobBookSerializer(serializers.ModelSerializer):
+    # The book of a listed job, its text is only in the job detail
+    class Meta:
+        model = Book
+        fields = ['id', 'name']
+
+
+class BookJobListSerializer(serializers.ModelSerializer):
+    book = JobBookSerializer(read_only=True)
+
+    class Meta:
+        model = BookJob
+        exclude = ['payload', 'worker']
+
+
+class BookJobSerializer(BookJobListSerializer):
+    book = BookSerializer(read_only=True)
@@ -0,0 +1,330 @@
+from collections import Counter
+from functools import lru_cache
+from math import log
+from re import findall
+from threading import Lock, Thread
+from typing import Callable
+from django.conf import settings
+from django.db import connections
+from django.db.models import Count, Max
+from numpy import (
+    argpartition,
+    argsort,
+    array,
+    bincount,
+    concatenate,
+    cumsum,
+    float32,
+    float64,
+    int64,
+    isin,
+    log as nlog,
+    sqrt,
+    zeros,
+)
+
+
+from base.models import Book, Paragraph, Subsection
+from .dtos import BookCreateDto
+from .metrics import REUSE
+
+
+def stem(word: str) -> str:
+    # Crude suffix stripping, so that "learn", "learning" and "learned" match
+    for suffix in ("ing", "ed", "es", "s"):
+        if len(word) > 4 and word.endswith(suffix):
+            return word[: -len(suffix)]
+    return word
+
+
+@lru_cache(maxsize=2**18)
+def terms(text: str) -> Counter:
+    # Words and pairs of words, numbers (chapter and subsection numbers) are left out.
+    # Cached, the same texts are indexed again every time the index is rebuilt.
+    words = [
+        stem(word)
+        for word in findall(r"[a-z0-9]+", text.lower())
+        if not word.isdigit()
+    ]
+    return Counter(words + [f"{a} {b}" for a, b in zip(words, words[1:])])
+
+
+def request_text(title: str, topic: str, target_audience: str) -> str:
+    return f"{title}\n{topic}\n{target_audience}"
+
+
+def section_text(chapter: str, subsection: str) -> str:
+    return f"{chapter}\n{subsection}"
+
+
+class TfidfIndex:
+    # TF-IDF vectors of texts, normalized for cosine similarity. The vectors are sparse
+    # and stored column by column (one column per term): scoring a query only reads
+    # the columns of its terms, whatever the number of texts.
+    def __init__(self, keys: list, texts: list) -> None:
+        self.keys = array(keys, dtype=int64)
+
+        # Flatten the term counts of all the texts, then weigh them all at once
+        self.vocabulary = {}
+        rows, columns, counts = [], [], []
+        for row, text in enumerate(texts):
+            for term, tf in terms(text).items():
+                columns.append(self.vocabulary.setdefault(term, len(self.vocabulary)))
+                rows.append(row)
+                counts.append(tf)
+        rows = array(rows, dtype=int64)
+        columns = array(columns, dtype=int64)
+
+        # Smoothed inverse document frequency, a term found nowhere gets the highest one
+        frequencies = bincount(columns, minlength=len(self.vocabulary))
+        self.unknown_idf = log(len(texts) + 1) + 1
+        idf = nlog((len(texts) + 1) / (1 + frequencies)) + 1
+
+        weights = (1 + nlog(array(counts, dtype=float64))) * idf[columns]
+        norms = sqrt(bincount(rows, weights**2, minlength=len(texts)))
+        weights /= norms[rows]
+
+        # Compressed sparse columns: the rows and weights of column c are at
+        # indptr[c]:indptr[c + 1]
+        order = argsort(columns, kind="stable")
+        self.indices = rows[order]
+        self.data = weights[order].astype(float32)
+        self.indptr = concatenate([[0], cumsum(frequencies)])
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def search(self, text: str, k: int, mask=None) -> list:
+        # Keys of the k most similar texts (among the rows of `mask`) with their cosine
+        # similarity, the most similar first
+        query = terms(text)
+        if not query or not len(self):
+            return []
+
+        columns, weights = [], []
+        for term, tf in query.items():
+            column = self.vocabulary.get(term)
+            idf = self.unknown_idf if column is None else log(
+                (len(self) + 1) / (1 + self.indptr[column + 1] - self.indptr[column])
+            ) + 1
+            weights.append((1 + log(tf)) * idf)
+            columns.append(column)
+        norm = sum(weight**2 for weight in weights) ** 0.5
+
+        scores = zeros(len(self), dtype=float32)
+        for column, weight in zip(columns, weights):
+            if column is not None:
+                start, end = self.indptr[column], self.indptr[column + 1]
+                scores[self.indices[start:end]] += self.data[start:end] * (weight / norm)
+        if mask is not None:
+            scores[~mask] = 0
+
+        k = min(k, len(self))
+        top = argpartition(-scores, k - 1)[:k]
+        top = top[argsort(-scores[top])]
+        return [(int(self.keys[i]), float(scores[i])) for i in top if scores[i] > 0]
+
+
+class SimilarityIndex:
+    # The requests (title, topic, audience) of the existing books and the headings of
+    # their subsections, as TF-IDF vectors
+    def __init__(self, state: dict) -> None:
+        self.state = state
+
+        books = list(
+            Book.objects.values_list(
+                "id",
+                "title",
+                "topic",
+                "target_audience",
+                "num_chapters",
+                "num_subsections",
+            )
+        )
+        self.books = TfidfIndex(
+            [book[0] for book in books], [request_text(*book[1:4]) for book in books]
+        )
+        self.shapes = {book[0]: (book[4], book[5]) for book in books}
+
+        sections = list(
+            Subsection.objects.values_list(
+                "id", "chapter__book_id", "chapter__title", "title"
+            )
+        )
+        self.sections = TfidfIndex(
+            [section[0] for section in sections],
+            [section_text(*section[2:]) for section in sections],
+        )
+        self.section_books = array([section[1] for section in sections], dtype=int64)
+
+    def similar_books(
+        self, title: str, topic: str, target_audience: str, k: int
+    ) -> list:
+        return self.books.search(request_text(title, topic, target_audience), k)
+
+    def similar_section(self, chapter: str, subsection: str, books) -> tuple | None:
+        # The subsection closest to this one, among the subsections of the books
+        # selected by `books` (a mask from `books_mask`), with its similarity
+        hits = self.sections.search(section_text(chapter, subsection), 1, books)
+        return hits[0] if hits else None
+
+    def books_mask(self, books: list):
+        return isin(self.section_books, books)
+
+
+class ReuseMetrics:
+    # Lookups of the similarity index and what they allowed to reuse, since the start
+    # of the process
+    def __init__(self) -> None:
+        self._counts = Counter()
+        self._lock = Lock()
+
+    def record(self, name: str, count: int = 1) -> None:
+        with self._lock:
+            self._counts[name] += count
+        REUSE.labels(name).inc(count)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counts = dict(self._counts)
+
+        lookups, sections = counts.get("lookups", 0), counts.get("section_lookups", 0)
+        return {
+            **counts,
+            "hit_rate": counts.get("hits", 0) / lookups if lookups else 0.0,
+            "section_hit_rate": counts.get("section_hits", 0) / sections
+            if sections
+            else 0.0,
+        }
+
+
+metrics = ReuseMetrics()
+
+_index = None
+_index_lock = Lock()
+_rebuilding = False
+
+
+def index_state() -> dict:
+    # A book created, updated or deleted changes it
+    return Book.objects.aggregate(
+        count=Count("id"), last_id=Max("id"), last_modified=Max("updated_at")
+    )
+
+
+def rebuild_in_background(state: dict) -> None:
+    # Called with the lock held, a single rebuild at a time
+    global _rebuilding
+    if not _rebuilding:
+        _rebuilding = True
+        Thread(target=rebuild_index, args=(_index, state), daemon=True).start()
+
+
+def get_index(wait: bool = True) -> SimilarityIndex:
+    # Rebuilt when a book was created, updated or deleted since it was built. Without
+    # `wait`, the previous index is returned while a new one is built in the background.
+    global _index
+    state = index_state()
+    with _index_lock:
+        if _index is None or (wait and _index.state != state):
+            _index = SimilarityIndex(state)
+        elif _index.state != state:
+            rebuild_in_background(state)
+        return _index
+
+
+def cached_index() -> SimilarityIndex | None:
+    # The index at hand, never waiting for one: the generation goes on without reuse
+    # until the first index is built (in the background), and with the previous one
+    # while a new one is
+    state = index_state()
+    with _index_lock:
+        if _index is None or _index.state != state:
+            rebuild_in_background(state)
+        return _index
+
+
+def rebuild_index(previous: SimilarityIndex | None, state: dict) -> None:
+    global _index, _rebuilding
+    try:
+        index = SimilarityIndex(state)
+        # Unless a newer index was built in the meantime
+        with _index_lock:
+            if _index is previous:
+                _index = index
+    finally:
+        with _index_lock:
+            _rebuilding = False
+        connections.close_all()
+
+
+def lookup_books(
+    index: SimilarityIndex, title: str, topic: str, target_audience: str, k: int = None
+) -> list:
+    hits = index.similar_books(
+        title, topic, target_audience, k or settings.BOOK_SIMILARITY_TOP_K
+    )
+    metrics.record("lookups")
+    if hits and hits[0][1] >= settings.BOOK_SIMILARITY_THRESHOLD:
+        metrics.record("hits")
+    return hits
+
+
+def similar_books(
+    title: str, topic: str, target_audience: str, k: int = None, wait: bool = True
+) -> list:
+    # The existing books closest to a request, [(book id, similarity)] most similar first
+    return lookup_books(get_index(wait), title, topic, target_audience, k)
+
+
+def find_reusable_book(data: BookCreateDto) -> tuple | None:
+    # The most similar book above the threshold with the requested number of chapters
+    # and subsections, whose outline (or whole text) can be reused
+    index = cached_index()
+    if index is None:
+        return None
+
+    for book, score in lookup_books(
+        index, data.title, data.topic, data.target_audience
+    ):
+        if score < settings.BOOK_SIMILARITY_THRESHOLD:
+            break
+        if index.shapes.get(book) == (data.num_chapters, data.num_subsections):
+            return book, score
+    return None
+
+
+def section_reuser(data: BookCreateDto) -> Callable[[str, str], list | None] | None:
+    # Looks the subsections to generate up among the subsections of the books similar
+    # to the request, returns their paragraphs when their headings are close enough.
+    # The whole book is looked up in the same index.
+    index = cached_index()
+    if index is None:
+        return None
+
+    books = [
+        book
+        for book, score in lookup_books(
+            index, data.title, data.topic, data.target_audience
+        )
+        if score >= settings.BOOK_SIMILARITY_THRESHOLD
+    ]
+    if not books:
+        return None
+    mask = index.books_mask(books)
+
+    def reuse(chapter: str, subsection: str) -> list | None:
+        hit = index.similar_section(chapter, subsection, mask)
+        metrics.record("section_lookups")
+        if hit is None or hit[1] < settings.SECTION_SIMILARITY_THRESHOLD:
+            return None
+
+        paragraphs = list(
+            Paragraph.objects.filter(subsection_id=hit[0]).values_list("text", flat=True)
+        )
+        if not paragraphs:
+            return None
+        metrics.record("section_hits")
+        return paragraphs
+
+    return reuse
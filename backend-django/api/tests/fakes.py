@@ -0,0 +1,100 @@
+from openai import OpenAI
+
+
+from benchmarks.fake_openai import FakeOpenAI
+from model.cache import ResponseCache
+from model.client import LLMClient, create_http_client
+from base.models import Book
+from api.dtos import BookCreateDto
+from api.serializers import BookSerializer
+
+
+class RecordingClient(LLMClient):
+    # Client keeping the prompts of the chat requests and the pieces of the streamed
+    # responses, as they were received. The requests whose prompt contains one of
+    # `failing` fail.
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.prompts = []
+        self.chunks = []
+        self.failing = ()
+
+    def chat(self, messages: list, *args, **kwargs) -> str:
+        self.record(messages)
+        return super().chat(messages, *args, **kwargs)
+
+    def chat_stream(self, messages: list, *args, **kwargs):
+        self.record(messages)
+        for token in super().chat_stream(messages, *args, **kwargs):
+            self.chunks.append(token)
+            yield token
+
+    def record(self, messages: list) -> None:
+        prompt = "".join(message["content"] for message in messages)
+        self.prompts.append(prompt)
+        if any(text in prompt for text in self.failing):
+            raise RuntimeError(f"Injected failure: {prompt[:80]}")
+
+
+def fake_client(**options) -> tuple:
+    # A local fake of the OpenAI API (benchmarks/fake_openai.py) and a client calling
+    # it, without cache. The caller stops the fake and closes the client's pool.
+    fake = FakeOpenAI(latency=0, image_latency=0, **options).start()
+    http = create_http_client()
+    client = RecordingClient(
+        openai=OpenAI(
+            api_key="fake", base_url=fake.url, http_client=http, max_retries=0
+        ),
+        http=http,
+        cache=ResponseCache(),
+    )
+    return fake, client
+
+
+def book_request(**fields) -> BookCreateDto:
+    return BookCreateDto(
+        {
+            "name": "test-book",
+            "author": "Test Author",
+            "title": "Testing Under Load",
+            "topic": "software testing",
+            "target_audience": "developers",
+            "num_chapters": 4,
+            "num_subsections": 3,
+            "cover": "null",
+            **fields,
+        }
+    )
+
+
+def create_book(name: str, paragraphs: list = ("Some text.",), **fields) -> Book:
+    # A saved (and indexed) book of two chapters of two subsections, the first
+    # subsection having the given `paragraphs`
+    content = [
+        {
+            "chapter": f"Chapter {c}: Topic {c}",
+            "subsections": [
+                {
+                    "subsection": f"{c}.{s} Subtopic {c}.{s}",
+                    "paragraphs": list(paragraphs) if (c, s) == (1, 1) else ["Text."],
+                }
+                for s in (1, 2)
+            ],
+        }
+        for c in (1, 2)
+    ]
+    serializer = BookSerializer(
+        data={
+            "author": "Test Author",
+            "title": "Testing Under Load",
+            "topic": "software testing",
+            "target_audience": "developers",
+            "num_chapters": 2,
+            "num_subsections": 2,
+            "cover": "null",
+            "content": content,
+            **fields,
+        }
+    )
+    serializer.is_valid(raise_exception=True)
+    return serializer.save(name=name)
@@ -0,0 +1,50 @@
+from django.test import TestCase
+
+
+from .fakes import create_book
+
+
+class BookListTests(TestCase):
+    # The list of the books: cursor pages, projections and conditional requests
+    def setUp(self) -> None:
+        self.books = [create_book(f"book-{n}") for n in range(5)]
+
+    def test_not_modified(self) -> None:
+        response = self.client.get("/book-list/")
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+
+        response = self.client.get("/book-list/", headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+
+        # Another page or projection, or a change of the books, has another ETag
+        response = self.client.get(
+            "/book-list/", {"fields": "id"}, headers={"if-none-match": etag}
+        )
+        self.assertEqual(response.status_code, 200)
+        create_book("book-new")
+        response = self.client.get("/book-list/", headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, 200)
+
+    def test_cursor_pages(self) -> None:
+        ids, url = [], "/book-list/?page_size=2"
+        while url:
+            page = self.client.get(url).json()
+            self.assertLessEqual(len(page["results"]), 2)
+            ids += [book["id"] for book in page["results"]]
+            url = page["next"]
+
+        # Every book once, the newest first
+        self.assertEqual(ids, [book.id for book in reversed(self.books)])
+
+    def test_fields(self) -> None:
+        page = self.client.get("/book-list/", {"fields": "id,title,covers"}).json()
+        self.assertEqual(set(page["results"][0]), {"id", "title", "covers"})
+
+        # Never the text of the books
+        self.assertNotIn("content", self.client.get("/book-list/").json()["results"][0])
+
+        response = self.client.get("/book-list/", {"fields": "id,content,bogus"})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"fields": "Unknown fields: bogus, content"})
@@ -0,0 +1,108 @@
+from os import path
+from tempfile import TemporaryDirectory
+from time import sleep
+from django.test import SimpleTestCase
+
+
+from model.cache import MemoryCache, SQLiteCache
+
+
+class CacheTests:
+    # Limits, expiry and usage of a cache backend, made by the `create` of the test case
+    def test_entry_limit_evicts_oldest(self) -> None:
+        cache = self.create(max_entries=3)
+        for key in "abc":
+            cache.set(key, key * 10)
+        # Reading an entry makes it the most recently used
+        self.assertEqual(cache.get("a"), "a" * 10)
+        cache.set("d", "d" * 10)
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(
+            [cache.get(key) for key in "acd"], ["a" * 10, "c" * 10, "d" * 10]
+        )
+        self.assertEqual(cache.usage(), {"entries": 3, "bytes": 30})
+        self.assertEqual(cache.evictions, 1)
+
+    def test_byte_limit_evicts_oldest(self) -> None:
+        cache = self.create(max_bytes=25)
+        cache.set("a", "a" * 10)
+        cache.set("b", "b" * 10)
+        cache.set("c", "c" * 10)
+
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.usage(), {"entries": 2, "bytes": 20})
+
+    def test_expired_entries_miss(self) -> None:
+        cache = self.create()
+        cache.set("short", "value", ttl=0.05)
+        cache.set("long", "value")
+        sleep(0.1)
+
+        self.assertIsNone(cache.get("short"))
+        self.assertEqual(cache.get("long"), "value")
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+
+class MemoryCacheTests(CacheTests, SimpleTestCase):
+    def create(self, **limits) -> MemoryCache:
+        return MemoryCache(
+            **{"ttl": 60, "max_entries": 100, "max_bytes": 10**6, **limits}
+        )
+
+
+class SQLiteCacheTests(CacheTests, SimpleTestCase):
+    def setUp(self) -> None:
+        self.directory = TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = path.join(self.directory.name, "cache.sqlite3")
+
+    def create(self, **limits) -> SQLiteCache:
+        return SQLiteCache(
+            self.path, **{"ttl": 60, "max_entries": 100, "max_bytes": 10**6, **limits}
+        )
+
+    def assertTotals(self, cache: SQLiteCache) -> None:
+        # The totals kept by the triggers match the rows
+        self.assertEqual(
+            cache._db.execute("SELECT entries, size FROM totals").fetchone(),
+            cache._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone(),
+        )
+
+    def test_totals(self) -> None:
+        cache = self.create(max_entries=20, max_bytes=1000)
+        # Inserts, then replaces of entries of another size
+        for n in range(15):
+            cache.set(f"key-{n}", "x" * n)
+        self.assertTotals(cache)
+        for n in range(0, 15, 2):
+            cache.set(f"key-{n}", "é" * (n + 3))
+        self.assertTotals(cache)
+
+        # Evictions, from a second cache sharing the file
+        other = self.create(max_entries=20, max_bytes=1000)
+        for n in range(40):
+            other.set(f"other-{n}", "y" * 40)
+        self.assertTotals(cache)
+        self.assertGreater(other.evictions, 0)
+        self.assertEqual(cache.usage(), other.usage())
+        self.assertLessEqual(cache.usage()["entries"], 20)
+        self.assertLessEqual(cache.usage()["bytes"], 1000)
+
+        cache.clear()
+        self.assertTotals(cache)
+        self.assertEqual(cache.usage(), {"entries": 0, "bytes": 0})
+
+    def test_totals_of_existing_file(self) -> None:
+        # A file written before the totals existed gets them from its rows
+        cache = self.create()
+        for n in range(5):
+            cache.set(f"key-{n}", "x" * 10)
+        cache._db.execute("DROP TABLE totals")
+        cache._db.commit()
+
+        cache = self.create()
+        self.assertEqual(cache.usage(), {"entries": 5, "bytes": 50})
+        self.assertTotals(cache)
@@ -0,0 +1,106 @@
+from hashlib import sha256
+from json import dumps
+from os import path, remove, stat
+from random import Random
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+from zipfile import ZipFile
+from zlib import crc32
+from cv2 import imwrite
+from django.test import SimpleTestCase
+from docx import Document
+from numpy import full, uint8
+
+
+from model.docx_parts import build_document, compress, join, parts_directory
+
+
+def chapter(c: int, text: str) -> dict:
+    return {
+        "chapter": f"Chapter {c}: Topic {c}",
+        "subsections": [
+            {"subsection": f"{c}.{s} Subtopic {c}.{s}", "paragraphs": [text, text]}
+            for s in (1, 2)
+        ],
+    }
+
+
+class DocumentPartsTests(SimpleTestCase):
+    # Documents assembled from the cached parts of their chapters (model/docx_parts.py)
+    def setUp(self) -> None:
+        self.directory = TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        patcher = patch("model.docx_parts.DOCUMENT_PARTS_ROOT", self.directory.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.cover = path.join(self.directory.name, "cover.png")
+        imwrite(self.cover, full((250, 200, 3), 128, uint8))
+        self.chapters = [
+            chapter(c, f"Text of chapter {c} & <more>.") for c in (1, 2, 3)
+        ]
+
+    def content_hash(self, c: int) -> str:
+        return sha256(dumps(self.chapters[c]).encode()).hexdigest()
+
+    def build(self, rendered: list) -> str:
+        # Build the document with the text of the `rendered` chapters only, like
+        # api/exports.document_parts
+        hashes = [self.content_hash(c) for c in range(len(self.chapters))]
+        target = build_document(
+            {
+                "id": "test-document",
+                "author": "Test Author",
+                "title": "Testing Documents",
+                "cover": self.cover,
+                "table_of_contents": [
+                    {
+                        "chapter": chapter["chapter"],
+                        "subsections": [
+                            subsection["subsection"]
+                            for subsection in chapter["subsections"]
+                        ],
+                    }
+                    for chapter in self.chapters
+                ],
+                "hashes": hashes,
+                "chapters": {hashes[c]: self.chapters[c] for c in rendered},
+            }
+        )
+        self.addCleanup(lambda: path.exists(target) and remove(target))
+        return target
+
+    def assertValid(self, target: str) -> list:
+        # A ZIP whose CRCs all match, that Word (python-docx) opens
+        with ZipFile(target) as package:
+            self.assertIsNone(package.testzip())
+        return [paragraph.text for paragraph in Document(target).paragraphs]
+
+    def part(self, c: int) -> str:
+        return path.join(
+            parts_directory("test-document"), f"{self.content_hash(c)}.chapter"
+        )
+
+    def test_chapter_update(self) -> None:
+        text = self.assertValid(self.build([0, 1, 2]))
+        self.assertIn("Text of chapter 2 & <more>.", text)
+        edited, unchanged = self.part(0), stat(self.part(2))
+
+        # Only the edited chapter is rendered again, the others are copied as they are
+        self.chapters[0]["subsections"][0]["paragraphs"][0] = "An edited paragraph."
+        text = self.assertValid(self.build([0]))
+        self.assertIn("An edited paragraph.", text)
+        self.assertIn("Text of chapter 3 & <more>.", text)
+        self.assertEqual(stat(self.part(2)).st_ino, unchanged.st_ino)
+        self.assertEqual(stat(self.part(2)).st_mtime_ns, unchanged.st_mtime_ns)
+        # The part of the previous version of the chapter is dropped
+        self.assertTrue(path.exists(self.part(0)))
+        self.assertFalse(path.exists(edited))
+
+    def test_combined_crc(self) -> None:
+        # The CRC-32 of joined segments is the CRC-32 of their data one after the other
+        rng = Random(0)
+        pieces = [rng.randbytes(rng.choice([0, 1, 7, 4096, 70000])) for _ in range(20)]
+        crc, size, _ = join([compress(piece) for piece in pieces])
+        self.assertEqual(crc, crc32(b"".join(pieces)))
+        self.assertEqual(size, sum(map(len, pieces)))
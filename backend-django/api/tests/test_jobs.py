@@ -0,0 +1,179 @@
+from datetime import timedelta
+from glob import glob
+from os import remove
+from threading import Barrier, Event, Thread
+from time import sleep
+from unittest.mock import patch
+from django.db import connections
+from django.test import TransactionTestCase, override_settings
+from django.utils import timezone
+
+
+from model.client import set_client
+from base.models import BookJob
+from api.checkpoints import Checkpoints
+from api.jobs import (
+    check_stale_jobs,
+    claim_job,
+    enqueue_book,
+    requeue_stale_jobs,
+    resume_job,
+    run_job,
+    work,
+)
+from .fakes import book_request, fake_client
+
+
+# The jobs are run by threads (the stages of the pipeline, the workers), which only
+# see what is committed
+class JobTests(TransactionTestCase):
+    def setUp(self) -> None:
+        self.fake, self.client = fake_client()
+        set_client(self.client)
+
+    def tearDown(self) -> None:
+        set_client(None)
+        self.client.http.close()
+        self.fake.stop()
+        for file in glob("media/covers/test-book*"):
+            remove(file)
+
+    def test_resume_after_failed_unit(self) -> None:
+        # The subsections of the second chapter fail (4 chapters of 3 subsections)
+        self.client.failing = ('chapter: "Chapter 2:',)
+        job = enqueue_book(book_request())
+        with self.assertLogs("aiscript", "ERROR") as logs:
+            run_job(claim_job("worker-1"))
+        self.assertIn('"event": "job_failed"', logs.output[-1])
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, BookJob.Status.FAILED)
+        self.assertIn("Injected failure", job.error)
+        checkpoints = Checkpoints(job)
+        self.assertIsNotNone(checkpoints.get("outline"))
+        self.assertIsNotNone(checkpoints.get("cover"))
+        completed = checkpoints.units("subsection")
+        self.assertEqual(sorted(completed), [0, 1, 2, 6, 7, 8, 9, 10, 11])
+
+        # Resumed, only the failed subsections are generated again
+        self.client.failing = ()
+        sent = len(self.client.prompts)
+        self.assertTrue(resume_job(job))
+        self.assertFalse(resume_job(job))
+        with self.assertLogs("aiscript", "INFO") as logs:
+            run_job(claim_job("worker-2"))
+        self.assertIn('"event": "job_done"', logs.output[-1])
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, BookJob.Status.DONE)
+        self.assertEqual(job.attempts, 2)
+        prompts = self.client.prompts[sent:]
+        self.assertEqual(len(prompts), 3)
+        self.assertTrue(all('chapter: "Chapter 2:' in prompt for prompt in prompts))
+
+        # The book has the subsections of both runs, the checkpoints are gone
+        paragraphs = [
+            subsection["paragraphs"]
+            for chapter in job.book.content
+            for subsection in chapter["subsections"]
+        ]
+        self.assertEqual(len(paragraphs), 12)
+        for index, unit in completed.items():
+            self.assertEqual(paragraphs[index], unit)
+        self.assertFalse(job.checkpoints.exists())
+
+    def test_claimed_once(self) -> None:
+        job = enqueue_book(book_request())
+        workers = 8
+        start = Barrier(workers)
+        claimed = []
+
+        def claim(worker: str) -> None:
+            start.wait()
+            try:
+                if claim_job(worker) is not None:
+                    claimed.append(worker)
+            finally:
+                connections.close_all()
+
+        threads = [Thread(target=claim, args=(f"worker-{n}",)) for n in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(claimed), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, BookJob.Status.RUNNING)
+        self.assertEqual(job.worker, claimed[0])
+        self.assertEqual(job.attempts, 1)
+        self.assertIsNone(claim_job("worker-late"))
+
+    @override_settings(BOOK_JOB_STALE_AFTER=60, BOOK_JOB_MAX_ATTEMPTS=2)
+    def test_requeue_stale_jobs(self) -> None:
+        stale, exhausted, alive = (enqueue_book(book_request()) for _ in range(3))
+        for _ in range(3):
+            claim_job("worker-1")
+        BookJob.objects.filter(id=exhausted.id).update(attempts=2)
+        BookJob.objects.filter(id__in=[stale.id, exhausted.id]).update(
+            updated_at=timezone.now() - timedelta(seconds=120)
+        )
+
+        self.assertEqual(requeue_stale_jobs(), 2)
+        for job in (stale, exhausted, alive):
+            job.refresh_from_db()
+        self.assertEqual(stale.status, BookJob.Status.PENDING)
+        self.assertEqual(stale.worker, "")
+        self.assertEqual(exhausted.status, BookJob.Status.FAILED)
+        self.assertEqual(alive.status, BookJob.Status.RUNNING)
+
+        # The requeued job is claimed again, on its next attempt
+        job = claim_job("worker-2")
+        self.assertEqual((job.id, job.attempts), (stale.id, 2))
+
+    def make_stale(self, job: BookJob) -> None:
+        BookJob.objects.filter(id=job.id).update(
+            updated_at=timezone.now() - timedelta(seconds=120)
+        )
+
+    @override_settings(BOOK_JOB_STALE_AFTER=60)
+    @patch("api.jobs._stale_checked_at", None)
+    def test_stale_jobs_checked_every_half_period(self) -> None:
+        first, second = enqueue_book(book_request()), enqueue_book(book_request())
+        logs = self.assertLogs("aiscript", "WARNING")
+        with patch("api.jobs.monotonic") as clock, logs:
+            claim_job("worker-1")
+            self.make_stale(first)
+            clock.return_value = 1000
+            self.assertEqual(check_stale_jobs(), 1)
+
+            claim_job("worker-1")
+            claim_job("worker-1")
+            self.make_stale(second)
+            clock.return_value = 1029
+            self.assertEqual(check_stale_jobs(), 0)
+            clock.return_value = 1031
+            self.assertEqual(check_stale_jobs(), 1)
+
+    @override_settings(BOOK_JOB_STALE_AFTER=60, BOOK_JOB_POLL_INTERVAL=0.05)
+    @patch("api.jobs._stale_checked_at", None)
+    def test_worker_picks_up_stale_job(self) -> None:
+        # A worker crashed with the job, another one that keeps running takes it over
+        job = enqueue_book(book_request())
+        claim_job("crashed-worker")
+        self.make_stale(job)
+
+        stop = Event()
+        worker = Thread(target=work, args=("worker-2", stop))
+        with self.assertLogs("aiscript", "INFO"):
+            worker.start()
+            for _ in range(200):
+                job.refresh_from_db()
+                if job.status == BookJob.Status.DONE:
+                    break
+                sleep(0.05)
+            stop.set()
+            worker.join()
+
+        self.assertEqual(job.status, BookJob.Status.DONE)
+        self.assertEqual((job.worker, job.attempts), ("worker-2", 2))
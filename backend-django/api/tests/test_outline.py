@@ -0,0 +1,49 @@
+from django.test import SimpleTestCase
+
+
+from model.book_generator import BookGenerator
+from model.outline_parser import parse_outline
+from .fakes import book_request, fake_client
+
+
+class StreamedOutlineTests(SimpleTestCase):
+    # The outline streamed by the fake API in chunks of a word, so that the titles and
+    # their quotes are split across chunks, goes through the client and the parser
+    def setUp(self) -> None:
+        self.fake, self.client = fake_client()
+
+    def tearDown(self) -> None:
+        self.client.http.close()
+        self.fake.stop()
+
+    def test_chapters_split_across_chunks(self) -> None:
+        generator = BookGenerator(book_request(), client=self.client)
+        received = []
+        generator.generate_table_of_contents(
+            on_chapter=lambda chapter: received.append(len(self.client.chunks))
+        )
+
+        # The titles do not come in one chunk each
+        self.assertGreater(len(self.client.chunks), 20)
+        self.assertTrue(any(chunk.count('"') % 2 for chunk in self.client.chunks))
+
+        # Every chapter, as the whole response parses
+        outline = parse_outline("".join(self.client.chunks))
+        self.assertEqual(
+            [chapter["chapter"] for chapter in generator.book["table_of_contents"]],
+            list(outline),
+        )
+        for c, chapter in enumerate(generator.book["table_of_contents"], 1):
+            self.assertEqual(
+                chapter["subsections"],
+                [
+                    f"{c}.{s} {subsection}"
+                    for s, subsection in enumerate(outline[chapter["chapter"]], 1)
+                ],
+            )
+
+        # Handed over as soon as complete, before the end of the stream
+        self.assertEqual(len(received), 4)
+        self.assertLess(received[0], len(self.client.chunks))
+        self.assertEqual(received, sorted(received))
+        self.assertEqual(self.fake.stats["requests"], 1)
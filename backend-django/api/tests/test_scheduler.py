@@ -0,0 +1,54 @@
+from threading import Event
+from django.test import SimpleTestCase
+from openai import InternalServerError
+
+
+from model.book_generator import BookGenerator
+from model.throttle import Backpressure
+from api.scheduler import StageScheduler
+from .fakes import book_request, fake_client
+
+
+class StageFailureTests(SimpleTestCase):
+    # A stage failing on the API (every request of the fake fails) stops the pipeline
+    def setUp(self) -> None:
+        self.fake, self.client = fake_client(error_rate=1.0)
+        # No retries, the first error fails the call
+        self.client.backpressure = Backpressure(max_retries=0)
+
+    def tearDown(self) -> None:
+        self.client.http.close()
+        self.fake.stop()
+
+    def test_failure_propagates(self) -> None:
+        generator = BookGenerator(book_request(), client=self.client)
+        cover_started = Event()
+        started, done = [], []
+
+        def cover() -> str:
+            cover_started.set()
+            return "cover.png"
+
+        def outline() -> None:
+            # The independent stage runs alongside the failing one
+            cover_started.wait(5)
+            generator.generate_table_of_contents()
+
+        scheduler = StageScheduler(
+            on_start=started.append, on_done=lambda name, _: done.append(name)
+        )
+        scheduler.add("outline", outline)
+        scheduler.add("cover", cover)
+        scheduler.add("chapters", generator.generate_chapters, after=("outline",))
+
+        with self.assertRaises(InternalServerError):
+            scheduler.run()
+
+        # The stages after the failed one never start, the others finish
+        self.assertCountEqual(started, ["outline", "cover"])
+        self.assertEqual(done, ["cover"])
+        self.assertEqual(scheduler.results, {"cover": "cover.png"})
+        self.assertCountEqual(
+            [entry["stage"] for entry in scheduler.trace], ["outline", "cover"]
+        )
+        self.assertEqual(self.fake.stats["errors"], 1)
@@ -0,0 +1,54 @@
+from django.test import TestCase
+
+
+from .fakes import create_book
+
+
+class BookSearchTests(TestCase):
+    # Ranked full-text search of the books, its index kept in sync by the database
+    def setUp(self) -> None:
+        # The term is in the title of one book and in the text of the other
+        self.in_text = create_book(
+            "in-text", paragraphs=["Keep the <b>lighthouse</b> & the harbour lit."]
+        )
+        self.in_title = create_book("in-title", title="The Lighthouse Keeper")
+
+    def search(self, query: str) -> list:
+        response = self.client.get("/book-search/", {"q": query})
+        self.assertEqual(response.status_code, 200)
+        return response.json()["results"]
+
+    def test_ranking_and_snippet(self) -> None:
+        results = self.search("lighthouse")
+
+        # The title weighs more than the text
+        self.assertEqual(
+            [book["id"] for book in results], [self.in_title.id, self.in_text.id]
+        )
+        self.assertGreater(results[0]["score"], results[1]["score"])
+
+        # The text is escaped, the matches marked
+        self.assertIn(
+            "&lt;b&gt;<mark>lighthouse</mark>&lt;/b&gt; &amp; the harbour",
+            results[1]["snippet"],
+        )
+
+    def test_index_follows_section_update(self) -> None:
+        response = self.client.patch(
+            f"/section-update/{self.in_text.id}/1/1/",
+            {"subsection": "Beacons", "paragraphs": ["A paragraph about beacons."]},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(
+            [book["id"] for book in self.search("lighthouse")], [self.in_title.id]
+        )
+        self.assertEqual(
+            [book["id"] for book in self.search("beacons")], [self.in_text.id]
+        )
+
+    def test_query_syntax_is_plain_words(self) -> None:
+        # FTS5 operators typed by a user are matched as words, not parsed
+        self.assertEqual(self.search('lighthouse" OR NEAR(harbour'), [])
+        self.assertEqual(self.client.get("/book-search/").status_code, 400)
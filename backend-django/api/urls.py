@@ -9,10 +9,37 @@ from . import views
 urlpatterns = [
     path("", views.ApiOverview, name="api-overview"),
     path("book-list/", views.BookList, name="book-list"),
+    path("book-search/", views.BookSearch, name="book-search"),
+    path("book-similar/", views.BookSimilar, name="book-similar"),
     path("book-detail/<int:pk>/", views.BookDetail, name="book-detail"),
     path("book-create/", views.BookCreate, name="book-create"),
+    path(
+        "book-create-stream/", views.BookCreateStream, name="book-create-stream"
+    ),
+    path("book-create-bulk/", views.BookCreateBulk, name="book-create-bulk"),
     path("book-update/<int:pk>/", views.BookUpdate, name="book-update"),
     path("book-delete/<int:pk>/", views.BookDelete, name="book-delete"),
+    path(
+        "book-export/<int:pk>/<str:format>/", views.BookExport, name="book-export"
+    ),
+    path(
+        "section-detail/<int:pk>/<int:chapter>/<int:subsection>/",
+        views.SectionDetail,
+        name="section-detail",
+    ),
+    path(
+        "section-update/<int:pk>/<int:chapter>/<int:subsection>/",
+        views.SectionUpdate,
+        name="section-update",
+    ),
+    path("job-list/", views.JobList, name="job-list"),
+    path("job-detail/<int:pk>/", views.JobDetail, name="job-detail"),
+    path("job-resume/<int:pk>/", views.JobResume, name="job-resume"),
+    path("metrics", views.Metrics, name="metrics"),
+    # The files of the books are rendered when they are first requested, the other
+    # media are served as they are
+    path("media/docs/<str:name>.docx", views.BookDocument, name="book-document"),
+    path("media/pdfs/<str:name>.pdf", views.BookPdf, name="book-pdf"),
 ]
 
 urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
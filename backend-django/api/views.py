@@ -1,48 +1,222 @@
+from datetime import datetime
+from hashlib import sha256
+from json import loads
 from rest_framework.response import Response
 from rest_framework.request import Request
 from rest_framework.decorators import api_view
 from rest_framework import status
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Count, Max
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpRequest,
+    HttpResponse,
+    HttpResponseBadRequest,
+    StreamingHttpResponse,
+)
 from django.shortcuts import get_object_or_404
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition, require_GET, require_POST
+from prometheus_client import CONTENT_TYPE_LATEST
 
 
-from model.book_generator import BookGenerator
-from model.cover_generator import CoverGenerator
-from model.document_generator import DocumentGenerator
-
-
-from base.models import Book
-from .serializers import BookSerializer
+from model.metrics import event
+from model.pdf_converter import ConversionError
+from model.renderers import RENDERERS
+from base.models import BOOK_TEXT, Book, BookJob, Subsection
+from .serializers import (
+    BookSerializer,
+    BookCreateSerializer,
+    BookListSerializer,
+    BookSearchSerializer,
+    BookSimilarSerializer,
+    BookJobSerializer,
+    BookJobListSerializer,
+    SectionSerializer,
+)
+from .pagination import (
+    BookCursorPagination,
+    BookSearchPagination,
+    JobCursorPagination,
+)
+from .search import search_books
+from .similarity import similar_books
 from .dtos import BookCreateDto
+from .jobs import enqueue_book, start_job, resume_job, run_job
+from .bulk import create_books
+from .events import EventStream
+from .exports import book_docx, book_pdf, export_book
+from .metrics import render_metrics
 
 
 @api_view(["GET"])
 def ApiOverview(_: Request) -> Response:
     # This is the API overview
     api_urls = {
-        "List": "/book-list/",
+        "List": "/book-list/?fields=<field,...>&page_size=<int>&cursor=<cursor>",
+        "Search": "/book-search/?q=<query>&fields=<field,...>&page_size=<int>&page=<int>",
+        "Similar": "/book-similar/?title=<str>&topic=<str>&target_audience=<str>&k=<int>",
         "Detail View": "/book-detail/<int:pk>/",
         "Create": "/book-create/",
+        "Create (Server-Sent Events)": "/book-create-stream/",
+        "Create in bulk (Server-Sent Events)": "/book-create-bulk/",
         "Update": "/book-update/<int:pk>/",
         "Delete": "/book-delete/<int:pk>/",
+        "Export": f"/book-export/<int:pk>/<{'|'.join(RENDERERS)}>/",
+        "Section Detail View": "/section-detail/<int:pk>/<int:chapter>/<int:subsection>/",
+        "Section Update": "/section-update/<int:pk>/<int:chapter>/<int:subsection>/",
+        "Job List": "/job-list/",
+        "Job Detail View": "/job-detail/<int:pk>/",
+        "Job Resume": "/job-resume/<int:pk>/",
+        "Document": "/media/docs/<str:name>.docx",
+        "PDF": "/media/pdfs/<str:name>.pdf",
         "Static Media": "/media/<path>/",
+        "Metrics (Prometheus)": "/metrics",
     }
     return Response(api_urls)
 
 
+# State of the books a listing depends on: any book created, updated or deleted
+# changes it. Computed once per request for both the ETag and the Last-Modified.
+def book_list_state(req: HttpRequest) -> dict:
+    if not hasattr(req, "book_list_state"):
+        req.book_list_state = Book.objects.aggregate(
+            count=Count("id"), last_id=Max("id"), last_modified=Max("updated_at")
+        )
+    return req.book_list_state
+
+
+def book_list_etag(req: HttpRequest) -> str:
+    state = book_list_state(req)
+    # Every page and projection of the list has its own ETag
+    return sha256(
+        f"{state['count']}:{state['last_id']}:{state['last_modified']}:"
+        f"{req.GET.urlencode()}".encode()
+    ).hexdigest()
+
+
+def book_list_last_modified(req: HttpRequest) -> datetime | None:
+    return book_list_state(req)["last_modified"]
+
+
+def book_last_modified(req: HttpRequest, pk: int) -> datetime | None:
+    if not hasattr(req, "book_last_modified"):
+        req.book_last_modified = (
+            Book.objects.filter(id=pk).values_list("updated_at", flat=True).first()
+        )
+    return req.book_last_modified
+
+
+def book_etag(req: HttpRequest, pk: int) -> str | None:
+    # Last-Modified only has a precision of a second, the ETag tells apart
+    # the updates made within the same second
+    last_modified = book_last_modified(req, pk)
+    return last_modified and f"{pk}-{last_modified.timestamp()}"
+
+
+@condition(etag_func=book_list_etag, last_modified_func=book_list_last_modified)
+@api_view(["GET"])
+def BookList(req: Request) -> Response:
+    # Only serialize the requested fields (?fields=id,title,covers), all by default
+    fields = req.query_params.get("fields")
+    if fields is not None:
+        fields = [field for field in fields.split(",") if field]
+        unknown = set(fields) - set(BookListSerializer().fields)
+        if unknown:
+            return Response(
+                {"fields": f"Unknown fields: {', '.join(sorted(unknown))}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+    # Only load the columns needed by these fields, never the text of the books
+    columns = {
+        "cover" if field == "covers" else field
+        for field in fields or BookListSerializer().fields
+    }
+    books = Book.objects.only("id", *columns)
+
+    # Serialize a page of the books and return it with the cursors of its neighbours
+    paginator = BookCursorPagination()
+    page = paginator.paginate_queryset(books, req)
+    serializer = BookListSerializer(page, many=True, fields=fields)
+    return paginator.get_paginated_response(serializer.data)
+
+
+@api_view(["GET"])
+def BookSearch(req: Request) -> Response:
+    # Search the title, topic, table of contents and text of the books (?q=...)
+    query = req.query_params.get("q", "").strip()
+    if not query:
+        return Response(status=status.HTTP_400_BAD_REQUEST)
+
+    # Only serialize the requested fields, the score and snippet are always returned
+    fields = req.query_params.get("fields")
+    if fields is not None:
+        fields = [field for field in fields.split(",") if field]
+        unknown = set(fields) - set(BookListSerializer().fields)
+        if unknown:
+            return Response(
+                {"fields": f"Unknown fields: {', '.join(sorted(unknown))}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        fields += ["score", "snippet"]
+
+    # Rank a page of the books, then load them without their text
+    paginator = BookSearchPagination()
+    hits = paginator.paginate_queryset(search_books(query), req)
+    books = Book.objects.in_bulk([hit["book"] for hit in hits])
+
+    # Books deleted since they were ranked are skipped
+    results = []
+    for hit in hits:
+        if hit["book"] in books:
+            book = books[hit["book"]]
+            book.score, book.snippet = hit["score"], hit["snippet"]
+            results.append(book)
+
+    serializer = BookSearchSerializer(results, many=True, fields=fields)
+    return paginator.get_paginated_response(serializer.data)
+
+
 @api_view(["GET"])
-def BookList(_: Request) -> Response:
-    # Get all the books from the database
-    books = Book.objects.all()
+def BookSimilar(req: Request) -> Response:
+    # The existing books closest to a book request, offered before creating it
+    title = req.query_params.get("title", "")
+    topic = req.query_params.get("topic", "")
+    target_audience = req.query_params.get("target_audience", "")
+    if not (title or topic):
+        return Response(status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        k = int(req.query_params.get("k", settings.BOOK_SIMILARITY_TOP_K))
+        k = max(1, min(k, 100))
+    except ValueError:
+        return Response(status=status.HTTP_400_BAD_REQUEST)
+
+    # Load the books without their text, in the order of their similarity
+    # (the index may lag behind the latest books while it is rebuilt)
+    hits = similar_books(title, topic, target_audience, k, wait=False)
+    books = Book.objects.in_bulk([book for book, _ in hits])
+
+    results = []
+    for book_id, score in hits:
+        if book_id in books:
+            book = books[book_id]
+            book.score = round(score, 3)
+            book.reusable = score >= settings.BOOK_SIMILARITY_THRESHOLD
+            results.append(book)
 
-    # Serialize the data and return it
-    serializer = BookSerializer(books, many=True)
+    serializer = BookSimilarSerializer(results, many=True)
     return Response(serializer.data)
 
 
+@condition(etag_func=book_etag, last_modified_func=book_last_modified)
 @api_view(["GET"])
 def BookDetail(_: Request, pk: int) -> Response:
-    # Get the book by its ID or raise a 404 error
-    book = get_object_or_404(Book, id=pk)
+    # Get the book with its text by its ID or raise a 404 error
+    book = get_object_or_404(Book.objects.prefetch_related(BOOK_TEXT), id=pk)
 
     # If the book exists, serialize the data and return it
     serializer = BookSerializer(book, many=False)
@@ -51,40 +225,122 @@ def BookDetail(_: Request, pk: int) -> Response:
 
 @api_view(["POST"])
 def BookCreate(req: Request) -> Response:
-    try:
-        # Create a new book instance
-        book = BookGenerator(BookCreateDto(req.data))
-    except KeyError:
+    # Validate the request data against the fields of the book, before anything is
+    # generated
+    serializer = BookCreateSerializer(data=req.data)
+    if not serializer.is_valid():
         return Response(status=status.HTTP_400_BAD_REQUEST)
+    data = BookCreateDto(serializer.validated_data)
 
-    # Generate the table of contents
-    book.generate_table_of_contents()
+    # Queue the generation, the workers run the pipeline in the background
+    job = enqueue_book(data)
 
-    # Generate the chapters and content
-    book.generate_chapters()
+    # Return the job so the client can poll its status
+    serializer = BookJobSerializer(job, many=False)
+    return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
 
-    # Generate the cover
-    cover = CoverGenerator(book.book)
-    book.book["cover"] = cover.generate_cover()
 
-    # Generate the document
-    document = DocumentGenerator(book.book)
-    document.generate_cover_page()
-    document.generate_document()
+@csrf_exempt
+@require_POST
+async def BookCreateStream(req: HttpRequest) -> StreamingHttpResponse:
+    try:
+        # Validate the request data against the fields of the book
+        serializer = BookCreateSerializer(data=loads(req.body))
+    except ValueError:
+        return HttpResponseBadRequest()
+    if not serializer.is_valid():
+        return HttpResponseBadRequest()
+    data = BookCreateDto(serializer.validated_data)
 
-    # Generate the PDF
-    document.generate_pdf()
+    stream = EventStream()
 
-    # Serialize the data
-    serializer = BookSerializer(data=book.book)
+    def generate() -> None:
+        try:
+            # Track the generation as a job, so that it can be resumed if it fails
+            job = start_job(data, worker="stream")
+            stream.emit("job", {"id": job.id})
 
-    # If the data is valid, save it and return the data
-    if serializer.is_valid():
-        serializer.save()
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+            # Run the pipeline, pushing every stage result to the stream
+            run_job(
+                job,
+                on_event=lambda event, payload: stream.emit(
+                    event, {"job": job.id, **payload}
+                ),
+            )
 
-    # If the data is not valid, return a 400 status code
-    return Response(status=status.HTTP_400_BAD_REQUEST)
+            if job.status == BookJob.Status.DONE:
+                stream.emit("book", BookSerializer(job.book, many=False).data)
+            else:
+                stream.emit("error", {"job": job.id, "detail": job.error})
+        except Exception as e:
+            stream.emit("error", {"detail": str(e)})
+        finally:
+            close_old_connections()
+            stream.close()
+
+    # Generate in a worker thread so that the event loop is never blocked
+    stream.start(generate)
+
+    response = StreamingHttpResponse(stream, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+@csrf_exempt
+@require_POST
+async def BookCreateBulk(req: HttpRequest) -> StreamingHttpResponse:
+    try:
+        # Validate the list of books, a single invalid one rejects the request
+        payloads = loads(req.body)
+    except ValueError:
+        return HttpResponseBadRequest()
+    if not isinstance(payloads, list) or not (
+        0 < len(payloads) <= settings.BOOK_BULK_MAX_BOOKS
+    ):
+        return HttpResponseBadRequest()
+    serializer = BookCreateSerializer(data=payloads, many=True)
+    if not serializer.is_valid():
+        return HttpResponseBadRequest()
+    requests = [BookCreateDto(payload) for payload in serializer.validated_data]
+
+    stream = EventStream()
+
+    # Every event names the book by its position in the request
+    def on_job(index: int, job: BookJob) -> None:
+        stream.emit("job", {"index": index, "id": job.id})
+
+    def on_result(index: int, job: BookJob) -> None:
+        if job.status == BookJob.Status.DONE:
+            book = Book.objects.prefetch_related(BOOK_TEXT).get(id=job.book_id)
+            stream.emit(
+                "book",
+                {
+                    "index": index,
+                    "job": job.id,
+                    "book": BookSerializer(book, many=False).data,
+                },
+            )
+        else:
+            stream.emit("error", {"index": index, "job": job.id, "detail": job.error})
+
+    def generate() -> None:
+        try:
+            # The books are generated by the shared pool, in the order they complete
+            create_books(requests, on_job, on_result)
+        except Exception as e:
+            stream.emit("error", {"detail": str(e)})
+        finally:
+            close_old_connections()
+            stream.close()
+
+    # Wait for the books in a worker thread so that the event loop is never blocked
+    stream.start(generate)
+
+    response = StreamingHttpResponse(stream, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
 
 
 @api_view(["PUT"])
@@ -95,10 +351,12 @@ def BookUpdate(req: Request, pk: int) -> Response:
     # Serialize the data
     serializer = BookSerializer(instance=book, data=req.data)
 
-    # If the data is valid, save it and return the data
+    # If the data is valid, save it and return the data, with the text read back in
+    # 3 queries (not one per chapter and subsection)
     if serializer.is_valid():
         serializer.save()
-        return Response(serializer.data)
+        book = Book.objects.prefetch_related(BOOK_TEXT).get(id=pk)
+        return Response(BookSerializer(book, many=False).data)
 
     # If the data is not valid, return a 400 status code
     return Response(status=status.HTTP_400_BAD_REQUEST)
@@ -112,3 +370,133 @@ def BookDelete(_: Request, pk: int) -> Response:
     # Delete the book and return a 204 status code
     book.delete()
     return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+def get_section(pk: int, chapter: int, subsection: int) -> Subsection:
+    # Get a subsection by its number in the book (2/3 for 2.3) or raise a 404 error
+    return get_object_or_404(
+        Subsection.objects.select_related("chapter"),
+        chapter__book_id=pk,
+        chapter__position=chapter - 1,
+        position=subsection - 1,
+    )
+
+
+@require_GET
+def BookExport(_: HttpRequest, pk: int, format: str) -> FileResponse:
+    # Not a DRF view, the file is returned whatever the client accepts
+    if format not in RENDERERS:
+        raise Http404(f"Unknown format: {format}")
+
+    # Get the book by its ID or raise a 404 error, then render it if needed
+    book = get_object_or_404(Book, id=pk)
+    renderer = RENDERERS[format]
+    return FileResponse(
+        open(export_book(book, format), "rb"),
+        content_type=renderer.content_type,
+        # Pages are shown, the other formats downloaded
+        as_attachment=format != "html",
+        filename=f"{book.title}.{renderer.extension}",
+    )
+
+
+def get_named_book(name: str) -> Book:
+    # Get the book whose files have this name (the latest one) or raise a 404 error
+    book = Book.objects.filter(name=name).order_by("-id").first()
+    if book is None:
+        raise Http404(f"No book named {name}")
+    return book
+
+
+@require_GET
+def BookDocument(_: HttpRequest, name: str) -> FileResponse:
+    # Rendered from the text of the book on the first request, and after every update
+    book = get_named_book(name)
+    return FileResponse(
+        open(book_docx(book), "rb"),
+        content_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    )
+
+
+@require_GET
+def BookPdf(_: HttpRequest, name: str) -> HttpResponse:
+    book = get_named_book(name)
+    try:
+        pdf = book_pdf(book)
+    except ConversionError as e:
+        # The converter is down or busy, the next request tries again
+        event("pdf_conversion_failed", book=book.id, error=str(e))
+        return HttpResponse(status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    return FileResponse(open(pdf, "rb"), content_type="application/pdf")
+
+
+@api_view(["GET"])
+def SectionDetail(_: Request, pk: int, chapter: int, subsection: int) -> Response:
+    section = get_section(pk, chapter, subsection)
+
+    # Serialize the subsection and its paragraphs only, not the whole book
+    serializer = SectionSerializer(section, many=False)
+    return Response(serializer.data)
+
+
+@api_view(["PATCH"])
+def SectionUpdate(req: Request, pk: int, chapter: int, subsection: int) -> Response:
+    section = get_section(pk, chapter, subsection)
+
+    # Serialize the data, the title and the paragraphs can be updated separately
+    serializer = SectionSerializer(instance=section, data=req.data, partial=True)
+
+    # If the data is valid, save it and return the data
+    if serializer.is_valid():
+        serializer.save()
+        return Response(serializer.data)
+
+    # If the data is not valid, return a 400 status code
+    return Response(status=status.HTTP_400_BAD_REQUEST)
+
+
+@api_view(["GET"])
+def JobList(req: Request) -> Response:
+    # The jobs, the most recent first, with the id and name of their book but not its
+    # text, which only the detail of a job has
+    jobs = BookJob.objects.select_related("book")
+
+    # Serialize a page of the jobs and return it with the cursors of its neighbours
+    paginator = JobCursorPagination()
+    page = paginator.paginate_queryset(jobs, req)
+    serializer = BookJobListSerializer(page, many=True)
+    return paginator.get_paginated_response(serializer.data)
+
+
+@api_view(["GET"])
+def JobDetail(_: Request, pk: int) -> Response:
+    # Get the job by its ID or raise a 404 error
+    job = get_object_or_404(
+        BookJob.objects.select_related("book").prefetch_related(f"book__{BOOK_TEXT}"),
+        id=pk,
+    )
+
+    # Serialize the data (including the book once it is generated) and return it
+    serializer = BookJobSerializer(job, many=False)
+    return Response(serializer.data)
+
+
+@api_view(["POST"])
+def JobResume(_: Request, pk: int) -> Response:
+    # Get the job by its ID or raise a 404 error
+    job = get_object_or_404(BookJob, id=pk)
+
+    # Only failed jobs can be resumed, the others are still running or done
+    if not resume_job(job):
+        return Response(status=status.HTTP_409_CONFLICT)
+
+    # Return the queued job, it restarts from its last completed unit
+    job.refresh_from_db()
+    serializer = BookJobSerializer(job, many=False)
+    return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
+
+@require_GET
+def Metrics(_: HttpRequest) -> HttpResponse:
+    # Prometheus text format, not a DRF view so that no content negotiation happens
+    return HttpResponse(render_metrics(), content_type=CONTENT_TYPE_LATEST)
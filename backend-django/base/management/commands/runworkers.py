@@ -0,0 +1,58 @@
+from socket import gethostname
+from os import getpid
+from threading import Event, Thread
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+from api.jobs import check_stale_jobs, work
+from model.pdf_converter import get_converter
+
+
+class Command(BaseCommand):
+    help = "Runs a pool of workers that process the queued book generation jobs"
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=settings.BOOK_JOB_WORKERS,
+            help="Number of jobs processed concurrently",
+        )
+
+    def handle(self, *args, **options) -> None:
+        # Put back the jobs abandoned by workers that died mid-generation, the workers
+        # check again as they poll
+        requeued = check_stale_jobs()
+        if requeued:
+            self.stdout.write(f"Recovered {requeued} stale job(s)")
+
+        # Start the PDF converters now, they are warm when the first book needs them
+        converter = get_converter()
+        self.stdout.write(
+            f"Started {converter.stats()['workers']} {converter.backend} PDF worker(s)"
+        )
+
+        stop = Event()
+        threads = [
+            Thread(
+                target=work,
+                args=(f"{gethostname()}:{getpid()}:{i}", stop),
+                name=f"book-worker-{i}",
+            )
+            for i in range(options["workers"])
+        ]
+
+        for thread in threads:
+            thread.start()
+        self.stdout.write(f"Started {len(threads)} book worker(s)")
+
+        try:
+            for thread in threads:
+                thread.join()
+        except KeyboardInterrupt:
+            # Let the running jobs finish before exiting
+            self.stdout.write("Stopping workers, waiting for running jobs...")
+            stop.set()
+            for thread in threads:
+                thread.join()
@@ -0,0 +1,29 @@
+# Generated by Django 5.0.2 on 2026-10-18 04:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0002_bookjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stage', models.CharField(max_length=20)),
+                ('unit', models.IntegerField(default=0)),
+                ('data', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoints', to='base.bookjob')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='bookcheckpoint',
+            constraint=models.UniqueConstraint(fields=('job', 'stage', 'unit'), name='unique_checkpoint_unit'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-18 04:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0003_bookcheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bookjob',
+            name='trace',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-18 04:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0004_bookjob_trace'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='book',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.0.2 on 2026-10-18 04:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0005_book_updated_at_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Chapter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.IntegerField()),
+                ('title', models.TextField()),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chapters', to='base.book')),
+            ],
+            options={
+                'ordering': ['position'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Subsection',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.IntegerField()),
+                ('title', models.TextField()),
+                ('chapter', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='subsections', to='base.chapter')),
+            ],
+            options={
+                'ordering': ['position'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Paragraph',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.IntegerField()),
+                ('text', models.TextField()),
+                ('subsection', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='paragraphs', to='base.subsection')),
+            ],
+            options={
+                'ordering': ['position'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='chapter',
+            constraint=models.UniqueConstraint(fields=('book', 'position'), name='unique_chapter_position'),
+        ),
+        migrations.AddConstraint(
+            model_name='subsection',
+            constraint=models.UniqueConstraint(fields=('chapter', 'position'), name='unique_subsection_position'),
+        ),
+        migrations.AddConstraint(
+            model_name='paragraph',
+            constraint=models.UniqueConstraint(fields=('subsection', 'position'), name='unique_paragraph_position'),
+        ),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 5.0.2 on 2026-10-18 04:41
+
+from django.db import migrations
+
+
+# Split the text of every book into chapters, subsections and paragraphs
+def split_content(apps, schema_editor):
+    Book = apps.get_model('base', 'Book')
+    Chapter = apps.get_model('base', 'Chapter')
+    Subsection = apps.get_model('base', 'Subsection')
+    Paragraph = apps.get_model('base', 'Paragraph')
+
+    for book in Book.objects.only('id', 'content').iterator(chunk_size=100):
+        content = book.content or []
+
+        # One insert per level and per book
+        chapters = Chapter.objects.bulk_create(
+            Chapter(book=book, position=c, title=chapter['chapter'])
+            for c, chapter in enumerate(content)
+        )
+        entries = [
+            (chapter_row, s, subsection)
+            for chapter_row, chapter in zip(chapters, content)
+            for s, subsection in enumerate(chapter['subsections'])
+        ]
+        subsections = Subsection.objects.bulk_create(
+            Subsection(chapter=chapter_row, position=s, title=subsection['subsection'])
+            for chapter_row, s, subsection in entries
+        )
+        Paragraph.objects.bulk_create(
+            Paragraph(subsection=subsection_row, position=p, text=text)
+            for subsection_row, (_, _, subsection) in zip(subsections, entries)
+            for p, text in enumerate(subsection['paragraphs'])
+        )
+
+
+# Join the chapters, subsections and paragraphs back into the JSON fields
+def join_content(apps, schema_editor):
+    Book = apps.get_model('base', 'Book')
+    Chapter = apps.get_model('base', 'Chapter')
+
+    for book in Book.objects.prefetch_related('chapters__subsections__paragraphs'):
+        chapters = book.chapters.all()
+        book.table_of_contents = [
+            {
+                'chapter': chapter.title,
+                'subsections': [s.title for s in chapter.subsections.all()],
+            }
+            for chapter in chapters
+        ]
+        book.content = [
+            {
+                'chapter': chapter.title,
+                'subsections': [
+                    {
+                        'subsection': s.title,
+                        'paragraphs': [p.text for p in s.paragraphs.all()],
+                    }
+                    for s in chapter.subsections.all()
+                ],
+            }
+            for chapter in chapters
+        ]
+        book.save(update_fields=['table_of_contents', 'content'])
+
+    Chapter.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0006_chapter_subsection_paragraph'),
+    ]
+
+    operations = [
+        migrations.RunPython(split_content, join_content),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.0.2 on 2026-10-18 04:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0007_split_book_content'),
+    ]
+
+    # The defaults let the fields be added back to existing books when reverting
+    operations = [
+        migrations.AlterField(
+            model_name='book',
+            name='table_of_contents',
+            field=models.JSONField(default=list),
+        ),
+        migrations.AlterField(
+            model_name='book',
+            name='content',
+            field=models.JSONField(default=list),
+        ),
+        migrations.RemoveField(
+            model_name='book',
+            name='content',
+        ),
+        migrations.RemoveField(
+            model_name='book',
+            name='table_of_contents',
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.0.2 on 2026-10-18 04:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0008_remove_book_content'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.TextField(blank=True, default='')),
+                ('topic', models.TextField(blank=True, default='')),
+                ('headings', models.TextField(blank=True, default='')),
+                ('text', models.TextField(blank=True, default='')),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_entries', to='base.book')),
+                ('subsection', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='search_entries', to='base.subsection')),
+            ],
+        ),
+    ]
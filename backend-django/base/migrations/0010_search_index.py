@@ -0,0 +1,127 @@
+# Generated by Django 5.0.2 on 2026-10-18 04:45
+
+from django.db import migrations
+
+
+# Full-text index over the search entries, depending on the database:
+# - SQLite: an FTS5 table reading its text from base_searchentry, kept in sync by triggers
+# - PostgreSQL: a weighted tsvector column generated from the entry, with a GIN index
+# The weights rank the title first, then the topic, the headings and the text.
+SQLITE_INDEX = [
+    """
+    CREATE VIRTUAL TABLE base_searchentry_fts USING fts5(
+        title, topic, headings, text,
+        content='base_searchentry', content_rowid='id',
+        tokenize='porter unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER base_searchentry_ai AFTER INSERT ON base_searchentry BEGIN
+        INSERT INTO base_searchentry_fts(rowid, title, topic, headings, text)
+        VALUES (new.id, new.title, new.topic, new.headings, new.text);
+    END
+    """,
+    """
+    CREATE TRIGGER base_searchentry_ad AFTER DELETE ON base_searchentry BEGIN
+        INSERT INTO base_searchentry_fts(base_searchentry_fts, rowid, title, topic, headings, text)
+        VALUES ('delete', old.id, old.title, old.topic, old.headings, old.text);
+    END
+    """,
+    """
+    CREATE TRIGGER base_searchentry_au AFTER UPDATE ON base_searchentry BEGIN
+        INSERT INTO base_searchentry_fts(base_searchentry_fts, rowid, title, topic, headings, text)
+        VALUES ('delete', old.id, old.title, old.topic, old.headings, old.text);
+        INSERT INTO base_searchentry_fts(rowid, title, topic, headings, text)
+        VALUES (new.id, new.title, new.topic, new.headings, new.text);
+    END
+    """,
+    "INSERT INTO base_searchentry_fts(base_searchentry_fts) VALUES ('rebuild')",
+]
+SQLITE_DROP = [
+    "DROP TRIGGER IF EXISTS base_searchentry_au",
+    "DROP TRIGGER IF EXISTS base_searchentry_ad",
+    "DROP TRIGGER IF EXISTS base_searchentry_ai",
+    "DROP TABLE IF EXISTS base_searchentry_fts",
+]
+
+POSTGRESQL_INDEX = [
+    """
+    ALTER TABLE base_searchentry ADD COLUMN document tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', title), 'A')
+        || setweight(to_tsvector('english', topic), 'B')
+        || setweight(to_tsvector('english', headings), 'C')
+        || setweight(to_tsvector('english', text), 'D')
+    ) STORED
+    """,
+    "CREATE INDEX base_searchentry_document ON base_searchentry USING GIN (document)",
+]
+POSTGRESQL_DROP = [
+    "DROP INDEX IF EXISTS base_searchentry_document",
+    "ALTER TABLE base_searchentry DROP COLUMN IF EXISTS document",
+]
+
+
+def create_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    statements = {'sqlite': SQLITE_INDEX, 'postgresql': POSTGRESQL_INDEX}
+    for statement in statements.get(vendor, []):
+        schema_editor.execute(statement)
+
+
+def drop_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    statements = {'sqlite': SQLITE_DROP, 'postgresql': POSTGRESQL_DROP}
+    for statement in statements.get(vendor, []):
+        schema_editor.execute(statement)
+
+
+# Index the books created before the search
+def index_books(apps, schema_editor):
+    Book = apps.get_model('base', 'Book')
+    SearchEntry = apps.get_model('base', 'SearchEntry')
+
+    books = Book.objects.prefetch_related('chapters__subsections__paragraphs')
+    for book in books.iterator(chunk_size=100):
+        chapters = book.chapters.all()
+        entries = [
+            SearchEntry(
+                book=book,
+                title=book.title,
+                topic=book.topic,
+                headings='\n'.join(
+                    title
+                    for chapter in chapters
+                    for title in (
+                        chapter.title,
+                        *(s.title for s in chapter.subsections.all()),
+                    )
+                ),
+            )
+        ]
+        entries += [
+            SearchEntry(
+                book=book,
+                subsection=subsection,
+                headings=f'{chapter.title}\n{subsection.title}',
+                text='\n\n'.join(p.text for p in subsection.paragraphs.all()),
+            )
+            for chapter in chapters
+            for subsection in chapter.subsections.all()
+        ]
+        SearchEntry.objects.bulk_create(entries)
+
+
+def unindex_books(apps, schema_editor):
+    apps.get_model('base', 'SearchEntry').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0009_searchentry'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+        migrations.RunPython(index_books, unindex_books),
+    ]
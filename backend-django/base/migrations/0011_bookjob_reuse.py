@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 04:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0010_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bookjob',
+            name='reuse',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
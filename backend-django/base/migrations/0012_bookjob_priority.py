@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 04:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0011_bookjob_reuse'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bookjob',
+            name='priority',
+            field=models.SmallIntegerField(choices=[(0, 'Interactive'), (1, 'Bulk')], default=0),
+        ),
+    ]
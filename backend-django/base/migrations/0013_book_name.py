@@ -0,0 +1,29 @@
+# Generated by Django 5.1.4 on 2026-10-18 06:12
+
+from django.db import migrations, models
+
+
+# The files of the existing books are named after their cover (media/covers/{name}.png)
+def name_books(apps, schema_editor):
+    Book = apps.get_model('base', 'Book')
+
+    books = list(Book.objects.filter(cover__startswith='media/covers/').only('id', 'cover'))
+    for book in books:
+        book.name = book.cover.removeprefix('media/covers/').rsplit('.', 1)[0]
+    Book.objects.bulk_update(books, ['name'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0012_bookjob_priority'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='name',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=200),
+        ),
+        migrations.RunPython(name_books, migrations.RunPython.noop),
+    ]
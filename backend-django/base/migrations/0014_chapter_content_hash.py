@@ -0,0 +1,61 @@
+# Generated by Django 5.1.4 on 2026-10-18 07:03
+
+from hashlib import sha256
+from json import dumps
+
+from django.db import migrations, models
+
+
+# Frozen copy of base.models.chapter_hash as of this migration
+def chapter_hash(chapter):
+    text = [
+        chapter['chapter'],
+        [[s['subsection'], s['paragraphs']] for s in chapter['subsections']],
+    ]
+    return sha256(dumps(text, ensure_ascii=False).encode()).hexdigest()
+
+
+# Hash the text of the existing chapters, a few hundred at a time
+def hash_chapters(apps, schema_editor):
+    Chapter = apps.get_model('base', 'Chapter')
+    Subsection = apps.get_model('base', 'Subsection')
+    Paragraph = apps.get_model('base', 'Paragraph')
+
+    ids = list(Chapter.objects.order_by('id').values_list('id', flat=True))
+    for start in range(0, len(ids), 500):
+        chapters = {
+            chapter.id: (chapter, {'chapter': chapter.title, 'subsections': []})
+            for chapter in Chapter.objects.filter(id__in=ids[start : start + 500])
+        }
+        subsections = {}
+        for id, chapter, title in Subsection.objects.filter(
+            chapter__in=list(chapters)
+        ).order_by('position').values_list('id', 'chapter_id', 'title'):
+            subsections[id] = {'subsection': title, 'paragraphs': []}
+            chapters[chapter][1]['subsections'].append(subsections[id])
+        for subsection, text in Paragraph.objects.filter(
+            subsection__in=list(subsections)
+        ).order_by('position').values_list('subsection_id', 'text'):
+            subsections[subsection]['paragraphs'].append(text)
+
+        for chapter, content in chapters.values():
+            chapter.content_hash = chapter_hash(content)
+        Chapter.objects.bulk_update(
+            [chapter for chapter, _ in chapters.values()], ['content_hash']
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0013_book_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chapter',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.RunPython(hash_chapters, migrations.RunPython.noop),
+    ]
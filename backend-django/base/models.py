@@ -1,6 +1,11 @@
+from hashlib import sha256
+from json import dumps
 from django.db import models
 
 class Book(models.Model):
+    # Name of the files of the book (media/docs/{name}.docx, media/pdfs/{name}.pdf...),
+    # chosen by the client that created it
+    name = models.CharField(max_length=200, blank=True, default="", db_index=True)
     author = models.CharField(max_length=40)
     title = models.CharField(max_length=50)
     topic = models.CharField(max_length=200)
@@ -8,10 +13,236 @@ class Book(models.Model):
     num_chapters = models.IntegerField()
     num_subsections = models.IntegerField()
     cover = models.CharField(max_length=200)
-    table_of_contents = models.JSONField()
-    content = models.JSONField()
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    # Indexed for the Last-Modified/ETag of the book list
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    def __str__(self):
+        return self.title
+
+    # The text of the book is stored as chapters, subsections and paragraphs, so that
+    # a section is read or edited without loading the rest of the book. These build
+    # back the nested lists of the generator, prefetch `BOOK_TEXT` to read them.
+
+    @property
+    def table_of_contents(self) -> list:
+        return [
+            {
+                "chapter": chapter.title,
+                "subsections": [
+                    subsection.title for subsection in chapter.subsections.all()
+                ],
+            }
+            for chapter in self.chapters.all()
+        ]
+
+    @property
+    def content(self) -> list:
+        return [chapter.content for chapter in self.chapters.all()]
+
+    def set_content(self, content: list) -> list:
+        # Replace the text of the book, in one insert per level. The chapters whose text
+        # did not change (at the same position) are kept as they are, only the others
+        # are written again. Returns the chapters written.
+        hashes = [chapter_hash(chapter) for chapter in content]
+        kept = {
+            position
+            for position, content_hash in self.chapters.values_list(
+                "position", "content_hash"
+            )
+            if position < len(content) and hashes[position] == content_hash
+        }
+        self.chapters.exclude(position__in=kept).delete()
+
+        written = [(c, chapter) for c, chapter in enumerate(content) if c not in kept]
+        chapters = Chapter.objects.bulk_create(
+            Chapter(
+                book=self, position=c, title=chapter["chapter"], content_hash=hashes[c]
+            )
+            for c, chapter in written
+        )
+        entries = [
+            (chapter, s, subsection)
+            for chapter, (_, entry) in zip(chapters, written)
+            for s, subsection in enumerate(entry["subsections"])
+        ]
+        subsections = Subsection.objects.bulk_create(
+            Subsection(chapter=chapter, position=s, title=subsection["subsection"])
+            for chapter, s, subsection in entries
+        )
+        Paragraph.objects.bulk_create(
+            Paragraph(subsection=subsection, position=p, text=text)
+            for subsection, (_, _, entry) in zip(subsections, entries)
+            for p, text in enumerate(entry["paragraphs"])
+        )
+
+        # Drop the text prefetched before the update
+        if hasattr(self, "_prefetched_objects_cache"):
+            self._prefetched_objects_cache.clear()
+        return chapters
+
+
+# Lookups loading the whole text of books in 3 queries, whatever their number
+BOOK_TEXT = "chapters__subsections__paragraphs"
+
+
+def chapter_hash(chapter: dict) -> str:
+    # Hash of the text of a chapter (its title, subsections and paragraphs)
+    text = [
+        chapter["chapter"],
+        [[s["subsection"], s["paragraphs"]] for s in chapter["subsections"]],
+    ]
+    return sha256(dumps(text, ensure_ascii=False).encode()).hexdigest()
+
+
+class Chapter(models.Model):
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name="chapters")
+    position = models.IntegerField()
+    title = models.TextField()
+    # Hash of its text, the chapters that did not change are neither written again
+    # nor rendered again when the book is updated
+    content_hash = models.CharField(max_length=64, blank=True, default="")
+
+    class Meta:
+        ordering = ["position"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["book", "position"], name="unique_chapter_position"
+            ),
+        ]
 
     def __str__(self):
         return self.title
+
+    @property
+    def content(self) -> dict:
+        return {
+            "chapter": self.title,
+            "subsections": [
+                {
+                    "subsection": subsection.title,
+                    "paragraphs": [
+                        paragraph.text for paragraph in subsection.paragraphs.all()
+                    ],
+                }
+                for subsection in self.subsections.all()
+            ],
+        }
+
+
+class Subsection(models.Model):
+    chapter = models.ForeignKey(
+        Chapter, on_delete=models.CASCADE, related_name="subsections"
+    )
+    position = models.IntegerField()
+    title = models.TextField()
+
+    class Meta:
+        ordering = ["position"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["chapter", "position"], name="unique_subsection_position"
+            ),
+        ]
+
+    def __str__(self):
+        return self.title
+
+
+class Paragraph(models.Model):
+    subsection = models.ForeignKey(
+        Subsection, on_delete=models.CASCADE, related_name="paragraphs"
+    )
+    position = models.IntegerField()
+    text = models.TextField()
+
+    class Meta:
+        ordering = ["position"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["subsection", "position"], name="unique_paragraph_position"
+            ),
+        ]
+
+
+class SearchEntry(models.Model):
+    # Text of a book indexed by the search: one entry for the book itself (title, topic
+    # and table of contents in `headings`) and one per subsection (its chapter and
+    # subsection titles in `headings`, its paragraphs in `text`). The full-text index
+    # over these entries depends on the database, see the migration 0010_search_index.
+    book = models.ForeignKey(
+        Book, on_delete=models.CASCADE, related_name="search_entries"
+    )
+    subsection = models.ForeignKey(
+        Subsection,
+        null=True,
+        blank=True,
+        on_delete=models.CASCADE,
+        related_name="search_entries",
+    )
+    title = models.TextField(blank=True, default="")
+    topic = models.TextField(blank=True, default="")
+    headings = models.TextField(blank=True, default="")
+    text = models.TextField(blank=True, default="")
+
+
+class BookJob(models.Model):
+    class Status(models.TextChoices):
+        PENDING = "pending"
+        RUNNING = "running"
+        DONE = "done"
+        FAILED = "failed"
+
+    # Same values as the priorities of the API calls (model/throttle.py)
+    class Priority(models.IntegerChoices):
+        INTERACTIVE = 0
+        BULK = 1
+
+    payload = models.JSONField()
+    status = models.CharField(
+        max_length=10, choices=Status.choices, default=Status.PENDING, db_index=True
+    )
+    # Jobs of the lowest priority are claimed first, and their API calls go first
+    priority = models.SmallIntegerField(
+        choices=Priority.choices, default=Priority.INTERACTIVE
+    )
+    stage = models.CharField(max_length=20, blank=True, default="")
+    book = models.ForeignKey(
+        Book, null=True, blank=True, on_delete=models.SET_NULL, related_name="jobs"
+    )
+    error = models.TextField(blank=True, default="")
+    attempts = models.IntegerField(default=0)
+    worker = models.CharField(max_length=100, blank=True, default="")
+    # Timing of the stages of the last run: [{"stage", "start", "end", "seconds"}]
+    trace = models.JSONField(default=list, blank=True)
+    # What the last run reused from a similar book: {"book", "score", "mode", "sections"}
+    reuse = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.payload.get('title')} ({self.status})"
+
+
+class BookCheckpoint(models.Model):
+    # Output of one unit of a job's pipeline (the outline, a subsection, the cover...),
+    # saved as soon as it is produced so that a failed job can resume from there
+    job = models.ForeignKey(
+        BookJob, on_delete=models.CASCADE, related_name="checkpoints"
+    )
+    stage = models.CharField(max_length=20)
+    unit = models.IntegerField(default=0)
+    data = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["job", "stage", "unit"], name="unique_checkpoint_unit"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.job_id}:{self.stage}:{self.unit}"
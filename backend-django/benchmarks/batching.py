@@ -0,0 +1,101 @@
+# Compares the per-subsection and batched prompting modes of BookGenerator.generate_chapters:
+# number of requests, tokens used and wall time for the same outline.
+# Every call hits the API configured by OPENAI_API_KEY / OPENAI_BASE_URL, bypassing the cache.
+#
+# Usage: python -m benchmarks.batching [--chapters 5] [--subsections 5] [--batch-size 5]
+
+from argparse import ArgumentParser
+from json import dumps
+from time import perf_counter
+
+
+from model.book_generator import BookGenerator
+from model.cache import ResponseCache
+from model.client import LLMClient
+from model.settings import GENERATION_CONCURRENCY
+from api.dtos import BookCreateDto
+
+
+def run(
+    chapters: int, subsections: int, batch_size: int, concurrency: int
+) -> dict:
+    # A fresh client with no cache, so that every mode pays for its own requests
+    client = LLMClient(cache=ResponseCache())
+    generator = BookGenerator(
+        BookCreateDto(
+            {
+                "name": "benchmark",
+                "author": "Benchmark",
+                "title": "The Art of Benchmarking",
+                "topic": "Measuring the performance of software systems",
+                "target_audience": "Software engineers",
+                "num_chapters": chapters,
+                "num_subsections": subsections,
+                "cover": "null",
+            }
+        ),
+        concurrency=concurrency,
+        batch_size=batch_size,
+        client=client,
+    )
+
+    # Use a fixed outline so that both modes write exactly the same book
+    generator.book["table_of_contents"] = [
+        {
+            "chapter": f"Chapter {c}: Topic {c}",
+            "subsections": [f"{c}.{s} Subtopic {c}.{s}" for s in range(1, subsections + 1)],
+        }
+        for c in range(1, chapters + 1)
+    ]
+
+    start = perf_counter()
+    generator.generate_chapters()
+    elapsed = perf_counter() - start
+
+    metrics = client.metrics.snapshot()
+    tokens = metrics["tokens"].values()
+    return {
+        "batch_size": batch_size,
+        "requests": sum(calls["count"] for calls in metrics["calls"].values()),
+        "prompt_tokens": sum(usage["prompt"] for usage in tokens),
+        "completion_tokens": sum(usage["completion"] for usage in tokens),
+        "wall_time": round(elapsed, 3),
+    }
+
+
+def main() -> None:
+    parser = ArgumentParser(
+        description="Compare the per-subsection and batched prompting modes"
+    )
+    parser.add_argument("--chapters", type=int, default=5)
+    parser.add_argument("--subsections", type=int, default=5)
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=None,
+        help="Subsections per request in batched mode (default: a whole chapter)",
+    )
+    parser.add_argument("--concurrency", type=int, default=GENERATION_CONCURRENCY)
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    results = [
+        run(args.chapters, args.subsections, batch_size, args.concurrency)
+        for batch_size in (1, args.batch_size or args.subsections)
+    ]
+
+    print(f"{'mode':<16}{'requests':>10}{'prompt tok':>12}{'compl. tok':>12}{'wall (s)':>10}")
+    for result in results:
+        mode = "per-subsection" if result["batch_size"] == 1 else f"batched ({result['batch_size']})"
+        print(
+            f"{mode:<16}{result['requests']:>10}{result['prompt_tokens']:>12}"
+            f"{result['completion_tokens']:>12}{result['wall_time']:>10}"
+        )
+
+    if args.json:
+        with open(args.json, "w") as file:
+            file.write(dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
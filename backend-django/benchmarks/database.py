@@ -0,0 +1,200 @@
+# Load test of the database: concurrent writers create books (with their text, through
+# BookSerializer like the pipeline does) while readers list them (GET /book-list/),
+# reporting the throughput, latencies and errors of both, on each database:
+# - sqlite: the settings of the project (WAL, immediate transactions, pragmas)
+# - sqlite-legacy: the previous settings (rollback journal, deferred transactions,
+#   a new connection per request), for comparison
+# - postgresql: the database configured by the POSTGRES_* variables (the compose
+#   `database` service), with the connection pool
+# Every run happens in a fresh process on a fresh test database, dropped afterwards.
+#
+# Usage: python -m benchmarks.database [--modes sqlite sqlite-legacy postgresql]
+#                                      [--writers 4] [--readers 8] [--duration 10]
+
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from json import dumps
+from multiprocessing import get_context
+from os import environ, path
+from statistics import quantiles
+from tempfile import mkdtemp
+from threading import Barrier, Thread
+from time import perf_counter
+
+
+def synthetic_content(chapters: int, subsections: int, paragraphs: int) -> list:
+    paragraph = (
+        "A load test measures how a system behaves under the traffic it is built for. "
+        "Its results only mean something when the data looks like the real one. "
+    ) * 3
+    return [
+        {
+            "chapter": f"Chapter {c}: Topic {c}",
+            "subsections": [
+                {
+                    "subsection": f"{c}.{s} Subtopic {c}.{s}",
+                    "paragraphs": [paragraph] * paragraphs,
+                }
+                for s in range(1, subsections + 1)
+            ],
+        }
+        for c in range(1, chapters + 1)
+    ]
+
+
+def configure(mode: str) -> None:
+    # Select the database before Django reads its settings
+    environ["DATABASE_ENGINE"] = "postgresql" if mode == "postgresql" else "sqlite"
+
+    import django
+    from django.conf import settings
+
+    django.setup()
+    # Do not keep every query in memory
+    settings.DEBUG = False
+
+    database = settings.DATABASES["default"]
+    if mode != "postgresql":
+        database.setdefault("TEST", {})["NAME"] = path.join(mkdtemp(), "benchmark.sqlite3")
+    if mode == "sqlite-legacy":
+        database["CONN_MAX_AGE"] = 0
+        database["OPTIONS"] = {
+            "timeout": 20,
+            "init_command": "PRAGMA journal_mode=DELETE",
+        }
+
+
+def run(
+    mode: str,
+    writers: int,
+    readers: int,
+    duration: float,
+    chapters: int,
+    subsections: int,
+    paragraphs: int,
+) -> dict:
+    configure(mode)
+
+    from django.db import connection, connections
+    from django.test import Client
+    from api.serializers import BookSerializer
+
+    content = synthetic_content(chapters, subsections, paragraphs)
+    database = connection.creation.create_test_db(verbosity=0)
+
+    def create() -> None:
+        serializer = BookSerializer(
+            data={
+                "author": "Benchmark",
+                "title": "The Art of Load Testing",
+                "topic": "Measuring databases under concurrent traffic",
+                "target_audience": "Software engineers",
+                "num_chapters": chapters,
+                "num_subsections": subsections,
+                "cover": "media/covers/benchmark.png",
+                "content": content,
+            }
+        )
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+    def list_books(client: Client) -> None:
+        response = client.get("/book-list/", {"page_size": 20})
+        if response.status_code != 200:
+            raise RuntimeError(f"GET /book-list/ returned {response.status_code}")
+
+    # Start every client at the same time, then run them until the deadline
+    results = {"create": [], "list": []}
+    errors = {"create": [], "list": []}
+    start = Barrier(writers + readers)
+
+    def work(operation: str) -> None:
+        client = Client(HTTP_HOST="localhost")
+        latencies, failures = [], []
+        start.wait()
+        deadline = perf_counter() + duration
+        while perf_counter() < deadline:
+            started = perf_counter()
+            try:
+                create() if operation == "create" else list_books(client)
+            except Exception as e:
+                failures.append(type(e).__name__)
+            else:
+                latencies.append(perf_counter() - started)
+
+        # Lists are thread-safe to extend
+        results[operation].extend(latencies)
+        errors[operation].extend(failures)
+        connections.close_all()
+
+    threads = [Thread(target=work, args=("create",)) for _ in range(writers)]
+    threads += [Thread(target=work, args=("list",)) for _ in range(readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    connection.creation.destroy_test_db(database, verbosity=0)
+
+    report = {"mode": mode, "writers": writers, "readers": readers}
+    for operation, latencies in results.items():
+        percentiles = quantiles(latencies, n=100) if len(latencies) > 1 else [0] * 99
+        report[operation] = {
+            "count": len(latencies),
+            "per_second": round(len(latencies) / duration, 1),
+            "p50_ms": round(percentiles[49] * 1000, 1),
+            "p95_ms": round(percentiles[94] * 1000, 1),
+            "errors": len(errors[operation]),
+            "error_types": sorted(set(errors[operation])),
+        }
+    return report
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Concurrent create/list load test of the database")
+    parser.add_argument("--modes", nargs="+", default=["sqlite", "sqlite-legacy"])
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--chapters", type=int, default=10)
+    parser.add_argument("--subsections", type=int, default=5)
+    parser.add_argument("--paragraphs", type=int, default=6)
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    results = []
+    for mode in args.modes:
+        # A fresh process per run, Django is configured for a single database
+        with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as executor:
+            results.append(
+                executor.submit(
+                    run,
+                    mode,
+                    args.writers,
+                    args.readers,
+                    args.duration,
+                    args.chapters,
+                    args.subsections,
+                    args.paragraphs,
+                ).result()
+            )
+
+    print(
+        f"{'mode':<15}{'operation':<11}{'per second':>12}{'p50 (ms)':>10}"
+        f"{'p95 (ms)':>10}{'errors':>8}"
+    )
+    for result in results:
+        for operation in ("create", "list"):
+            stats = result[operation]
+            print(
+                f"{result['mode']:<15}{operation:<11}{stats['per_second']:>12}"
+                f"{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['errors']:>8}"
+            )
+
+    if args.json:
+        with open(args.json, "w") as file:
+            file.write(dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+# Compares the documents built from chapter parts (model/docx_parts.py, as the API
+# builds them) with building the whole python-docx object tree (as the document
+# generator used to), on synthetic books of growing length: wall time, peak memory and
+# size of the file written.
+# - parts: the first build of a book, every chapter is rendered
+# - update: the build after a chapter of the book changed, the others are reused
+# - tree: the python-docx object tree
+# Every run happens in a fresh process so that their peak memory does not add up.
+#
+# Usage: python -m benchmarks.documents [--chapters 10 100 500]
+#                                       [--modes parts update tree]
+
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import sha256
+from json import dumps
+from multiprocessing import get_context
+from os import path, remove
+from resource import RUSAGE_SELF, getrusage
+from shutil import rmtree
+from sys import platform
+from tempfile import gettempdir
+from time import perf_counter
+from cv2 import imwrite
+from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
+from docx.shared import Pt
+from numpy import full, uint8
+
+
+from model.document_generator import DocumentGenerator
+from model.docx_parts import build_document
+from model.settings import DOCUMENT_PARTS_ROOT, TOC_FONT, TITLE_FONT, CONTENT_FONT
+
+
+PARAGRAPH = (
+    "Benchmarks measure what a system does rather than what we believe it does. "
+    "A good one isolates a single variable, repeats every measurement, and reports "
+    "the spread of the results along with their mean. "
+) * 4
+
+
+def synthetic_book(chapters: int, subsections: int, paragraphs: int) -> dict:
+    cover = path.join(gettempdir(), "benchmark-cover.png")
+    imwrite(cover, full((1250, 1000, 3), 128, uint8))
+
+    table_of_contents, content = [], []
+    for c in range(1, chapters + 1):
+        titles = [f"{c}.{s} Subtopic {c}.{s}" for s in range(1, subsections + 1)]
+        table_of_contents.append({"chapter": f"Chapter {c}: Topic {c}", "subsections": titles})
+        content.append(
+            {
+                "chapter": f"Chapter {c}: Topic {c}",
+                "subsections": [
+                    {"subsection": title, "paragraphs": [PARAGRAPH] * paragraphs}
+                    for title in titles
+                ],
+            }
+        )
+
+    return {
+        "id": f"benchmark-{chapters}",
+        "author": "Benchmark",
+        "title": "The Art of Benchmarking",
+        "cover": cover,
+        "table_of_contents": table_of_contents,
+        "content": content,
+    }
+
+
+def document_parts(book: dict, chapters: list) -> dict:
+    # What the document is built from, like api/exports.document_parts: the text of
+    # the `chapters` (positions) only, the others are rendered already
+    hashes = [
+        sha256(dumps(chapter).encode()).hexdigest()[:16] for chapter in book["content"]
+    ]
+    return {
+        **{key: book[key] for key in ("id", "author", "title", "cover")},
+        "table_of_contents": book["table_of_contents"],
+        "hashes": hashes,
+        "chapters": {hashes[c]: book["content"][c] for c in chapters},
+    }
+
+
+def build_tree(generator: DocumentGenerator, filename: str) -> None:
+    # The previous implementation: the whole book as a python-docx object tree,
+    # formatted run by run, with blank paragraphs to lay the chapter pages out
+    document, book = generator.document, generator.book
+
+    document.add_page_break()
+    h = document.add_heading("Table of Contents", 0)
+    h.runs[0].font.name = TOC_FONT
+    document.add_paragraph()
+    for chapter in book["table_of_contents"]:
+        h = document.add_heading(chapter["chapter"], 1)
+        h.runs[0].font.name = TOC_FONT
+        h.runs[0].font.size = Pt(20)
+        for subsection in chapter["subsections"]:
+            number, title = subsection.split(" ", 1)
+            h = document.add_heading(level=2)
+            for text, bold in ((number + " ", True), (title, None)):
+                r = h.add_run(text)
+                r.font.name = TITLE_FONT
+                r.font.size = Pt(18)
+                r.bold = bold
+        document.add_paragraph()
+
+    for chapter in book["content"]:
+        document.add_page_break()
+        for _ in range(13):
+            document.add_paragraph()
+        title = document.add_paragraph()
+        r = title.add_run(chapter["chapter"].split(":", 1)[1].strip())
+        r.bold = True
+        r.font.size = Pt(30)
+        r.font.name = TITLE_FONT
+        title.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+
+        for subsection in chapter["subsections"]:
+            document.add_page_break()
+            h = document.add_heading(subsection["subsection"], 1)
+            h.runs[0].font.name = TITLE_FONT
+            h.runs[0].font.size = Pt(24)
+            for i, paragraph in enumerate(subsection["paragraphs"]):
+                p = document.add_paragraph(paragraph)
+                if i == 0:
+                    p.paragraph_format.space_before = Pt(12)
+                p.paragraph_format.space_after = Pt(12)
+                p.paragraph_format.alignment = WD_PARAGRAPH_ALIGNMENT.JUSTIFY
+                p.runs[0].font.name = CONTENT_FONT
+                p.runs[0].font.size = Pt(16)
+
+    document.save(filename)
+
+
+def max_rss() -> int:
+    # Peak resident memory of the process, in bytes
+    rss = getrusage(RUSAGE_SELF).ru_maxrss
+    return rss if platform == "darwin" else rss * 1024
+
+
+def run(mode: str, chapters: int, subsections: int, paragraphs: int) -> dict:
+    book = synthetic_book(chapters, subsections, paragraphs)
+    # Where the API serves the document of a book named after its id
+    filename = f"media/docs/{book['id']}.docx"
+    rmtree(path.join(DOCUMENT_PARTS_ROOT, book["id"]), ignore_errors=True)
+
+    # Memory used by the book itself (and the imports) is not counted, nor the first
+    # build of an updated book
+    if mode == "tree":
+        generator = DocumentGenerator(book)
+        generator.generate_cover_page()
+    elif mode == "update":
+        build_document(document_parts(book, range(chapters)))
+        book["content"][0]["subsections"][0]["paragraphs"][0] = "An edited paragraph."
+    baseline = max_rss()
+
+    start = perf_counter()
+    if mode == "parts":
+        build_document(document_parts(book, range(chapters)))
+    elif mode == "update":
+        build_document(document_parts(book, [0]))
+    else:
+        build_tree(generator, filename)
+    elapsed = perf_counter() - start
+
+    result = {
+        "mode": mode,
+        "chapters": chapters,
+        "paragraphs": chapters * subsections * paragraphs,
+        "wall_time": round(elapsed, 3),
+        "peak_memory_mb": round((max_rss() - baseline) / 2**20, 1),
+        "file_size_mb": round(path.getsize(filename) / 2**20, 2),
+    }
+    remove(filename)
+    rmtree(path.join(DOCUMENT_PARTS_ROOT, book["id"]), ignore_errors=True)
+    return result
+
+
+def main() -> None:
+    parser = ArgumentParser(
+        description="Compare the documents built from parts with the python-docx tree"
+    )
+    parser.add_argument("--chapters", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--subsections", type=int, default=5)
+    parser.add_argument("--paragraphs", type=int, default=6)
+    parser.add_argument("--modes", nargs="+", default=["parts", "update", "tree"])
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    results = []
+    for chapters in args.chapters:
+        for mode in args.modes:
+            # A fresh process per run, the peak memory of a process never goes down
+            with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as executor:
+                results.append(
+                    executor.submit(
+                        run, mode, chapters, args.subsections, args.paragraphs
+                    ).result()
+                )
+
+    print(f"{'mode':<8}{'chapters':>10}{'paragraphs':>12}{'wall (s)':>10}{'peak (MB)':>11}{'file (MB)':>11}")
+    for result in results:
+        print(
+            f"{result['mode']:<8}{result['chapters']:>10}{result['paragraphs']:>12}"
+            f"{result['wall_time']:>10}{result['peak_memory_mb']:>11}{result['file_size_mb']:>11}"
+        )
+
+    if args.json:
+        with open(args.json, "w") as file:
+            file.write(dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+# Local, deterministic fake of the OpenAI chat completions and image generation APIs,
+# answering the prompts of the generators like the real API would (outlines, JSON
+# batches, subsections of paragraphs, cover prompts, images), the same prompt always
+# getting the same response:
+# - latency per request, and per token when streamed
+# - requests and tokens per minute enforced like the real API: continuously refilled
+#   budgets, x-ratelimit-* headers on every response, 429 with a Retry-After once a
+#   budget is exhausted (0 = unlimited)
+# - error injection: a share of the requests fail with a 500, drawn from a seeded
+#   generator so that runs are reproducible
+#
+# Usage: python -m benchmarks.fake_openai [--port 8001] [--rpm 600] [--tpm 200000]
+#                                         [--latency 0.5] [--error-rate 0.01]
+#        then run the backend with OPENAI_BASE_URL=http://127.0.0.1:8001/v1
+
+from argparse import ArgumentParser
+from base64 import b64encode
+from functools import lru_cache
+from hashlib import sha256
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from json import dumps, loads
+from math import ceil
+from random import Random
+from re import M, findall, search
+from threading import Lock, Thread
+from time import monotonic, sleep
+from cv2 import imencode
+from numpy import linspace, stack, tile, uint8
+
+
+WORDS = (
+    "the book explains how systems behave under load and why measuring them matters "
+    "more than guessing while every chapter builds on the previous one with examples "
+    "drawn from real projects so that readers can apply each idea step by step"
+).split()
+
+
+class Budget:
+    # Requests or tokens per minute, refilled continuously (0 = unlimited)
+    def __init__(self, per_minute: int) -> None:
+        self.limit = per_minute
+        self.level = float(per_minute)
+        self.at = monotonic()
+
+    def refill(self) -> None:
+        now = monotonic()
+        self.level = min(self.limit, self.level + self.limit / 60 * (now - self.at))
+        self.at = now
+
+    def shortage(self, amount: int) -> float:
+        # Seconds until `amount` is available, 0 if it is now
+        missing = min(amount, self.limit) - self.level
+        return missing / (self.limit / 60) if self.limit and missing > 0 else 0
+
+    def reset(self) -> float:
+        # Seconds until the budget is full again
+        return (self.limit - self.level) / (self.limit / 60) if self.limit else 0
+
+
+def duration(seconds: float) -> str:
+    return f"{ceil(seconds * 1000)}ms"
+
+
+def words(rng: Random, count: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(count))
+
+
+@lru_cache(maxsize=32)
+def image(prompt: str, size: str) -> str:
+    # A gradient whose colors depend on the prompt, as a base64 PNG
+    width, height = (int(n) for n in size.split("x"))
+    seed = sha256(prompt.encode()).digest()
+    channels = [
+        tile(linspace(seed[i], seed[i + 3], width, dtype=uint8), (height, 1))
+        for i in range(3)
+    ]
+    _, data = imencode(".png", stack(channels, axis=2))
+    return b64encode(data.tobytes()).decode()
+
+
+class FakeOpenAI:
+    def __init__(
+        self,
+        port: int = 0,
+        rpm: int = 0,
+        tpm: int = 0,
+        latency: float = 0.05,
+        token_latency: float = 0.0,
+        completion_tokens: int = 200,
+        paragraphs: int = 5,
+        paragraph_words: int = 80,
+        image_latency: float = 0.5,
+        error_rate: float = 0.0,
+        seed: int = 0,
+    ) -> None:
+        self.requests = Budget(rpm)
+        self.tokens = Budget(tpm)
+        self.latency = latency
+        self.token_latency = token_latency
+        # Words of the responses to the prompts that are not recognized
+        self.completion_tokens = completion_tokens
+        # Shape of the text of a subsection
+        self.paragraphs = paragraphs
+        self.paragraph_words = paragraph_words
+        self.image_latency = image_latency
+        self.error_rate = error_rate
+        self.stats = {"requests": 0, "rate_limited": 0, "errors": 0, "tokens": 0}
+        self._errors = Random(seed)
+        self._lock = Lock()
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args) -> None:
+                pass
+
+            def do_POST(self) -> None:
+                body = loads(self.rfile.read(int(self.headers["Content-Length"])))
+                if self.path.endswith("/chat/completions"):
+                    fake.chat(self, body)
+                elif self.path.endswith("/images/generations"):
+                    fake.image(self, body)
+                else:
+                    fake.send(self, 404, {"error": {"message": "Unknown endpoint"}})
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.server.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}/v1"
+
+    def start(self) -> "FakeOpenAI":
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def admit(self, tokens: int) -> tuple:
+        # Take the request from the budgets, or tell how long to wait for them.
+        # Returns that delay, whether an error is injected, and the headers.
+        with self._lock:
+            self.requests.refill()
+            self.tokens.refill()
+            wait = max(self.requests.shortage(1), self.tokens.shortage(tokens))
+            failed = False
+            if wait > 0:
+                self.stats["rate_limited"] += 1
+            else:
+                self.requests.level -= 1
+                self.tokens.level -= tokens
+                self.stats["requests"] += 1
+                self.stats["tokens"] += tokens
+                failed = self._errors.random() < self.error_rate
+                self.stats["errors"] += failed
+            return wait, failed, self.headers()
+
+    def headers(self) -> dict:
+        headers = {}
+        for name, budget in (("requests", self.requests), ("tokens", self.tokens)):
+            if budget.limit:
+                headers[f"x-ratelimit-limit-{name}"] = str(budget.limit)
+                headers[f"x-ratelimit-remaining-{name}"] = str(max(0, int(budget.level)))
+                headers[f"x-ratelimit-reset-{name}"] = duration(budget.reset())
+        return headers
+
+    def reject(
+        self, handler: BaseHTTPRequestHandler, wait: float, failed: bool, headers: dict
+    ) -> bool:
+        # Answer with a 429 or an injected error, if any
+        if wait > 0:
+            headers["retry-after"] = f"{wait:.3f}"
+            error = {"message": "Rate limit reached", "code": "rate_limit_exceeded"}
+            self.send(handler, 429, {"error": error}, headers)
+            return True
+        if failed:
+            self.send(handler, 500, {"error": {"message": "Injected error"}}, headers)
+            return True
+        return False
+
+    def text(self, rng: Random) -> str:
+        # The paragraphs of a subsection
+        return "\n\n".join(
+            words(rng, self.paragraph_words).capitalize() + "."
+            for _ in range(self.paragraphs)
+        )
+
+    def reply(self, prompt: str, json: bool) -> str:
+        # What the generators expect for their prompts (see model/book_generator.py and
+        # model/cover_generator.py)
+        rng = Random(prompt)
+        shape = search(r"(\d+) chapter\(s\)\. Each chapter should have exactly (\d+)", prompt)
+        if shape:
+            chapters, subsections = (int(n) for n in shape.groups())
+            return dumps(
+                {
+                    f"Chapter {c}: {words(rng, 4).title()}": [
+                        words(rng, 5).capitalize() for _ in range(subsections)
+                    ]
+                    for c in range(1, chapters + 1)
+                }
+            )
+        if json:
+            numbers = findall(r"^(\d+\.\d+) ", prompt, M)
+            return dumps({number: self.text(rng) for number in numbers})
+        if "for the subsection" in prompt:
+            return self.text(rng)
+        if "dall-e-2 prompt" in prompt:
+            return f"An illustration of {words(rng, 12)}."
+        return words(rng, self.completion_tokens)
+
+    def chat(self, handler: BaseHTTPRequestHandler, body: dict) -> None:
+        prompt = "".join(message.get("content") or "" for message in body["messages"])
+        json = (body.get("response_format") or {}).get("type") == "json_object"
+        # A token is a word and the spaces after it
+        tokens = findall(r"\S+\s*|\s+", self.reply(prompt, json))
+
+        # Counted like the API does: the prompt and the most tokens it may complete
+        prompt_tokens = len(prompt) // 4 + 4 * len(body["messages"])
+        wait, failed, headers = self.admit(
+            prompt_tokens + (body.get("max_tokens") or len(tokens))
+        )
+        if self.reject(handler, wait, failed, headers):
+            return
+
+        sleep(self.latency)
+        model = body.get("model", "gpt-3.5-turbo")
+        if not body.get("stream"):
+            return self.send(
+                handler,
+                200,
+                {
+                    "id": "chatcmpl-fake",
+                    "object": "chat.completion",
+                    "created": 0,
+                    "model": model,
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": "".join(tokens)},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": {
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": len(tokens),
+                        "total_tokens": prompt_tokens + len(tokens),
+                    },
+                },
+                headers,
+            )
+
+        # Server-sent events, in chunked transfer encoding
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream")
+        handler.send_header("Transfer-Encoding", "chunked")
+        for name, value in headers.items():
+            handler.send_header(name, value)
+        handler.end_headers()
+
+        def write(data: str) -> None:
+            event = f"data: {data}\n\n".encode()
+            handler.wfile.write(f"{len(event):x}\r\n".encode() + event + b"\r\n")
+            handler.wfile.flush()
+
+        for token in tokens:
+            sleep(self.token_latency)
+            chunk = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": 0,
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}],
+            }
+            write(dumps(chunk))
+        write("[DONE]")
+        handler.wfile.write(b"0\r\n\r\n")
+
+    def image(self, handler: BaseHTTPRequestHandler, body: dict) -> None:
+        wait, failed, headers = self.admit(0)
+        if self.reject(handler, wait, failed, headers):
+            return
+
+        sleep(self.image_latency)
+        data = image(body["prompt"], body.get("size") or "1024x1024")
+        self.send(
+            handler,
+            200,
+            {"created": 0, "data": [{"b64_json": data}] * (body.get("n") or 1)},
+            headers,
+        )
+
+    @staticmethod
+    def send(
+        handler: BaseHTTPRequestHandler, status: int, body: dict, headers: dict = None
+    ) -> None:
+        data = dumps(body).encode()
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(data)
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Fake OpenAI API for offline benchmarks")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--rpm", type=int, default=0)
+    parser.add_argument("--tpm", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--token-latency", type=float, default=0.005)
+    parser.add_argument("--completion-tokens", type=int, default=200)
+    parser.add_argument("--paragraphs", type=int, default=5)
+    parser.add_argument("--paragraph-words", type=int, default=80)
+    parser.add_argument("--image-latency", type=float, default=2)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    fake = FakeOpenAI(
+        args.port,
+        args.rpm,
+        args.tpm,
+        args.latency,
+        args.token_latency,
+        args.completion_tokens,
+        args.paragraphs,
+        args.paragraph_words,
+        args.image_latency,
+        args.error_rate,
+        args.seed,
+    ).start()
+    print(f"Fake OpenAI API on {fake.url}", flush=True)
+    try:
+        while True:
+            sleep(3600)
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
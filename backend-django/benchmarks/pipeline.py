@@ -0,0 +1,278 @@
+# End-to-end benchmark of book generation, offline: books are created through
+# POST /book-create/ and generated by job workers (BookGenerator -> CoverGenerator ->
+# DocumentGenerator -> PDF) against the local fake API (benchmarks/fake_openai.py),
+# at every concurrency level (number of workers). Reports the throughput, the duration
+# of the books and of their stages, the API calls and the peak memory.
+# Every level runs in a fresh process, on a fresh test database, with its own fake
+# server; the files of the books are removed afterwards. Results can be saved as JSON
+# and compared with a previous run (--compare), to catch regressions.
+#
+# Usage: python -m benchmarks.pipeline [--concurrency 1 4 8] [--books-per-worker 2]
+#                                      [--chapters 5] [--subsections 4] [--latency 0.5]
+#                                      [--pdf-backend aspose] [--artifacts eager]
+#                                      [--error-rate 0.01]
+#                                      [--json results.json]
+#                                      [--compare previous.json]
+
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from json import dumps, loads
+from multiprocessing import get_context
+from os import environ, path, remove
+from resource import RUSAGE_CHILDREN, RUSAGE_SELF, getrusage
+from statistics import mean, quantiles
+from subprocess import PIPE, Popen
+from sys import executable, platform
+from threading import Thread
+from time import perf_counter
+
+
+def max_rss(who: int) -> int:
+    # Peak resident memory of the process (or of its largest child), in bytes
+    rss = getrusage(who).ru_maxrss
+    return rss if platform == "darwin" else rss * 1024
+
+
+def summary(values: list) -> dict:
+    percentiles = quantiles(values, n=100) if len(values) > 1 else values * 99 or [0] * 99
+    return {
+        "mean": round(mean(values), 3) if values else 0,
+        "p50": round(percentiles[49], 3),
+        "p95": round(percentiles[94], 3),
+    }
+
+
+def start_fake(args) -> tuple:
+    # The fake API runs in its own process, so that it does not compete with the
+    # pipeline for the interpreter
+    fake = Popen(
+        [
+            executable,
+            "-m",
+            "benchmarks.fake_openai",
+            "--port=0",
+            f"--latency={args.latency}",
+            f"--token-latency={args.token_latency}",
+            f"--image-latency={args.image_latency}",
+            f"--paragraphs={args.paragraphs}",
+            f"--paragraph-words={args.paragraph_words}",
+            f"--error-rate={args.error_rate}",
+            f"--rpm={args.rpm}",
+            f"--tpm={args.tpm}",
+            f"--seed={args.seed}",
+        ],
+        stdout=PIPE,
+        text=True,
+    )
+    return fake, fake.stdout.readline().split()[-1]
+
+
+def run(
+    url: str,
+    concurrency: int,
+    books: int,
+    chapters: int,
+    subsections: int,
+    pdf_backend: str,
+    artifacts: str,
+) -> dict:
+    # Point the client to the fake API, with no response cache and no metrics directory
+    environ["OPENAI_BASE_URL"] = url
+    if pdf_backend:
+        environ["PDF_BACKEND"] = pdf_backend
+    if artifacts:
+        environ["BOOK_ARTIFACTS"] = artifacts
+    environ.setdefault("OPENAI_API_KEY", "benchmark")
+    environ["LLM_CACHE_BACKEND"] = "none"
+    environ.pop("PROMETHEUS_MULTIPROC_DIR", None)
+
+    from benchmarks.database import configure
+
+    configure("sqlite")
+
+    from django.db import connection, connections
+    from django.test import Client
+    from prometheus_client import REGISTRY
+    from model.client import get_client
+    from model.cover_generator import cover_paths
+    from model.pdf_converter import get_converter
+    from base.models import BookJob
+    from api.jobs import claim_job, run_job
+    from api.scheduler import get_process_pool
+
+    database = connection.creation.create_test_db(verbosity=0)
+    names = [f"benchmark-{concurrency}-{i}" for i in range(books)]
+
+    # Queue every book through the API, then let the workers drain the queue
+    start = perf_counter()
+    client = Client(HTTP_HOST="localhost")
+    for i, name in enumerate(names):
+        response = client.post(
+            "/book-create/",
+            {
+                "name": name,
+                "author": "Benchmark",
+                "title": f"Measuring Systems, Volume {i + 1}",
+                "topic": f"How to benchmark software systems, part {i + 1}",
+                "target_audience": "Software engineers",
+                "num_chapters": chapters,
+                "num_subsections": subsections,
+                "cover": "ai",
+                "reuse": "none",
+            },
+            content_type="application/json",
+        )
+        if response.status_code != 202:
+            raise RuntimeError(f"POST /book-create/ returned {response.status_code}")
+
+    def work(worker: str) -> None:
+        while (job := claim_job(worker)) is not None:
+            run_job(job)
+        connections.close_all()
+
+    threads = [Thread(target=work, args=(f"worker-{n}",)) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = perf_counter() - start
+
+    # The worker processes of the render and PDF pools are only stopped at exit, which
+    # the process of an executor does not go through (and their memory is only counted
+    # once they are)
+    get_process_pool().shutdown()
+    get_converter().close()
+
+    jobs = list(BookJob.objects.all())
+    done = [job for job in jobs if job.status == BookJob.Status.DONE]
+
+    # Stages of the pipeline (from the jobs' traces) and of the generators (from the
+    # metrics of this process, the documents are built in render processes)
+    stages = {}
+    for job in done:
+        for stage in job.trace:
+            stages.setdefault(stage["stage"], []).append(stage["seconds"])
+    for metric in REGISTRY.collect():
+        if metric.name == "aiscript_stage_seconds":
+            for sample in metric.samples:
+                if sample.name.endswith("_sum") and sample.labels["stage"] not in stages:
+                    count = REGISTRY.get_sample_value(
+                        "aiscript_stage_seconds_count", sample.labels
+                    )
+                    stages[sample.labels["stage"]] = {
+                        "mean": round(sample.value / count, 3),
+                        "count": int(count),
+                    }
+
+    report = {
+        "concurrency": concurrency,
+        "books": books,
+        "done": len(done),
+        "failed": [job.error.strip().splitlines()[-1] for job in jobs if job not in done],
+        "seconds": round(wall, 2),
+        "books_per_minute": round(len(done) / wall * 60, 2),
+        "book_seconds": summary(
+            [(job.finished_at - job.started_at).total_seconds() for job in done]
+        ),
+        "stages": {
+            stage: values if isinstance(values, dict) else summary(values)
+            for stage, values in stages.items()
+        },
+        "api": get_client().metrics.snapshot(),
+        "peak_rss_mb": round(max_rss(RUSAGE_SELF) / 2**20, 1),
+        "peak_child_rss_mb": round(max_rss(RUSAGE_CHILDREN) / 2**20, 1),
+    }
+
+    connection.creation.destroy_test_db(database, verbosity=0)
+    for name in names:
+        files = [f"media/docs/{name}.docx", f"media/pdfs/{name}.pdf"]
+        for file in files + list(cover_paths(f"media/covers/{name}.png").values()):
+            if path.exists(file):
+                remove(file)
+    return report
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Offline end-to-end benchmark of book generation")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--books-per-worker", type=int, default=2)
+    parser.add_argument("--chapters", type=int, default=5)
+    parser.add_argument("--subsections", type=int, default=4)
+    parser.add_argument("--pdf-backend", help="Overrides the PDF_BACKEND setting")
+    parser.add_argument(
+        "--artifacts",
+        choices=["lazy", "eager"],
+        help="Overrides the BOOK_ARTIFACTS setting (eager to measure the documents and PDFs)",
+    )
+    # Behavior of the fake API
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--token-latency", type=float, default=0.002)
+    parser.add_argument("--image-latency", type=float, default=2)
+    parser.add_argument("--paragraphs", type=int, default=5)
+    parser.add_argument("--paragraph-words", type=int, default=80)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--rpm", type=int, default=0)
+    parser.add_argument("--tpm", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write the results to this file")
+    parser.add_argument("--compare", help="Results of a previous run to compare with")
+    args = parser.parse_args()
+
+    results = []
+    for concurrency in args.concurrency:
+        fake, url = start_fake(args)
+        try:
+            # A fresh process per level, the clients, pools and metrics are per process
+            with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as executor:
+                results.append(
+                    executor.submit(
+                        run,
+                        url,
+                        concurrency,
+                        concurrency * args.books_per_worker,
+                        args.chapters,
+                        args.subsections,
+                        args.pdf_backend,
+                        args.artifacts,
+                    ).result()
+                )
+        finally:
+            fake.terminate()
+            fake.wait()
+
+    previous = {}
+    if args.compare:
+        with open(args.compare) as file:
+            previous = {result["concurrency"]: result for result in loads(file.read())}
+
+    print(
+        f"{'workers':>8}{'books':>7}{'failed':>8}{'books/min':>11}{'book p50 (s)':>14}"
+        f"{'book p95 (s)':>14}{'peak RSS (MB)':>15}{'vs previous':>13}"
+    )
+    for result in results:
+        change = ""
+        if result["concurrency"] in previous:
+            before = previous[result["concurrency"]]["books_per_minute"]
+            change = f"{(result['books_per_minute'] / before - 1) * 100:+.1f}%"
+        print(
+            f"{result['concurrency']:>8}{result['books']:>7}{len(result['failed']):>8}"
+            f"{result['books_per_minute']:>11}{result['book_seconds']['p50']:>14}"
+            f"{result['book_seconds']['p95']:>14}"
+            f"{max(result['peak_rss_mb'], result['peak_child_rss_mb']):>15}{change:>13}"
+        )
+
+    print(f"\n{'stage':<22}" + "".join(f"{n:>12}" for n in args.concurrency))
+    stages = dict.fromkeys(stage for result in results for stage in result["stages"])
+    for stage in stages:
+        row = "".join(
+            f"{result['stages'].get(stage, {}).get('mean', '-'):>12}" for result in results
+        )
+        print(f"{stage:<22}{row}")
+
+    if args.json:
+        with open(args.json, "w") as file:
+            file.write(dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
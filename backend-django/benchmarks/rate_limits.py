@@ -0,0 +1,165 @@
+# Load test of the rate limiter against the local fake API (benchmarks/fake_openai.py)
+# enforcing requests and tokens per minute: concurrent clients, some of them bulk
+# (low priority), make chat calls for a while, with each mode:
+# - adaptive: the rate limiter of the client (AIMD concurrency, budgets, priorities)
+# - unthrottled: every call sent at once and retried on 429, as before the limiter
+# Reports the throughput, the 429s received, the calls failed once out of retries and
+# the latencies (retries included) by priority.
+# Every run happens in a fresh process with its own fake server.
+#
+# Usage: python -m benchmarks.rate_limits [--modes adaptive unthrottled] [--clients 32]
+#                                         [--rpm 600] [--tpm 100000] [--duration 20]
+
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from json import dumps
+from multiprocessing import get_context
+from statistics import quantiles
+from threading import Barrier, Thread
+from time import perf_counter
+
+
+def run(
+    mode: str,
+    clients: int,
+    bulk: float,
+    rpm: int,
+    tpm: int,
+    latency: float,
+    completion_tokens: int,
+    duration: float,
+) -> dict:
+    from openai import OpenAI
+    from model.cache import ResponseCache
+    from model.client import LLMClient, create_http_client
+    from model.throttle import BULK, INTERACTIVE, RateLimiter, prioritized
+    from benchmarks.fake_openai import FakeOpenAI
+
+    class Unthrottled(RateLimiter):
+        # Every call admitted right away whatever the budgets
+        def __init__(self, model: str) -> None:
+            super().__init__(model, 0, 0, 10_000, 10_000, 10_000)
+
+        def update(self, headers) -> None:
+            pass
+
+    fake = FakeOpenAI(
+        rpm=rpm, tpm=tpm, latency=latency, completion_tokens=completion_tokens
+    ).start()
+    http = create_http_client()
+    client = LLMClient(
+        openai=OpenAI(api_key="fake", base_url=fake.url, http_client=http, max_retries=0),
+        http=http,
+        cache=ResponseCache(),
+    )
+    if mode == "unthrottled":
+        client.limiters["gpt-3.5-turbo"] = Unthrottled("gpt-3.5-turbo")
+
+    # Start every client at the same time, then run them until the deadline
+    latencies = {INTERACTIVE: [], BULK: []}
+    failures = []
+    start = Barrier(clients)
+
+    def work(n: int, priority: int) -> None:
+        done, failed = [], 0
+        start.wait()
+        deadline = perf_counter() + duration
+        with prioritized(priority):
+            while perf_counter() < deadline:
+                started = perf_counter()
+                try:
+                    client.chat(
+                        [{"role": "user", "content": f"Write subsection {n}.{len(done)}"}],
+                        use_cache=False,
+                    )
+                except Exception:
+                    failed += 1
+                else:
+                    done.append(perf_counter() - started)
+
+        # Lists are thread-safe to extend
+        latencies[priority].extend(done)
+        failures.extend([priority] * failed)
+
+    bulk_clients = round(clients * bulk)
+    threads = [
+        Thread(target=work, args=(n, BULK if n < bulk_clients else INTERACTIVE))
+        for n in range(clients)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    fake.stop()
+
+    report = {
+        "mode": mode,
+        "clients": clients,
+        "calls_per_second": round(sum(map(len, latencies.values())) / duration, 2),
+        "rate_limited": fake.stats["rate_limited"],
+        "failed": len(failures),
+        "tokens_per_minute": round(fake.stats["tokens"] / duration * 60),
+    }
+    for priority, name in ((INTERACTIVE, "interactive"), (BULK, "bulk")):
+        calls = latencies[priority]
+        percentiles = quantiles(calls, n=100) if len(calls) > 1 else [0] * 99
+        report[name] = {
+            "count": len(calls),
+            "p50_s": round(percentiles[49], 2),
+            "p95_s": round(percentiles[94], 2),
+        }
+    return report
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Rate limiter load test against a fake API")
+    parser.add_argument("--modes", nargs="+", default=["adaptive", "unthrottled"])
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--bulk", type=float, default=0.5, help="Share of bulk clients")
+    parser.add_argument("--rpm", type=int, default=600)
+    parser.add_argument("--tpm", type=int, default=100_000)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--completion-tokens", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    results = []
+    for mode in args.modes:
+        # A fresh process per run, the limiters and metrics are per process
+        with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as executor:
+            results.append(
+                executor.submit(
+                    run,
+                    mode,
+                    args.clients,
+                    args.bulk,
+                    args.rpm,
+                    args.tpm,
+                    args.latency,
+                    args.completion_tokens,
+                    args.duration,
+                ).result()
+            )
+
+    print(
+        f"{'mode':<13}{'calls/s':>9}{'tokens/min':>12}{'429s':>7}{'failed':>8}"
+        f"{'interactive p50/p95 (s)':>26}{'bulk p50/p95 (s)':>19}"
+    )
+    for result in results:
+        interactive, bulk = result["interactive"], result["bulk"]
+        print(
+            f"{result['mode']:<13}{result['calls_per_second']:>9}"
+            f"{result['tokens_per_minute']:>12}{result['rate_limited']:>7}"
+            f"{result['failed']:>8}"
+            f"{interactive['p50_s']:>14} / {interactive['p95_s']:<9}"
+            f"{bulk['p50_s']:>8} / {bulk['p95_s']:<8}"
+        )
+
+    if args.json:
+        with open(args.json, "w") as file:
+            file.write(dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
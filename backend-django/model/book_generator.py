@@ -1,16 +1,39 @@
-from openai import OpenAI
 from json import loads
+from typing import Callable, Iterator
+from functools import partial
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextvars import copy_context
 
 
-from .settings import API_KEY
+from .settings import GENERATION_CONCURRENCY, GENERATION_BATCH_SIZE
+from .client import LLMClient, get_client
+from .metrics import timed
+from .outline_parser import OutlineParser
 from api.dtos import BookCreateDto
 
 
 class BookGenerator:
-    def __init__(self, data: "BookCreateDto") -> None:
-        self.client = OpenAI(api_key=API_KEY)
+    def __init__(
+        self,
+        data: "BookCreateDto",
+        concurrency: int = GENERATION_CONCURRENCY,
+        batch_size: int = GENERATION_BATCH_SIZE,
+        client: LLMClient = None,
+        reuse: Callable[[str, str], list | None] = None,
+    ) -> None:
+        self.client = client or get_client()
         self.outline = None
 
+        # Called with the chapter and subsection titles before writing a subsection,
+        # returns paragraphs already written for them to reuse (or None)
+        self.reuse = reuse
+
+        # Maximum number of subsection requests in flight at once
+        self.concurrency = max(1, concurrency)
+        # Maximum number of subsections of a chapter written by a single request
+        self.batch_size = max(1, batch_size)
+
         self.book = {
             "id": data.name,
             "author": data.author,
@@ -24,7 +47,10 @@ class BookGenerator:
             "content": [],
         }
 
-    def generate_table_of_contents(self) -> None:
+    @timed("generate_outline")
+    def generate_table_of_contents(
+        self, on_chapter: Callable[[dict], None] = None
+    ) -> None:
         # Define prompt
         outline_prompt = (
             f'We are writing an eBook called "{self.book["title"]}". It is about'
@@ -38,54 +64,215 @@ class BookGenerator:
             " should be inside the list)."
         )
 
-        # Call API
-        response = self.client.chat.completions.create(
-            model="gpt-3.5-turbo",
+        # Call API, parsing the outline as it streams in
+        parser = OutlineParser()
+        for token in self.client.chat_stream(
             messages=[{"role": "user", "content": outline_prompt}],
-        )
-        outline = response.choices[0].message.content.strip()
+        ):
+            for chapter, subsections in parser.feed(token):
+                self.add_chapter(chapter, subsections, on_chapter)
+
+        # Add the chapters only complete once the whole response is known
+        for chapter, subsections in parser.close():
+            self.add_chapter(chapter, subsections, on_chapter)
 
-        # Convert to python dict
-        outline = loads(outline)
+    def add_chapter(
+        self,
+        chapter: str,
+        subsections: list,
+        on_chapter: Callable[[dict], None] = None,
+    ) -> None:
+        c = len(self.book["table_of_contents"]) + 1
 
-        c, s = 1, 1
         # Format outline
-        for chapter in outline:
-            self.book["table_of_contents"].append(
-                {"chapter": chapter, "subsections": []}
-            )
-            s = 1
-            for subsection in outline[chapter]:
-                if subsection.lower().startswith("section"):
-                    subsection = subsection.split(":", 1)[1].strip()
-                if not subsection.startswith(f"{c}.{s}"):
-                    subsection = f"{c}.{s} {subsection}"
-                self.book["table_of_contents"][-1]["subsections"].append(subsection)
-                s += 1
-            c += 1
-
-    def generate_chapters(self) -> None:
-        for chapter in self.book["table_of_contents"]:
-            self.book["content"].append(
-                {"chapter": chapter["chapter"], "subsections": []}
-            )
+        self.book["table_of_contents"].append({"chapter": chapter, "subsections": []})
+        for s, subsection in enumerate(subsections, 1):
+            subsection = str(subsection).strip()
+            if subsection.lower().startswith("section") and ":" in subsection:
+                subsection = subsection.split(":", 1)[1].strip()
+            if not subsection.startswith(f"{c}.{s}"):
+                subsection = f"{c}.{s} {subsection}"
+            self.book["table_of_contents"][-1]["subsections"].append(subsection)
+
+        if on_chapter:
+            on_chapter(self.book["table_of_contents"][-1])
+
+    def generate_chapters(
+        self,
+        on_token: Callable[[int, str], None] = None,
+        on_subsection: Callable[[int, dict], None] = None,
+        completed: dict = None,
+    ) -> None:
+        with self.chapter_writer(on_token, on_subsection, completed) as write:
+            for chapter in self.book["table_of_contents"]:
+                write(chapter)
+
+    def generate_outline_and_chapters(
+        self,
+        on_token: Callable[[int, str], None] = None,
+        on_subsection: Callable[[int, dict], None] = None,
+        on_chapter: Callable[[dict], None] = None,
+        on_outline: Callable[[], None] = None,
+    ) -> None:
+        # Start writing every chapter as soon as the streamed outline contains it,
+        # so the outline latency overlaps with the first chapters instead of adding up
+        with self.chapter_writer(on_token, on_subsection) as write:
+
+            def add(chapter: dict) -> None:
+                if on_chapter:
+                    on_chapter(chapter)
+                write(chapter)
+
+            self.generate_table_of_contents(on_chapter=add)
+            if on_outline:
+                on_outline()
+
+    @contextmanager
+    def chapter_writer(
+        self,
+        on_token: Callable[[int, str], None] = None,
+        on_subsection: Callable[[int, dict], None] = None,
+        completed: dict = None,
+    ) -> Iterator[Callable[[dict], None]]:
+        # Yields a function queueing the subsections of a table of contents chapter,
+        # and waits for all of them once the caller is done queueing
+        completed = completed or {}
+        entries, futures = [], []
+
+        def generate(batch: list) -> dict:
+            if len(batch) > 1:
+                return self.generate_batch(batch, on_token)
+
+            index, chapter, subsection = batch[0]
+            # Tag the streamed tokens with the subsection they belong to
+            return {
+                index: self.generate_subsection(
+                    chapter, subsection, on_token and partial(on_token, index)
+                )
+            }
+
+        # Generate the missing subsections with a bounded pool of workers
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+
+            def write(chapter: dict) -> None:
+                # Lay out the chapter's content skeleton first, so every subsection keeps
+                # its place in the book whatever order the responses come back in
+                self.book["content"].append(
+                    {"chapter": chapter["chapter"], "subsections": []}
+                )
+
+                pending = []
+                for subsection in chapter["subsections"]:
+                    entry = {"subsection": subsection, "paragraphs": []}
+                    self.book["content"][-1]["subsections"].append(entry)
 
-            for subsection in chapter["subsections"]:
-                # Define prompt
-                outline_prompt = f'Write a full text content for the subsection: "{subsection}" for the chapter: "{chapter["chapter"]}".'
+                    index = len(entries)
+                    entries.append(entry)
+                    if index in completed:
+                        entry["paragraphs"] = completed[index]
+                        continue
 
-                # Call API
-                response = self.client.chat.completions.create(
-                    model="gpt-3.5-turbo",
+                    paragraphs = self.reuse and self.reuse(chapter["chapter"], subsection)
+                    if paragraphs:
+                        entry["paragraphs"] = paragraphs
+                        if on_subsection:
+                            on_subsection(index, entry)
+                    else:
+                        pending.append((index, chapter["chapter"], subsection))
+
+                # Group the missing subsections of the chapter into batches
+                # (in the caller's context, which holds the priority of its API calls)
+                for i in range(0, len(pending), self.batch_size):
+                    futures.append(
+                        executor.submit(
+                            copy_context().run, generate, pending[i : i + self.batch_size]
+                        )
+                    )
+
+            yield write
+
+            # Hand over every subsection as soon as it is done, so that a failing
+            # request does not lose the subsections generated around it
+            error = None
+            for future in as_completed(futures):
+                try:
+                    results = future.result()
+                except Exception as e:
+                    error = error or e
+                    continue
+
+                for index, paragraphs in results.items():
+                    entries[index]["paragraphs"] = paragraphs
+                    if on_subsection:
+                        on_subsection(index, entries[index])
+
+        if error is not None:
+            raise error
+
+    @timed("generate_batch")
+    def generate_batch(
+        self, batch: list, on_token: Callable[[int, str], None] = None
+    ) -> dict:
+        chapter = batch[0][1]
+        numbers = {index: subsection.split(" ", 1)[0] for index, _, subsection in batch}
+
+        # Define prompt
+        outline_prompt = (
+            f'Write a full text content for each of the following subsections of the chapter: "{chapter}".\n'
+            + "\n".join(subsection for _, _, subsection in batch)
+            + "\nOutput Format: JSON object using double quotes with key: the subsection"
+            ' number (e.g. "1.1"), value: the full text content of the subsection as a'
+            " single string with the paragraphs separated by blank lines."
+        )
+
+        # Call API, asking for a JSON object
+        try:
+            outline = loads(
+                self.client.chat(
                     messages=[{"role": "user", "content": outline_prompt}],
+                    response_format={"type": "json_object"},
                 )
-                outline = response.choices[0].message.content.strip()
+            )
+        except ValueError:
+            outline = {}
+        if not isinstance(outline, dict):
+            outline = {}
+
+        results = {}
+        for index, chapter, subsection in batch:
+            text = outline.get(numbers[index])
 
-                self.book["content"][-1]["subsections"].append(
-                    {"subsection": subsection, "paragraphs": []}
+            # Split response into paragraphs
+            if isinstance(text, str) and text.strip():
+                results[index] = text.strip().split("\n\n")
+
+            # Fall back to a dedicated request for the subsections that failed to parse
+            else:
+                results[index] = self.generate_subsection(
+                    chapter, subsection, on_token and partial(on_token, index)
                 )
 
-                # Split response into paragraphs
-                paragraphs = outline.split("\n\n")
+        return results
+
+    @timed("generate_subsection")
+    def generate_subsection(
+        self, chapter: str, subsection: str, on_token: Callable[[str], None] = None
+    ) -> list:
+        # Define prompt
+        outline_prompt = f'Write a full text content for the subsection: "{subsection}" for the chapter: "{chapter}".'
+        messages = [{"role": "user", "content": outline_prompt}]
+
+        # Call API
+        if on_token is None:
+            outline = self.client.chat(messages=messages).strip()
+
+        # Stream the response, forwarding the tokens as they arrive
+        else:
+            tokens = []
+            for token in self.client.chat_stream(messages=messages):
+                on_token(token)
+                tokens.append(token)
+            outline = "".join(tokens).strip()
 
-                self.book["content"][-1]["subsections"][-1]["paragraphs"] = paragraphs
+        # Split response into paragraphs
+        return outline.split("\n\n")
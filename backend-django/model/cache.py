@@ -0,0 +1,271 @@
+from collections import OrderedDict
+from hashlib import sha256
+from json import dumps
+from sqlite3 import connect
+from threading import Lock
+from time import time
+from typing import Optional
+
+
+from .metrics import CACHE_EVICTIONS, CACHE_REQUESTS
+from .settings import (
+    LLM_CACHE_BACKEND,
+    LLM_CACHE_PATH,
+    LLM_CACHE_TTL,
+    LLM_CACHE_MAX_ENTRIES,
+    LLM_CACHE_MAX_BYTES,
+)
+
+
+class ResponseCache:
+    # Base cache, also used as the no-op backend: it never stores anything
+    def __init__(
+        self,
+        ttl: float = LLM_CACHE_TTL,
+        max_entries: int = LLM_CACHE_MAX_ENTRIES,
+        max_bytes: int = LLM_CACHE_MAX_BYTES,
+    ) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._counter_lock = Lock()
+
+    @staticmethod
+    def key(*parts) -> str:
+        # Content-addressed key: the same request always hashes to the same key
+        return sha256(
+            dumps(parts, sort_keys=True, separators=(",", ":")).encode()
+        ).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.load(key)
+        with self._counter_lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        CACHE_REQUESTS.labels("miss" if value is None else "hit").inc()
+        return value
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl > 0:
+            self.store(key, value, time() + ttl)
+
+    def stats(self) -> dict:
+        return {
+            "backend": type(self).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            **self.usage(),
+        }
+
+    # Storage hooks implemented by the backends
+
+    def load(self, key: str) -> Optional[str]:
+        return None
+
+    def store(self, key: str, value: str, expires_at: float) -> None:
+        pass
+
+    def usage(self) -> dict:
+        return {"entries": 0, "bytes": 0}
+
+    def clear(self) -> None:
+        pass
+
+
+class MemoryCache(ResponseCache):
+    # Per-process LRU cache, entries are kept in least recently used order
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = Lock()
+
+    def load(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            value, expires_at = entry
+            if expires_at <= time():
+                self._remove(key)
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def store(self, key: str, value: str, expires_at: float) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = (value, expires_at)
+            self._bytes += len(value.encode())
+
+            # Evict the least recently used entries until we are back under the caps
+            while self._entries and (
+                len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+            ):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+                CACHE_EVICTIONS.inc()
+
+    def usage(self) -> dict:
+        return {"entries": len(self._entries), "bytes": self._bytes}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key: str) -> None:
+        value, _ = self._entries.pop(key)
+        self._bytes -= len(value.encode())
+
+
+class SQLiteCache(ResponseCache):
+    # Disk cache shared by every process using the same file
+    def __init__(self, path: str = LLM_CACHE_PATH, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self._lock = Lock()
+
+        self._db = connect(path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("BEGIN IMMEDIATE")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)"
+        )
+
+        # Running totals of the entries, kept by triggers so that they hold for every
+        # process writing to the file, and a write checks the caps without a scan
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS totals ("
+            " id INTEGER PRIMARY KEY CHECK (id = 0),"
+            " entries INTEGER NOT NULL,"
+            " size INTEGER NOT NULL)"
+        )
+        self._db.execute(
+            "INSERT OR IGNORE INTO totals"
+            " SELECT 0, COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+        )
+        self._db.execute(
+            "CREATE TRIGGER IF NOT EXISTS responses_insert AFTER INSERT ON responses"
+            " BEGIN UPDATE totals SET entries = entries + 1, size = size + new.size;"
+            " END"
+        )
+        self._db.execute(
+            "CREATE TRIGGER IF NOT EXISTS responses_delete AFTER DELETE ON responses"
+            " BEGIN UPDATE totals SET entries = entries - 1, size = size - old.size;"
+            " END"
+        )
+        self._db.execute(
+            "CREATE TRIGGER IF NOT EXISTS responses_update"
+            " AFTER UPDATE OF size ON responses"
+            " BEGIN UPDATE totals SET size = size + new.size - old.size; END"
+        )
+        self._db.commit()
+
+    def load(self, key: str) -> Optional[str]:
+        now = time()
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT value, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            value, expires_at = row
+            if expires_at <= now:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+
+            self._db.execute(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            return value
+
+    def store(self, key: str, value: str, expires_at: float) -> None:
+        now = time()
+        with self._lock, self._db:
+            # An upsert rather than a replace: the delete of a replace would not
+            # update the totals (SQLite does not fire its triggers)
+            self._db.execute(
+                "INSERT INTO responses VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT (key) DO UPDATE SET value = excluded.value,"
+                " size = excluded.size, expires_at = excluded.expires_at,"
+                " accessed_at = excluded.accessed_at",
+                (key, value, len(value.encode()), expires_at, now),
+            )
+            if self._within_caps():
+                return
+
+            # Drop the expired entries, then the least recently used ones over the caps
+            self._db.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+            entries, size = self._totals()
+
+            evicted = []
+            for old_key, old_size in self._db.execute(
+                "SELECT key, size FROM responses ORDER BY accessed_at"
+            ):
+                if entries <= self.max_entries and size <= self.max_bytes:
+                    break
+
+                evicted.append((old_key,))
+                entries -= 1
+                size -= old_size
+
+            self._db.executemany("DELETE FROM responses WHERE key = ?", evicted)
+            self.evictions += len(evicted)
+            CACHE_EVICTIONS.inc(len(evicted))
+
+    def usage(self) -> dict:
+        with self._lock:
+            entries, size = self._totals()
+        return {"entries": entries, "bytes": size}
+
+    def clear(self) -> None:
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM responses")
+
+    def _totals(self) -> tuple:
+        return self._db.execute("SELECT entries, size FROM totals").fetchone()
+
+    def _within_caps(self) -> bool:
+        entries, size = self._totals()
+        return entries <= self.max_entries and size <= self.max_bytes
+
+
+# Available backends, selected with the LLM_CACHE_BACKEND setting
+BACKENDS = {
+    "none": ResponseCache,
+    "memory": MemoryCache,
+    "sqlite": SQLiteCache,
+}
+
+_cache = None
+_cache_lock = Lock()
+
+
+def get_cache() -> ResponseCache:
+    # The cache is shared by every client of the process
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = BACKENDS[LLM_CACHE_BACKEND]()
+        return _cache
@@ -0,0 +1,294 @@
+from base64 import b64decode
+from collections import deque
+from importlib.util import find_spec
+from threading import Lock
+from time import perf_counter
+from typing import Callable, Iterator, TypeVar
+from httpx import Client, Limits, Timeout
+from openai import OpenAI
+
+
+from .settings import (
+    API_KEY,
+    API_BASE_URL,
+    OPENAI_TIMEOUT,
+    OPENAI_CONNECT_TIMEOUT,
+    OPENAI_MAX_CONNECTIONS,
+    OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+    OPENAI_KEEPALIVE_EXPIRY,
+)
+from .cache import ResponseCache, get_cache
+from .throttle import Backpressure, RateLimiter
+from .metrics import LLM_REQUEST_SECONDS, record_images, record_tokens
+
+
+T = TypeVar("T")
+
+
+class CallMetrics:
+    # Per-call latency of the API calls, grouped by kind of call (chat, image...),
+    # and the tokens used, grouped by model
+    def __init__(self, window: int = 1000) -> None:
+        self.window = window
+        self._calls = {}
+        self._tokens = {}
+        self._lock = Lock()
+
+    def record(self, kind: str, seconds: float, error: bool = False) -> None:
+        with self._lock:
+            calls = self._calls.setdefault(
+                kind,
+                {
+                    "count": 0,
+                    "errors": 0,
+                    "total": 0.0,
+                    "max": 0.0,
+                    "recent": deque(maxlen=self.window),
+                },
+            )
+            calls["count"] += 1
+            calls["errors"] += error
+            calls["total"] += seconds
+            calls["max"] = max(calls["max"], seconds)
+            calls["recent"].append(seconds)
+
+    def record_tokens(self, model: str, usage) -> None:
+        # `usage` is the usage object of a response, streamed responses do not have one
+        if usage is None:
+            return
+
+        with self._lock:
+            tokens = self._tokens.setdefault(model, {"prompt": 0, "completion": 0})
+            tokens["prompt"] += usage.prompt_tokens
+            tokens["completion"] += usage.completion_tokens
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            calls = {}
+            for kind, stats in self._calls.items():
+                recent = sorted(stats["recent"])
+                calls[kind] = {
+                    "count": stats["count"],
+                    "errors": stats["errors"],
+                    "total": stats["total"],
+                    "mean": stats["total"] / stats["count"],
+                    "max": stats["max"],
+                    # Percentiles over the most recent calls only
+                    "p50": recent[len(recent) // 2],
+                    "p95": recent[min(len(recent) - 1, int(len(recent) * 0.95))],
+                }
+
+            tokens = {model: dict(usage) for model, usage in self._tokens.items()}
+            return {"calls": calls, "tokens": tokens}
+
+
+class LLMClient:
+    # Wrapper around the OpenAI client used by all the generators, every call goes
+    # through the response cache, the retry/backpressure gate, the rate limiter of its
+    # model and the call metrics
+    def __init__(
+        self,
+        openai: OpenAI = None,
+        http: Client = None,
+        cache: ResponseCache = None,
+    ) -> None:
+        self.http = http or create_http_client()
+        self.openai = openai or create_openai(self.http)
+        self.cache = cache if cache is not None else get_cache()
+        self.backpressure = Backpressure()
+        self.metrics = CallMetrics()
+        self.limiters = {}
+        self._limiters_lock = Lock()
+
+    def limiter(self, model: str) -> RateLimiter:
+        with self._limiters_lock:
+            if model not in self.limiters:
+                self.limiters[model] = RateLimiter(model)
+            return self.limiters[model]
+
+    def chat(
+        self, messages: list, model: str = "gpt-3.5-turbo", use_cache: bool = True, **params
+    ) -> str:
+        key = self.cache.key("chat", model, messages, params)
+
+        # Return the cached response if the same request was already made
+        if use_cache:
+            content = self.cache.get(key)
+            if content is not None:
+                return content
+
+        # Call API
+        limiter = self.limiter(model)
+        raw, admitted = self.timed(
+            "chat",
+            lambda: limiter.call(
+                lambda: self.openai.chat.completions.with_raw_response.create(
+                    model=model, messages=messages, **params
+                ),
+                limiter.estimate(messages, params.get("max_tokens")),
+            ),
+        )
+        # The call is over whether its response can be read or not
+        error, completion_tokens = None, None
+        try:
+            response = raw.parse()
+            content = response.choices[0].message.content
+            completion_tokens = response.usage and response.usage.completion_tokens
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            limiter.release(admitted, error, completion_tokens=completion_tokens)
+        self.metrics.record_tokens(model, response.usage)
+        if response.usage is not None:
+            record_tokens(
+                model, response.usage.prompt_tokens, response.usage.completion_tokens
+            )
+
+        self.cache.set(key, content)
+        return content
+
+    def chat_stream(
+        self, messages: list, model: str = "gpt-3.5-turbo", use_cache: bool = True, **params
+    ) -> Iterator[str]:
+        # Streamed responses share their cache entries with `chat`
+        key = self.cache.key("chat", model, messages, params)
+
+        # A cached response is yielded in one piece
+        if use_cache:
+            content = self.cache.get(key)
+            if content is not None:
+                yield content
+                return
+
+        # Call API, the latency recorded is the time to the first token
+        limiter = self.limiter(model)
+        raw, admitted = self.timed(
+            "chat_stream",
+            lambda: limiter.call(
+                lambda: self.openai.chat.completions.with_raw_response.create(
+                    model=model, messages=messages, stream=True, **params
+                ),
+                limiter.estimate(messages, params.get("max_tokens")),
+            ),
+        )
+
+        # Yield the tokens as they arrive, the call is in flight until the last one
+        tokens = []
+        error = None
+        try:
+            for chunk in raw.parse():
+                if chunk.choices and chunk.choices[0].delta.content:
+                    tokens.append(chunk.choices[0].delta.content)
+                    yield tokens[-1]
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            limiter.release(admitted, error, len(tokens))
+
+        # Streamed responses have no usage, every chunk holds a token
+        record_tokens(model, 0, len(tokens))
+        self.cache.set(key, "".join(tokens))
+
+    def image(
+        self, prompt: str, model: str = "dall-e-2", use_cache: bool = True, **params
+    ) -> bytes:
+        key = self.cache.key("image", model, prompt, params)
+
+        # Return the cached image if the same request was already made
+        if use_cache:
+            image = self.cache.get(key)
+            if image is not None:
+                return b64decode(image)
+
+        # Call API, asking for the image inline to avoid downloading it in a second request
+        limiter = self.limiter(model)
+        raw, admitted = self.timed(
+            "image",
+            lambda: limiter.call(
+                lambda: self.openai.images.with_raw_response.generate(
+                    model=model, prompt=prompt, response_format="b64_json", **params
+                )
+            ),
+        )
+        error = None
+        try:
+            response = raw.parse()
+            image = response.data[0].b64_json
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            limiter.release(admitted, error)
+        record_images(model, len(response.data))
+
+        self.cache.set(key, image)
+        return b64decode(image)
+
+    def download(self, url: str) -> bytes:
+        # Download a file (e.g. a generated image) through the same connection pool
+        def fetch() -> bytes:
+            response = self.http.get(url, follow_redirects=True)
+            response.raise_for_status()
+            return response.content
+
+        return self.timed("download", fetch)
+
+    def timed(self, kind: str, fn: Callable[[], T]) -> T:
+        # Run an API call with retries, recording its latency (retries included)
+        start = perf_counter()
+        try:
+            result = self.backpressure.call(fn)
+        except Exception:
+            self.metrics.record(kind, perf_counter() - start, error=True)
+            LLM_REQUEST_SECONDS.labels(kind, "error").observe(perf_counter() - start)
+            raise
+
+        self.metrics.record(kind, perf_counter() - start)
+        LLM_REQUEST_SECONDS.labels(kind, "ok").observe(perf_counter() - start)
+        return result
+
+
+def create_http_client() -> Client:
+    # Keep-alive connection pool, using HTTP/2 when the `h2` package is installed
+    return Client(
+        http2=find_spec("h2") is not None,
+        timeout=Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+        limits=Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+        ),
+    )
+
+
+def create_openai(http: Client) -> OpenAI:
+    # Retries are handled by the backpressure gate, not by the OpenAI client
+    return OpenAI(
+        api_key=API_KEY,
+        base_url=API_BASE_URL,
+        http_client=http,
+        timeout=Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+        max_retries=0,
+    )
+
+
+_client = None
+_client_lock = Lock()
+
+
+def get_client() -> LLMClient:
+    # The client (and so its connection pool) is shared by every generator of the process
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = LLMClient()
+        return _client
+
+
+def set_client(client: LLMClient) -> None:
+    # Replace the shared client, e.g. with one pointing to a local fake server in tests
+    global _client
+    with _client_lock:
+        _client = client
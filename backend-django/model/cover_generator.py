@@ -1,21 +1,39 @@
-from os import remove
-from requests import get
-from openai import OpenAI, OpenAIError
-from cv2 import imread, imwrite, resize, INTER_AREA
+from numpy import frombuffer, uint8
+from openai import OpenAIError
+from cv2 import (
+    imdecode,
+    imencode,
+    resize,
+    INTER_AREA,
+    IMREAD_COLOR,
+    IMWRITE_JPEG_QUALITY,
+)
 
 
-from .settings import API_KEY
+from .client import get_client
+from .files import atomic_write
+from .metrics import timed
+from .settings import COVER_SIZES, COVER_JPEG_QUALITY
+
+
+# Paths of every size of a cover, from the path of its print size ({id}.png)
+def cover_paths(cover: str) -> dict:
+    base = cover.rsplit(".", 1)[0]
+    return {
+        size: cover if size == "print" else f"{base}_{size}.jpg"
+        for size in COVER_SIZES
+    }
 
 
 class CoverGenerator:
     def __init__(self, book) -> None:
-        self.client = OpenAI(api_key=API_KEY)
+        self.client = get_client()
         self.book = book
 
     def generate_cover(self) -> str:
         # Check if the cover is not AI generated
         if self.book["cover"] != "null":
-            image_url = self.book["cover"]
+            image = self.client.download(self.book["cover"])
         # If the cover is AI generated use the API to generate a new one
         else:
             # Define prompt that will generate a good prompt for the book's topic
@@ -25,11 +43,9 @@ class CoverGenerator:
             )
 
             # Call API to generate the prompt
-            response_prompt = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
+            outline = self.client.chat(
                 messages=[{"role": "user", "content": outline_prompt}],
-            )
-            outline = response_prompt.choices[0].message.content.strip()
+            ).strip()
 
             # Add a general description to the outline
             outline = (
@@ -39,51 +55,57 @@ class CoverGenerator:
 
             try:
                 # Call DALL-E-2 API to generate the image
-                response = self.client.images.generate(
+                image = self.client.image(
                     model="dall-e-2",
                     prompt=outline,
                     size="1024x1024",
                     n=1,
                 )
-                image_url = response.data[0].url
             except OpenAIError as e:
                 raise e
 
-        # Save the image to {id}_generated.png
-        image = get(image_url).content
-        with open(f"media/covers/{self.book['id']}_generated.png", "wb+") as file:
-            file.write(image)
+        # Decode the image in memory
+        image = imdecode(frombuffer(image, uint8), IMREAD_COLOR)
+        if image is None:
+            raise ValueError(f"Could not decode the cover of {self.book['id']}")
 
-        # Resize the image
-        image = imread(f"media/covers/{self.book['id']}_generated.png")
-        self.resize_image(image)
+        # Crop the image once, then write every size of the cover from it
+        self.save_sizes(self.crop_image(image))
 
         # Return the path to the final generated cover
         return f"media/covers/{self.book['id']}.png"
 
-    def resize_image(self, image) -> None:
+    def crop_image(self, image):
+        # Center crop the image to the aspect ratio of the cover (a view, nothing is copied)
+        width, height = COVER_SIZES["print"]
         original_height, original_width = image.shape[:2]
-        new_height = 1250
-        new_width = int(original_width * (new_height / original_height))
-
-        if new_width < 1000:
-            new_width = 1000
-            new_height = int(original_height * (new_width / original_width))
-
-        # Resize the image to the new dimensions
-        image = resize(image, (new_width, new_height), interpolation=INTER_AREA)
 
-        # Calculate the cropping box (center crop to 1000x1250)
-        left = (new_width - 1000) // 2
-        right = left + 1000
-        top = (new_height - 1250) // 2
-        bottom = top + 1250
-
-        # Crop the image to 1000x1250 from the center to fit the cover
-        image = image[top:bottom, left:right]
-
-        # Delete the generated image
-        remove(f"media/covers/{self.book['id']}_generated.png")
-
-        # Save the final image to {id}.png
-        imwrite(f"media/covers/{self.book['id']}.png", image)
+        if original_width * height > original_height * width:
+            new_width = original_height * width // height
+            left = (original_width - new_width) // 2
+            return image[:, left : left + new_width]
+
+        new_height = original_width * height // width
+        top = (original_height - new_height) // 2
+        return image[top : top + new_height, :]
+
+    @timed("cover_sizes")
+    def save_sizes(self, image) -> None:
+        for size, path in cover_paths(f"media/covers/{self.book['id']}.png").items():
+            # Resize the image to the dimensions of the size
+            resized = resize(image, COVER_SIZES[size], interpolation=INTER_AREA)
+
+            # Encode it once and write it, moved in place once complete so that the
+            # cover being served is never half-written
+            if size == "print":
+                encoded, data = imencode(".png", resized)
+            else:
+                encoded, data = imencode(
+                    ".jpg", resized, [IMWRITE_JPEG_QUALITY, COVER_JPEG_QUALITY]
+                )
+            if not encoded:
+                raise ValueError(
+                    f"Could not encode the {size} cover of {self.book['id']}"
+                )
+            with atomic_write(path) as partial, open(partial, "wb") as file:
+                file.write(data.tobytes())
@@ -0,0 +1,310 @@
+from functools import lru_cache
+from hashlib import sha256
+from json import dumps, loads
+from os import listdir, makedirs, path, remove, utime
+from shutil import rmtree
+from struct import pack
+from zlib import (
+    DEFLATED,
+    MAX_WBITS,
+    Z_DEFAULT_COMPRESSION,
+    Z_FINISH,
+    Z_SYNC_FLUSH,
+    compressobj,
+    crc32,
+)
+
+
+from .document_generator import DocumentGenerator
+from .docx_writer import STYLES, DocxBody, add_styles, serialize
+from .files import atomic_write, builders, building
+from .metrics import timed
+from .settings import DOCUMENT_PARTS_ROOT
+
+
+# Documents assembled from cached parts, so that updating a book only renders the
+# chapters that changed. The parts of a book are kept in {DOCUMENT_PARTS_ROOT}/{id}/,
+# out of the served media:
+# - its head, for an author, title and cover: every part of the package but the body
+#   (template, cover page, styles), and the body before and after the text
+# - one part per chapter, the XML of the chapter, named after the hash of its text
+# Each part is compressed on its own into a deflate segment ending on a sync flush,
+# and such segments can be concatenated: a document is assembled by copying them into
+# the file, only the table of contents and the new chapters are compressed again.
+
+TEMPLATE = "templates/literature.docx"
+
+# Date of the parts of the documents, the same text always gives the same file
+DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+# Version of the format of the parts, the parts of another version are not read
+PARTS_FORMAT = 2
+
+
+# CRC-32 of concatenated data from the CRC-32s of its pieces, as zlib's crc32_combine:
+# polynomials over GF(2) modulo the (reflected) CRC-32 polynomial. Appending a piece of
+# `size` bytes to data multiplies its CRC by x^(8 * size), the "shift" of the piece.
+
+POLYNOMIAL = 0xEDB88320
+
+
+def multiply(a: int, b: int) -> int:
+    # a * b modulo the polynomial, `a` is not zero
+    m, product = 1 << 31, 0
+    while True:
+        if a & m:
+            product ^= b
+            if a & (m - 1) == 0:
+                return product
+        m >>= 1
+        b = (b >> 1) ^ POLYNOMIAL if b & 1 else b >> 1
+
+
+# x^(2^k) modulo the polynomial
+POWERS = [1 << 30]
+for _ in range(31):
+    POWERS.append(multiply(POWERS[-1], POWERS[-1]))
+
+
+def crc32_shift(size: int) -> int:
+    # x^(8 * size), from the binary digits of the number of bits
+    shift, k = 1 << 31, 3
+    while size:
+        if size & 1:
+            shift = multiply(POWERS[k & 31], shift)
+        size >>= 1
+        k += 1
+    return shift
+
+
+def compress(data: bytes, final: bool = False) -> tuple:
+    # A segment of its own: (CRC-32, size, shift, deflated data), the last is `final`
+    compressor = compressobj(Z_DEFAULT_COMPRESSION, DEFLATED, -MAX_WBITS)
+    compressed = compressor.compress(data)
+    compressed += compressor.flush(Z_FINISH if final else Z_SYNC_FLUSH)
+    return crc32(data), len(data), crc32_shift(len(data)), compressed
+
+
+def join(segments: list) -> tuple:
+    # (CRC-32, size, deflated data) of the segments one after the other, in one
+    # multiplication per segment whatever its size
+    crc, size = 0, 0
+    for segment_crc, segment_size, shift, _ in segments:
+        crc = multiply(shift, crc) ^ segment_crc
+        size += segment_size
+    return crc, size, b"".join(data for _, _, _, data in segments)
+
+
+def write_zip(target: str, entries: list) -> None:
+    # A ZIP of deflated entries (name, date_time, CRC-32, size, data) written as they
+    # are, without compressing them again
+    directory = []
+    with open(target, "wb") as file:
+        for name, (year, month, day, hour, minute, second), crc, size, data in entries:
+            name = name.encode()
+            date = (year - 1980) << 9 | month << 5 | day
+            time = hour << 11 | minute << 5 | second // 2
+            fields = (DEFLATED, time, date, crc, len(data), size, len(name))
+
+            # Central directory header, then local header (no extra fields, comments,
+            # or attributes)
+            offset = file.tell()
+            directory.append(
+                pack("<IHHH", 0x02014B50, 20, 20, 0)
+                + pack("<HHHIIIH", *fields)
+                + pack("<HHHHII", 0, 0, 0, 0, 0, offset)
+                + name
+            )
+            file.write(pack("<IHH", 0x04034B50, 20, 0) + pack("<HHHIIIHH", *fields, 0))
+            file.write(name)
+            file.write(data)
+
+        start = file.tell()
+        file.write(b"".join(directory))
+        file.write(
+            pack(
+                "<IHHHHIIH",
+                0x06054B50,
+                0,
+                0,
+                len(directory),
+                len(directory),
+                file.tell() - start,
+                start,
+                0,
+            )
+        )
+
+
+@lru_cache(maxsize=1)
+def render_key() -> str:
+    # The parts depend on the template, the styles and their format, they are kept
+    # apart per version
+    with open(TEMPLATE, "rb") as file:
+        digest = sha256(file.read())
+    digest.update(repr((STYLES, PARTS_FORMAT)).encode())
+    return digest.hexdigest()[:16]
+
+
+def parts_directory(book_id: str) -> str:
+    return path.join(DOCUMENT_PARTS_ROOT, book_id, render_key())
+
+
+def missing_chapters(book_id: str, hashes: set) -> set:
+    # Hashes of the chapters that were never rendered for this book
+    directory = parts_directory(book_id)
+    return {
+        content_hash
+        for content_hash in hashes
+        if not path.exists(path.join(directory, f"{content_hash}.chapter"))
+    }
+
+
+# A part is a line of JSON metadata, followed by the deflated data it describes
+# (`sizes` bytes each)
+
+
+def write_part(file: str, metadata: dict, blobs: list) -> None:
+    header = dumps({**metadata, "sizes": [len(blob) for blob in blobs]})
+    with atomic_write(file) as partial, open(partial, "wb") as output:
+        output.write(header.encode() + b"\n")
+        for blob in blobs:
+            output.write(blob)
+
+
+def read_part(file: str) -> tuple:
+    # (metadata, blobs)
+    with open(file, "rb") as source:
+        metadata = loads(source.readline())
+        return metadata, [source.read(size) for size in metadata.pop("sizes")]
+
+
+def write_segment(file: str, segment: tuple) -> None:
+    crc, size, shift, data = segment
+    write_part(file, {"crc": crc, "size": size, "shift": shift}, [data])
+
+
+def read_segment(file: str) -> tuple:
+    metadata, (data,) = read_part(file)
+    return metadata["crc"], metadata["size"], metadata["shift"], data
+
+
+def write_head(file: str, head: dict) -> None:
+    entries = head["entries"]
+    write_part(
+        file,
+        {
+            "entries": [entry[:4] for entry in entries],
+            "start": head["start"][:3],
+            "end": head["end"][:3],
+            "styles": head["styles"],
+        },
+        [entry[4] for entry in entries] + [head["start"][3], head["end"][3]],
+    )
+
+
+def read_head(file: str) -> dict:
+    metadata, blobs = read_part(file)
+    return {
+        "entries": [
+            (name, tuple(date_time), crc, size, data)
+            for (name, date_time, crc, size), data in zip(metadata["entries"], blobs)
+        ],
+        "start": (*metadata["start"], blobs[-2]),
+        "end": (*metadata["end"], blobs[-1]),
+        "styles": metadata["styles"],
+    }
+
+
+def render_head(book: dict) -> dict:
+    # The cover page on the template, with the styles of the book
+    document = DocumentGenerator(book)
+    document.generate_cover_page()
+    styles = add_styles(document.document)
+
+    items, start, end = serialize(document.document)
+    entries = []
+    for item, data in items:
+        crc, size, _, data = compress(data, final=True)
+        entries.append((item.filename, item.date_time, crc, size, data))
+    return {
+        "entries": entries,
+        "start": compress(start),
+        "end": compress(end, final=True),
+        "styles": styles,
+    }
+
+
+# Build and save the document of a book from its parts, rendering the missing ones, as
+# a module-level function so that it can run in a worker process. `book` has the
+# author, title, cover and table of contents of the book, the `hashes` of all of its
+# chapters and the text of the `chapters` without a part, by hash.
+@timed("document_parts")
+def build_document(book: dict) -> str:
+    directory = parts_directory(book["id"])
+    book_directory = path.dirname(directory)
+
+    # The parts of the book are not evicted while it is built
+    makedirs(DOCUMENT_PARTS_ROOT, exist_ok=True)
+    with building(book_directory):
+        makedirs(directory, exist_ok=True)
+
+        cover = book["cover"]
+        head_key = sha256(
+            dumps(
+                [
+                    book["author"],
+                    book["title"],
+                    cover,
+                    path.getmtime(cover) if path.exists(cover) else 0,
+                ]
+            ).encode()
+        ).hexdigest()[:16]
+        head_file = path.join(directory, f"head-{head_key}.part")
+        if path.exists(head_file):
+            head = read_head(head_file)
+        else:
+            head = render_head(book)
+            write_head(head_file, head)
+        # Marks the parts of the book as used, for the eviction of the artifact store
+        utime(head_file)
+
+        body = DocxBody(head["styles"])
+        for content_hash, chapter in book["chapters"].items():
+            write_segment(
+                path.join(directory, f"{content_hash}.chapter"),
+                compress(body.render_chapter(chapter).encode()),
+            )
+
+        segments = [
+            head["start"],
+            compress(
+                body.render_table_of_contents(book["table_of_contents"]).encode()
+            ),
+        ]
+        segments += [
+            read_segment(path.join(directory, f"{content_hash}.chapter"))
+            for content_hash in book["hashes"]
+        ]
+        segments.append(head["end"])
+
+        # Move the document in place only once complete
+        target = f"media/docs/{book['id']}.docx"
+        with atomic_write(target) as partial:
+            write_zip(
+                partial,
+                head["entries"] + [("word/document.xml", DATE_TIME, *join(segments))],
+            )
+
+        # Drop the parts of the previous versions of the book, unless another build of
+        # the book uses them
+        if builders(book_directory) == 1:
+            used = {f"{content_hash}.chapter" for content_hash in book["hashes"]}
+            used.add(path.basename(head_file))
+            for name in listdir(directory):
+                if name not in used and not name.startswith("."):
+                    remove(path.join(directory, name))
+            for name in listdir(book_directory):
+                if name != render_key():
+                    rmtree(path.join(book_directory, name), ignore_errors=True)
+        return target
@@ -0,0 +1,168 @@
+from io import BytesIO
+from re import sub
+from xml.sax.saxutils import escape
+from zipfile import ZipFile
+from docx.document import Document
+from docx.enum.style import WD_STYLE_TYPE
+from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
+from docx.shared import Pt
+
+
+from .settings import TOC_FONT, TITLE_FONT, CONTENT_FONT
+
+
+# Paragraph styles of the book, added to the document once so that the paragraphs only
+# reference them instead of formatting every run (sizes and spacing in points)
+STYLES = {
+    "Book Contents Title": {
+        "base": "Title",
+        "font": TOC_FONT,
+        "page_break_before": True,
+    },
+    "Book Contents Chapter": {"base": "Heading 1", "font": TOC_FONT, "size": 20},
+    "Book Contents Section": {"base": "Heading 2", "font": TITLE_FONT, "size": 18},
+    # Pushed down to where 13 blank lines used to put the title, mid-page
+    "Book Chapter": {
+        "base": "Normal",
+        "font": TITLE_FONT,
+        "size": 30,
+        "bold": True,
+        "alignment": WD_PARAGRAPH_ALIGNMENT.CENTER,
+        "space_before": 290,
+        "page_break_before": True,
+    },
+    "Book Section": {
+        "base": "Heading 1",
+        "font": TITLE_FONT,
+        "size": 24,
+        "page_break_before": True,
+    },
+    "Book Text": {
+        "base": "Normal",
+        "font": CONTENT_FONT,
+        "size": 16,
+        "alignment": WD_PARAGRAPH_ALIGNMENT.JUSTIFY,
+        "space_after": 12,
+    },
+    "Book First Text": {"base": "Book Text", "space_before": 12},
+}
+
+# Characters that are not allowed in XML
+INVALID_XML = r"[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]"
+
+
+class DocxBody:
+    # Renders the XML of the body of a book, its paragraphs referencing the book styles
+    # by their ids in the document
+    def __init__(self, styles: dict) -> None:
+        self.styles = styles
+
+    def render_table_of_contents(self, table_of_contents: list) -> str:
+        xml = [
+            self.paragraph("Book Contents Title", run("Table of Contents")),
+            "<w:p/>",
+        ]
+
+        for chapter in table_of_contents:
+            xml.append(
+                self.paragraph("Book Contents Chapter", run(chapter.get("chapter")))
+            )
+
+            for subsection in chapter.get("subsections"):
+                section_number, section_title = subsection.split(" ", 1)
+                xml.append(
+                    self.paragraph(
+                        "Book Contents Section",
+                        run(section_number + " ", bold=True),
+                        run(section_title),
+                    )
+                )
+
+            xml.append("<w:p/>")
+
+        return "".join(xml)
+
+    def render_chapter(self, chapter: dict) -> str:
+        title = chapter.get("chapter")
+        if title.lower().startswith("chapter") and ":" in title:
+            title = title.split(":", 1)[1].strip()
+        xml = [self.paragraph("Book Chapter", run(title))]
+
+        for subsection in chapter["subsections"]:
+            xml.append(self.paragraph("Book Section", run(subsection["subsection"])))
+
+            # Skip the paragraphs repeating the title of the subsection
+            titles = (
+                subsection["subsection"].lower(),
+                subsection["subsection"].split(" ", 1)[1].strip().lower(),
+            )
+            style = "Book First Text"
+            for paragraph in subsection["paragraphs"]:
+                if paragraph.lower() in titles:
+                    continue
+
+                xml.append(self.paragraph(style, run(paragraph)))
+                style = "Book Text"
+
+        return "".join(xml)
+
+    def paragraph(self, style: str, *runs: str) -> str:
+        return (
+            f'<w:p><w:pPr><w:pStyle w:val="{self.styles[style]}"/></w:pPr>'
+            f"{''.join(runs)}</w:p>"
+        )
+
+
+def serialize(document: Document) -> tuple:
+    # The document as it is (template, cover page and styles): its parts but the body
+    # as (ZipInfo, data), then the XML of the body before and after where the text of
+    # the book goes (between its current content and its section properties)
+    package = BytesIO()
+    document.save(package)
+
+    with ZipFile(package) as source:
+        items = [
+            (item, source.read(item))
+            for item in source.infolist()
+            if item.filename != "word/document.xml"
+        ]
+        xml = source.read("word/document.xml").decode()
+    split = xml.rindex("<w:sectPr")
+    return items, xml[:split].encode(), xml[split:].encode()
+
+
+def run(text: str, bold: bool = False) -> str:
+    # Line breaks and tabs become their Word elements, like python-docx does
+    text = escape(sub(INVALID_XML, "", text))
+    text = text.replace("\n", '</w:t><w:br/><w:t xml:space="preserve">')
+    text = text.replace("\t", '</w:t><w:tab/><w:t xml:space="preserve">')
+    properties = "<w:rPr><w:b/></w:rPr>" if bold else ""
+    return f'<w:r>{properties}<w:t xml:space="preserve">{text}</w:t></w:r>'
+
+
+def add_styles(document: Document) -> dict:
+    # Add the book styles to the document, returns their ids by name
+    styles = {}
+    for name, options in STYLES.items():
+        if name not in document.styles:
+            style = document.styles.add_style(name, WD_STYLE_TYPE.PARAGRAPH)
+            style.base_style = document.styles[options["base"]]
+            style.quick_style = False
+
+            if "font" in options:
+                style.font.name = options["font"]
+            if "size" in options:
+                style.font.size = Pt(options["size"])
+            if "bold" in options:
+                style.font.bold = options["bold"]
+            if "alignment" in options:
+                style.paragraph_format.alignment = options["alignment"]
+            if "space_before" in options:
+                style.paragraph_format.space_before = Pt(options["space_before"])
+            if "space_after" in options:
+                style.paragraph_format.space_after = Pt(options["space_after"])
+            if "page_break_before" in options:
+                style.paragraph_format.page_break_before = options["page_break_before"]
+
+        styles[name] = document.styles[name].style_id
+    return styles
@@ -0,0 +1,71 @@
+from contextlib import contextmanager
+from glob import escape, glob
+from os import chmod, close, path, remove, replace
+from tempfile import mkstemp
+from time import time
+
+
+# Files written by several threads and processes at once (the documents, PDFs and
+# exports of the books, and the parts they are built from)
+
+
+def partial_path(target: str, suffix: str = ".part") -> str:
+    # A new empty file next to `target`, to write it before moving it in place. It is
+    # unique to the caller (concurrent writers of a file never share one), and hidden.
+    directory, name = path.split(target)
+    descriptor, partial = mkstemp(
+        prefix=f".{name}.", suffix=suffix, dir=directory or "."
+    )
+    close(descriptor)
+    # Readable like any other file once moved in place (mkstemp creates it private)
+    chmod(partial, 0o644)
+    return partial
+
+
+@contextmanager
+def atomic_write(target: str, suffix: str = ".part"):
+    # Yields the path to write `target` to, moved in place if the block succeeds,
+    # so that a reader never gets a partial file
+    partial = partial_path(target, suffix)
+    try:
+        yield partial
+        replace(partial, target)
+    except BaseException:
+        if path.exists(partial):
+            remove(partial)
+        raise
+
+
+# Markers of the files and directories being built, in every process, which the eviction
+# of the artifact store (api/artifacts.py) leaves alone. The markers left by a process
+# that died are ignored after MARKER_TIMEOUT seconds.
+MARKER_TIMEOUT = 3600
+
+
+@contextmanager
+def building(target: str):
+    marker = partial_path(target.rstrip("/"), ".building")
+    try:
+        yield
+    finally:
+        try:
+            remove(marker)
+        except FileNotFoundError:
+            pass
+
+
+def builders(target: str) -> int:
+    # Number of builds of `target` in progress
+    directory, name = path.split(target.rstrip("/"))
+    count = 0
+    pattern = path.join(escape(directory or "."), f".{escape(name)}.*.building")
+    for marker in glob(pattern):
+        try:
+            count += time() - path.getmtime(marker) < MARKER_TIMEOUT
+        except FileNotFoundError:
+            pass
+    return count
+
+
+def is_building(target: str) -> bool:
+    return builders(target) > 0
@@ -0,0 +1,122 @@
+from atexit import register
+from contextlib import contextmanager
+from json import dumps
+from logging import ERROR, getLevelName, getLogger
+from os import getenv, getpid, makedirs
+from time import perf_counter
+
+
+# Loads the .env file, before the metrics read PROMETHEUS_MULTIPROC_DIR
+from .settings import LLM_PRICES, IMAGE_PRICES
+
+
+# Metrics of every process (web server, job workers, render processes) are written to
+# this directory when it is set, so that a single /metrics endpoint serves all of them
+MULTIPROCESS_DIR = getenv("PROMETHEUS_MULTIPROC_DIR")
+if MULTIPROCESS_DIR:
+    makedirs(MULTIPROCESS_DIR, exist_ok=True)
+
+from prometheus_client import Counter, Gauge, Histogram
+from prometheus_client.multiprocess import mark_process_dead
+
+
+logger = getLogger("aiscript")
+
+# Durations (in seconds) from a cached response to a whole book
+BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+STAGE_SECONDS = Histogram(
+    "aiscript_stage_seconds",
+    "Duration of the stages of the pipeline and of the generators",
+    ["stage"],
+    buckets=BUCKETS,
+)
+LLM_REQUEST_SECONDS = Histogram(
+    "aiscript_llm_request_seconds",
+    "Latency of the API calls, retries included (time to first token when streamed)",
+    ["kind", "outcome"],
+    buckets=BUCKETS,
+)
+LLM_TOKENS = Counter(
+    "aiscript_llm_tokens",
+    "Tokens used by the API calls (prompt tokens of streamed calls are not reported)",
+    ["model", "type"],
+)
+LLM_COST = Counter(
+    "aiscript_llm_cost_dollars", "Estimated cost of the API calls", ["model"]
+)
+LLM_RETRIES = Counter(
+    "aiscript_llm_retries", "API calls retried, by error", ["reason"]
+)
+LLM_THROTTLE_SECONDS = Histogram(
+    "aiscript_llm_throttle_seconds",
+    "Time the API calls waited for the rate limiter, by priority",
+    ["priority"],
+    buckets=BUCKETS,
+)
+LLM_CONCURRENCY_LIMIT = Gauge(
+    "aiscript_llm_concurrency_limit",
+    "Adaptive limit of the API calls in flight, by model (summed over the processes)",
+    ["model"],
+    multiprocess_mode="livesum",
+)
+CACHE_REQUESTS = Counter(
+    "aiscript_llm_cache_requests", "Lookups of the API response cache", ["result"]
+)
+CACHE_EVICTIONS = Counter(
+    "aiscript_llm_cache_evictions", "Responses evicted from the API response cache"
+)
+PDF_SECONDS = Histogram(
+    "aiscript_pdf_conversion_seconds",
+    "Duration of the PDF conversions, waiting in the queue included",
+    ["backend", "outcome"],
+    buckets=BUCKETS,
+)
+PDF_QUEUE = Gauge(
+    "aiscript_pdf_queue_depth",
+    "Documents waiting for a PDF converter worker",
+    multiprocess_mode="livesum",
+)
+PDF_RESTARTS = Counter(
+    "aiscript_pdf_worker_restarts", "PDF converter workers restarted", ["backend"]
+)
+EVENTS = Counter(
+    "aiscript_events", "Notable events (mostly errors), by name", ["event", "level"]
+)
+
+# The live gauges of a process are dropped when it exits
+if MULTIPROCESS_DIR:
+    register(mark_process_dead, getpid())
+
+
+@contextmanager
+def timed(stage: str):
+    # Record the duration of the block in the stage histogram
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(stage).observe(perf_counter() - start)
+
+
+def event(name: str, level: int = ERROR, **fields) -> None:
+    # Count the event and log it as a single JSON line
+    EVENTS.labels(name, getLevelName(level).lower()).inc()
+    logger.log(level, dumps({"event": name, **fields}, default=str))
+
+
+def record_tokens(model: str, prompt: int, completion: int) -> None:
+    LLM_TOKENS.labels(model, "prompt").inc(prompt)
+    LLM_TOKENS.labels(model, "completion").inc(completion)
+
+    # Prices are in dollars per million tokens
+    prices = LLM_PRICES.get(model)
+    if prices:
+        LLM_COST.labels(model).inc(
+            (prompt * prices["prompt"] + completion * prices["completion"]) / 1e6
+        )
+
+
+def record_images(model: str, count: int) -> None:
+    if model in IMAGE_PRICES:
+        LLM_COST.labels(model).inc(count * IMAGE_PRICES[model])
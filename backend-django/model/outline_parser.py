@@ -0,0 +1,133 @@
+from ast import literal_eval
+from json import loads
+from re import sub
+
+
+class OutlineParser:
+    # Incremental parser for the outline returned by the model: a dict of
+    # chapter title -> list of subsection titles. It is fed the response as it
+    # streams in, and hands over every chapter as soon as its list is closed.
+    # It tolerates code fences, text around the dict, single quotes and trailing commas.
+    def __init__(self) -> None:
+        self.buffer = ""
+        self.chapters = []
+
+        self._pos = 0
+        self._state = "start"
+        self._chapter = None
+        self._subsections = []
+
+    def feed(self, text: str) -> list:
+        # Returns the chapters completed by this piece of text
+        self.buffer += text
+        count = len(self.chapters)
+        self._parse()
+        return self.chapters[count:]
+
+    def close(self) -> list:
+        # Returns the remaining chapters, once the whole response is known
+        count = len(self.chapters)
+
+        # Nothing could be parsed incrementally, try harder on the whole response
+        if not self.chapters:
+            self.chapters = list(parse_outline(self.buffer).items())
+
+        # A chapter left open by a truncated response is kept with what it has
+        elif self._state == "list" and self._subsections:
+            self.chapters.append((self._chapter, self._subsections))
+            self._state = "done"
+
+        return self.chapters[count:]
+
+    def _parse(self) -> None:
+        while self._pos < len(self.buffer) and self._state != "done":
+            char = self.buffer[self._pos]
+
+            # Skip everything (code fences, explanations...) until the dict opens
+            if self._state == "start":
+                if char == "{":
+                    self._state = "key"
+                self._pos += 1
+
+            # Waiting for a chapter title, or the end of the dict
+            elif self._state == "key":
+                if char in "\"'":
+                    string = self._string()
+                    if string is None:
+                        return
+                    self._chapter = string
+                    self._state = "colon"
+                    continue
+                if char == "}":
+                    self._state = "done"
+                self._pos += 1
+
+            # Waiting for the list of subsections of the chapter
+            elif self._state == "colon":
+                if char == "[":
+                    self._subsections = []
+                    self._state = "list"
+                self._pos += 1
+
+            # Inside the list: subsection titles separated by commas
+            elif self._state == "list":
+                if char in "\"'":
+                    string = self._string()
+                    if string is None:
+                        return
+                    self._subsections.append(string)
+                    continue
+                if char == "]":
+                    self.chapters.append((self._chapter, self._subsections))
+                    self._state = "key"
+                self._pos += 1
+
+    def _string(self):
+        # Parse the quoted string starting at the current position,
+        # returns None (without moving) if it is not complete yet
+        quote = self.buffer[self._pos]
+        chars = []
+        i = self._pos + 1
+        while i < len(self.buffer):
+            char = self.buffer[i]
+            if char == "\\":
+                if i + 1 >= len(self.buffer):
+                    return None
+                chars.append(
+                    {"n": "\n", "t": "\t"}.get(self.buffer[i + 1], self.buffer[i + 1])
+                )
+                i += 2
+                continue
+            if char == quote:
+                self._pos = i + 1
+                return "".join(chars).strip()
+            chars.append(char)
+            i += 1
+        return None
+
+
+def parse_outline(text: str) -> dict:
+    # Parse a complete outline, repairing the usual formatting issues of the model
+    text = text.strip()
+
+    # Remove the Markdown code fences and anything around the dict
+    text = sub(r"```[a-zA-Z]*", "", text)
+    start, end = text.find("{"), text.rfind("}")
+    if start != -1 and end > start:
+        text = text[start : end + 1]
+
+    # Remove the trailing commas
+    text = sub(r",\s*([\]}])", r"\1", text)
+
+    try:
+        outline = loads(text)
+    except ValueError:
+        # Python dict syntax (single quotes...)
+        try:
+            outline = literal_eval(text)
+        except (ValueError, SyntaxError):
+            outline = None
+
+    if not isinstance(outline, dict):
+        raise ValueError(f"Could not parse the outline: {text[:200]}")
+    return outline
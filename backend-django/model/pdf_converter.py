@@ -0,0 +1,489 @@
+from abc import ABC, abstractmethod
+from atexit import register
+from concurrent.futures import Future
+from importlib.util import find_spec
+from multiprocessing import get_context
+from os import killpg, makedirs, path, replace
+from pathlib import Path
+from queue import Full, Queue
+from shutil import rmtree, which
+from signal import SIGKILL, SIGTERM
+from socket import socket
+from subprocess import DEVNULL, PIPE, Popen, TimeoutExpired
+from sys import platform
+from tempfile import mkdtemp
+from threading import Lock, Thread
+from time import perf_counter, sleep
+from xmlrpc.client import Fault, ProtocolError, ServerProxy, Transport
+
+
+from .files import atomic_write
+from .metrics import PDF_QUEUE, PDF_RESTARTS, PDF_SECONDS, event
+from .settings import (
+    PDF_BACKEND,
+    PDF_WORKERS,
+    PDF_QUEUE_SIZE,
+    PDF_TIMEOUT,
+    PDF_STARTUP_TIMEOUT,
+    LIBREOFFICE_PATH,
+    LIBREOFFICE_PROFILE_DIR,
+    LIBREOFFICE_UNOSERVER,
+    ASPOSE_LICENSE,
+)
+
+
+class ConversionError(Exception):
+    pass
+
+
+class PdfEngine(ABC):
+    # Base converter worker, owned by a single thread of the pool. `start` warms it up,
+    # `convert` starts it first if needed, and a worker that crashed or hung is
+    # stopped so that the next conversion starts a fresh one
+    concurrent = True
+
+    def __init__(self, worker: int) -> None:
+        self.worker = worker
+        self.restarts = 0
+
+    def start(self) -> None:
+        pass
+
+    @abstractmethod
+    def convert(self, source: str, target: str, timeout: float) -> None:
+        pass
+
+    def stop(self) -> None:
+        pass
+
+    def recover(self) -> None:
+        self.stop()
+        self.restarts += 1
+        PDF_RESTARTS.labels(type(self).__name__.removesuffix("Engine").lower()).inc()
+
+
+def _aspose_worker(connection) -> None:
+    # Runs in the child process of an AsposeEngine: Aspose (and its runtime) is
+    # loaded and licensed once, then converts the documents it is sent one by one
+    from aspose.words import Document, License
+
+    try:
+        License().set_license(ASPOSE_LICENSE)
+    except Exception as e:
+        event("aspose_license_failed", license=ASPOSE_LICENSE, error=str(e))
+
+    connection.send(None)
+    while True:
+        try:
+            job = connection.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+
+        source, target = job
+        try:
+            Document(source).save(target)
+            connection.send(None)
+        except Exception as e:
+            connection.send(str(e))
+
+
+class AsposeEngine(PdfEngine):
+    # Persistent child process running Aspose, it can be killed when a conversion
+    # hangs or crashes without taking the whole server down with it
+    def __init__(self, worker: int) -> None:
+        super().__init__(worker)
+        self._context = get_context("spawn")
+        self._process = None
+        self._connection = None
+
+    def start(self) -> None:
+        if self._process is not None and self._process.is_alive():
+            return
+
+        self._connection, child = self._context.Pipe()
+        self._process = self._context.Process(
+            target=_aspose_worker,
+            args=(child,),
+            name=f"aspose-{self.worker}",
+            daemon=True,
+        )
+        self._process.start()
+        child.close()
+
+        # Wait for Aspose to be loaded
+        self._receive(PDF_STARTUP_TIMEOUT)
+
+    def convert(self, source: str, target: str, timeout: float) -> None:
+        self.start()
+        self._connection.send((source, target))
+        error = self._receive(timeout)
+        if error is not None:
+            raise ConversionError(f"Aspose could not convert {source}: {error}")
+
+    def stop(self) -> None:
+        if self._process is None:
+            return
+
+        try:
+            self._connection.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self._process.join(5)
+        if self._process.is_alive():
+            self._process.kill()
+            self._process.join()
+
+        self._connection.close()
+        self._process = self._connection = None
+
+    def _receive(self, timeout: float):
+        try:
+            if self._connection.poll(timeout):
+                return self._connection.recv()
+            error = f"timed out after {timeout}s"
+        except (EOFError, OSError):
+            error = "the worker process died"
+
+        self.recover()
+        raise ConversionError(f"Aspose worker {self.worker}: {error}")
+
+
+class TimeoutTransport(Transport):
+    # XML-RPC transport whose calls give up after `timeout` seconds
+    def __init__(self, timeout: float) -> None:
+        super().__init__()
+        self.timeout = timeout
+
+    def make_connection(self, host):
+        connection = super().make_connection(host)
+        connection.timeout = self.timeout
+        return connection
+
+
+def free_port() -> int:
+    with socket() as listener:
+        listener.bind(("127.0.0.1", 0))
+        return listener.getsockname()[1]
+
+
+class LibreOfficeEngine(PdfEngine):
+    # Runs LibreOffice on a profile of its own, created once when the worker starts
+    # (two workers never fight over the lock of a shared profile).
+    # With unoserver, the worker keeps a headless LibreOffice running and sends it
+    # every document over XML-RPC. Without it, a new LibreOffice process runs every
+    # conversion and only the profile is reused, which saves the creation of the
+    # profile but not the start of LibreOffice.
+    def __init__(self, worker: int) -> None:
+        super().__init__(worker)
+        self.binary = libreoffice_path()
+        self.server = unoserver_path()
+        self._profile = None
+        self._process = None
+        self._url = None
+
+    def start(self) -> None:
+        if self._profile is None:
+            makedirs(LIBREOFFICE_PROFILE_DIR, exist_ok=True)
+            self._profile = mkdtemp(
+                prefix=f"worker-{self.worker}-", dir=LIBREOFFICE_PROFILE_DIR
+            )
+            if not self.server:
+                # Create the profile, LibreOffice exits as soon as it is initialized
+                self._run(["--terminate_after_init"], PDF_STARTUP_TIMEOUT)
+
+        if self.server and (self._process is None or self._process.poll() is not None):
+            self._start_server()
+
+    def convert(self, source: str, target: str, timeout: float) -> None:
+        self.start()
+        if self._process is not None:
+            self._convert_remote(source, target, timeout)
+            return
+
+        # LibreOffice names the output after the source, convert it in the profile
+        # directory and move it to the requested path
+        outdir = path.join(self._profile, "output")
+        self._run(["--convert-to", "pdf", "--outdir", outdir, source], timeout)
+
+        output = path.join(outdir, Path(source).stem + ".pdf")
+        if not path.exists(output):
+            raise ConversionError(f"LibreOffice could not convert {source}")
+        replace(output, target)
+
+    def stop(self) -> None:
+        if self._process is not None:
+            # The server and the LibreOffice it started share its process group
+            try:
+                killpg(self._process.pid, SIGTERM)
+                self._process.wait(5)
+            except TimeoutExpired:
+                killpg(self._process.pid, SIGKILL)
+                self._process.wait()
+            except ProcessLookupError:
+                pass
+            self._process = self._url = None
+
+        if self._profile is not None:
+            rmtree(self._profile, ignore_errors=True)
+            self._profile = None
+
+    def _start_server(self) -> None:
+        port = free_port()
+        command = [
+            self.server,
+            "--interface",
+            "127.0.0.1",
+            "--port",
+            str(port),
+            "--uno-port",
+            str(free_port()),
+            "--user-installation",
+            Path(self._profile).as_uri(),
+        ]
+        if self.binary:
+            command += ["--executable", self.binary]
+        self._process = Popen(
+            command, stdout=DEVNULL, stderr=DEVNULL, start_new_session=True
+        )
+        self._url = f"http://127.0.0.1:{port}"
+
+        # Wait for LibreOffice to be up and the server to answer
+        deadline = perf_counter() + PDF_STARTUP_TIMEOUT
+        while perf_counter() < deadline and self._process.poll() is None:
+            try:
+                ServerProxy(self._url, transport=TimeoutTransport(1)).info()
+                return
+            except (OSError, ProtocolError):
+                sleep(0.5)
+
+        error = "died" if self._process.poll() is not None else "did not answer"
+        self.recover()
+        raise ConversionError(f"LibreOffice worker {self.worker}: unoserver {error}")
+
+    def _convert_remote(self, source: str, target: str, timeout: float) -> None:
+        # The server writes the PDF (the format follows the extension of the target)
+        server = ServerProxy(
+            self._url, transport=TimeoutTransport(timeout), allow_none=True
+        )
+        try:
+            server.convert(source, None, target)
+            return
+        except Fault as e:
+            # LibreOffice failed on this document, the server itself is fine
+            raise ConversionError(
+                f"LibreOffice could not convert {source}: {e.faultString}"
+            )
+        except (OSError, ProtocolError) as e:
+            error = str(e) or type(e).__name__
+
+        # Hung or died, start over with a new server and profile
+        self.recover()
+        raise ConversionError(f"LibreOffice worker {self.worker}: {error}")
+
+    def _run(self, args: list, timeout: float) -> None:
+        process = Popen(
+            [
+                self.binary,
+                f"-env:UserInstallation={Path(self._profile).as_uri()}",
+                "--headless",
+                "--invisible",
+                "--nodefault",
+                "--nolockcheck",
+                "--nologo",
+                "--norestore",
+                *args,
+            ],
+            stdout=DEVNULL,
+            stderr=PIPE,
+            # In its own process group, to kill the processes LibreOffice forks too
+            start_new_session=True,
+        )
+
+        try:
+            _, stderr = process.communicate(timeout=timeout)
+        except TimeoutExpired:
+            killpg(process.pid, SIGKILL)
+            process.wait()
+            error = f"timed out after {timeout}s"
+        else:
+            if process.returncode == 0:
+                return
+            error = f"exited with {process.returncode}: {stderr.decode().strip()}"
+
+        # The profile may be left locked or corrupted, start over with a new one
+        self.recover()
+        raise ConversionError(f"LibreOffice worker {self.worker} {error}")
+
+
+class Docx2PdfEngine(PdfEngine):
+    # Converts through Microsoft Word (Windows/MacOS only), which handles a single
+    # document at a time
+    concurrent = False
+
+    def convert(self, source: str, target: str, timeout: float) -> None:
+        from docx2pdf import convert
+
+        try:
+            convert(source, target)
+        except Exception as e:
+            raise ConversionError(f"docx2pdf could not convert {source}: {e}")
+
+
+# Available backends, selected with the PDF_BACKEND setting
+ENGINES = {
+    "aspose": AsposeEngine,
+    "libreoffice": LibreOfficeEngine,
+    "docx2pdf": Docx2PdfEngine,
+}
+
+
+def libreoffice_path() -> str:
+    return LIBREOFFICE_PATH or which("soffice") or which("libreoffice")
+
+
+def unoserver_path() -> str:
+    return LIBREOFFICE_UNOSERVER or which("unoserver")
+
+
+def select_backend() -> str:
+    if PDF_BACKEND != "auto":
+        if PDF_BACKEND not in ENGINES:
+            raise ValueError(f"Unknown PDF backend: {PDF_BACKEND}")
+        return PDF_BACKEND
+
+    # Aspose is cross-platform, then the platform-specific converters
+    if find_spec("aspose") is not None:
+        return "aspose"
+    if platform.startswith("linux") and libreoffice_path():
+        return "libreoffice"
+    return "docx2pdf"
+
+
+class PdfConverter:
+    # Pool of warm converter workers fed by a bounded queue: conversions wait for
+    # a free worker, and are refused when too many are already waiting
+    def __init__(
+        self,
+        backend: str = None,
+        workers: int = PDF_WORKERS,
+        queue_size: int = PDF_QUEUE_SIZE,
+        timeout: float = PDF_TIMEOUT,
+    ) -> None:
+        self.backend = backend or select_backend()
+        self.timeout = timeout
+
+        self.converted = 0
+        self.failed = 0
+        self._lock = Lock()
+        self._jobs = Queue(maxsize=queue_size)
+
+        engine = ENGINES[self.backend]
+        self._engines = [
+            engine(worker)
+            for worker in range(max(1, workers if engine.concurrent else 1))
+        ]
+        self._threads = [
+            Thread(
+                target=self._work,
+                args=(engine,),
+                name=f"pdf-worker-{engine.worker}",
+                daemon=True,
+            )
+            for engine in self._engines
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, source: str, target: str) -> Future:
+        future = Future()
+        try:
+            self._jobs.put(
+                (path.abspath(source), path.abspath(target), future, perf_counter()),
+                timeout=self.timeout,
+            )
+        except Full:
+            event("pdf_queue_full", backend=self.backend, source=source)
+            raise ConversionError("Too many documents are waiting to be converted")
+        PDF_QUEUE.inc()
+        return future
+
+    def convert(self, source: str, target: str) -> str:
+        # Convert a document, blocking until it is done
+        return self.submit(source, target).result()
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.backend,
+            "workers": len(self._engines),
+            "queued": self._jobs.qsize(),
+            "converted": self.converted,
+            "failed": self.failed,
+            "restarts": sum(engine.restarts for engine in self._engines),
+        }
+
+    def close(self) -> None:
+        for _ in self._threads:
+            self._jobs.put(None)
+        for thread in self._threads:
+            thread.join(self.timeout)
+
+    def _work(self, engine: PdfEngine) -> None:
+        # Warm the worker up before the first document arrives, if it fails
+        # the first conversion will try again
+        try:
+            engine.start()
+        except Exception as e:
+            event(
+                "pdf_worker_start_failed",
+                backend=self.backend,
+                worker=engine.worker,
+                error=str(e),
+            )
+
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                engine.stop()
+                return
+
+            source, target, future, queued = job
+            PDF_QUEUE.dec()
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            # Write next to the target and move it in place once complete,
+            # a half-written PDF is never visible (the extension tells Aspose the format)
+            try:
+                with atomic_write(target, f".part{path.splitext(target)[1]}") as partial:
+                    engine.convert(source, partial, self.timeout)
+                    # Some converters exit successfully without writing anything
+                    if path.getsize(partial) == 0:
+                        raise ConversionError(f"No PDF was written for {source}")
+            except Exception as e:
+                with self._lock:
+                    self.failed += 1
+                PDF_SECONDS.labels(self.backend, "error").observe(perf_counter() - queued)
+                future.set_exception(
+                    e if isinstance(e, ConversionError) else ConversionError(str(e))
+                )
+            else:
+                with self._lock:
+                    self.converted += 1
+                PDF_SECONDS.labels(self.backend, "ok").observe(perf_counter() - queued)
+                future.set_result(target)
+
+
+_converter = None
+_converter_lock = Lock()
+
+
+def get_converter() -> PdfConverter:
+    # The pool (and so its backend) is chosen once and shared by the whole process
+    global _converter
+    with _converter_lock:
+        if _converter is None:
+            _converter = PdfConverter()
+            register(_converter.close)
+        return _converter
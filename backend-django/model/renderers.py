@@ -0,0 +1,264 @@
+from abc import ABC, abstractmethod
+from html import escape
+from os import makedirs, path
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile, ZipInfo
+
+
+from .cover_generator import cover_paths
+from .files import atomic_write
+from .settings import MEDIA_URL
+
+
+# Renderers writing a book (the dict of the generator: id, author, title, cover,
+# table_of_contents, content) straight to a file, with no office suite involved.
+# The text of a book is plain text, it is escaped wherever it lands in markup.
+
+
+def anchor(c: int, s: int = None) -> str:
+    return f"chapter-{c}" if s is None else f"section-{c}-{s}"
+
+
+def web_cover(book: dict) -> str | None:
+    # The web size of the cover, if it was generated
+    cover = cover_paths(book["cover"])["web"]
+    return cover if path.exists(cover) else None
+
+
+def media_url(file: str) -> str:
+    # URL of a file of media/, the pages link to it wherever they are served from
+    return MEDIA_URL + path.relpath(file, "media")
+
+
+class Renderer(ABC):
+    extension = ""
+    content_type = ""
+
+    @abstractmethod
+    def render(self, book: dict, target: str) -> None:
+        pass
+
+
+class MarkdownRenderer(Renderer):
+    extension = "md"
+    content_type = "text/markdown; charset=utf-8"
+
+    def render(self, book: dict, target: str) -> None:
+        # Markdown viewers render the HTML found in the text, it is escaped as well
+        def text(value: str) -> str:
+            return escape(value.strip(), quote=False)
+
+        lines = [f"# {text(book['title'])}", "", f"*{text(book['author'])}*", ""]
+
+        cover = web_cover(book)
+        if cover:
+            lines += [f"![Cover]({media_url(cover)})", ""]
+
+        lines += ["## Table of Contents", ""]
+        for c, chapter in enumerate(book["content"], 1):
+            lines.append(f"- [{text(chapter['chapter'])}](#{anchor(c)})")
+            for s, subsection in enumerate(chapter["subsections"], 1):
+                lines.append(f"  - [{text(subsection['subsection'])}](#{anchor(c, s)})")
+
+        for c, chapter in enumerate(book["content"], 1):
+            lines += ["", f'<a id="{anchor(c)}"></a>', "", f"## {text(chapter['chapter'])}"]
+            for s, subsection in enumerate(chapter["subsections"], 1):
+                lines += [
+                    "",
+                    f'<a id="{anchor(c, s)}"></a>',
+                    "",
+                    f"### {text(subsection['subsection'])}",
+                ]
+                for paragraph in subsection["paragraphs"]:
+                    lines += ["", text(paragraph)]
+
+        with open(target, "w", encoding="utf-8") as file:
+            file.write("\n".join(lines) + "\n")
+
+
+STYLE = """
+body { max-width: 42em; margin: 2em auto; padding: 0 1em; font-family: Garamond, Georgia, serif; font-size: 1.1em; line-height: 1.6; }
+h1, h2, h3 { line-height: 1.2; }
+h2 { margin-top: 3em; }
+p { text-align: justify; }
+img.cover { display: block; max-width: 100%; margin: 0 auto 2em; }
+nav ol { list-style: none; padding-left: 1em; }
+"""
+
+
+def chapter_html(c: int, chapter: dict) -> str:
+    parts = [f'<h2 id="{anchor(c)}">{escape(chapter["chapter"])}</h2>']
+    for s, subsection in enumerate(chapter["subsections"], 1):
+        parts.append(f'<h3 id="{anchor(c, s)}">{escape(subsection["subsection"])}</h3>')
+        parts += [f"<p>{escape(p.strip())}</p>" for p in subsection["paragraphs"]]
+    return "\n".join(parts)
+
+
+def toc_html(book: dict, href: str = "") -> str:
+    # Nested list of links to the chapters and subsections, `href` formats the file
+    # holding a chapter (the same file by default)
+    items = []
+    for c, chapter in enumerate(book["content"], 1):
+        file = href.format(c=c)
+        sections = "".join(
+            f'<li><a href="{file}#{anchor(c, s)}">{escape(subsection["subsection"])}</a></li>'
+            for s, subsection in enumerate(chapter["subsections"], 1)
+        )
+        items.append(
+            f'<li><a href="{file}#{anchor(c)}">{escape(chapter["chapter"])}</a>'
+            f"<ol>{sections}</ol></li>"
+        )
+    return f"<ol>{''.join(items)}</ol>"
+
+
+class HtmlRenderer(Renderer):
+    # A single static page, its style inlined
+    extension = "html"
+    content_type = "text/html; charset=utf-8"
+
+    def render(self, book: dict, target: str) -> None:
+        cover = web_cover(book)
+        cover = (
+            f'<img class="cover" src="{escape(media_url(cover))}" alt="Cover">'
+            if cover
+            else ""
+        )
+
+        with open(target, "w", encoding="utf-8") as file:
+            file.write(
+                "<!DOCTYPE html>\n"
+                '<html lang="en">\n<head>\n<meta charset="utf-8">\n'
+                '<meta name="viewport" content="width=device-width, initial-scale=1">\n'
+                f"<title>{escape(book['title'])}</title>\n<style>{STYLE}</style>\n"
+                "</head>\n<body>\n<header>\n"
+                f"{cover}<h1>{escape(book['title'])}</h1>\n"
+                f"<p><em>{escape(book['author'])}</em></p>\n</header>\n"
+                f"<nav>\n<h2>Table of Contents</h2>\n{toc_html(book)}\n</nav>\n<main>\n"
+            )
+            # Chapter by chapter, a long book is never held whole as a string
+            for c, chapter in enumerate(book["content"], 1):
+                file.write(f"<section>\n{chapter_html(c, chapter)}\n</section>\n")
+            file.write("</main>\n</body>\n</html>\n")
+
+
+def xhtml(title: str, body: str) -> str:
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>\n<!DOCTYPE html>\n'
+        '<html xmlns="http://www.w3.org/1999/xhtml" '
+        'xmlns:epub="http://www.idpf.org/2007/ops" lang="en" xml:lang="en">\n'
+        f"<head><meta charset=\"utf-8\"/><title>{escape(title)}</title>"
+        '<link rel="stylesheet" href="style.css"/></head>\n'
+        f"<body>\n{body}\n</body>\n</html>\n"
+    )
+
+
+CONTAINER = """<?xml version="1.0" encoding="utf-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>
+"""
+
+
+class EpubRenderer(Renderer):
+    # EPUB 3: a cover page, a navigation document and one XHTML file per chapter
+    extension = "epub"
+    content_type = "application/epub+zip"
+
+    def render(self, book: dict, target: str) -> None:
+        chapters = [
+            (f"chapter-{c}.xhtml", chapter) for c, chapter in enumerate(book["content"], 1)
+        ]
+        cover = web_cover(book)
+
+        manifest = [
+            '<item id="nav" href="nav.xhtml" media-type="application/xhtml+xml"'
+            ' properties="nav"/>',
+            '<item id="style" href="style.css" media-type="text/css"/>',
+            '<item id="title" href="title.xhtml" media-type="application/xhtml+xml"/>',
+        ]
+        if cover:
+            manifest.append(
+                '<item id="cover" href="cover.jpg" media-type="image/jpeg"'
+                ' properties="cover-image"/>'
+            )
+        manifest += [
+            f'<item id="c{c}" href="{name}" media-type="application/xhtml+xml"/>'
+            for c, (name, _) in enumerate(chapters, 1)
+        ]
+        spine = ['<itemref idref="title"/>', '<itemref idref="nav"/>']
+        spine += [f'<itemref idref="c{c}"/>' for c in range(1, len(chapters) + 1)]
+
+        package = (
+            '<?xml version="1.0" encoding="utf-8"?>\n'
+            '<package xmlns="http://www.idpf.org/2007/opf" version="3.0"'
+            ' unique-identifier="id">\n'
+            '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">\n'
+            f'<dc:identifier id="id">urn:aiscript:book:{escape(str(book["id"]))}</dc:identifier>\n'
+            f"<dc:title>{escape(book['title'])}</dc:title>\n"
+            f"<dc:creator>{escape(book['author'])}</dc:creator>\n"
+            "<dc:language>en</dc:language>\n"
+            f'<meta property="dcterms:modified">{book.get("modified", "2000-01-01T00:00:00Z")}</meta>\n'
+            + ('<meta name="cover" content="cover"/>\n' if cover else "")
+            + "</metadata>\n<manifest>\n"
+            + "\n".join(manifest)
+            + "\n</manifest>\n<spine>\n"
+            + "\n".join(spine)
+            + "\n</spine>\n</package>\n"
+        )
+
+        title = (
+            ('<img class="cover" src="cover.jpg" alt="Cover"/>' if cover else "")
+            + f"<h1>{escape(book['title'])}</h1><p><em>{escape(book['author'])}</em></p>"
+        )
+        nav = (
+            '<nav epub:type="toc" id="toc"><h2>Table of Contents</h2>'
+            + toc_html(book, "chapter-{c}.xhtml")
+            + "</nav>"
+        )
+
+        def write(archive: ZipFile, name: str, data, compress: int = ZIP_DEFLATED) -> None:
+            # Fixed timestamps, the same book always gives the same file
+            archive.writestr(ZipInfo(name, (1980, 1, 1, 0, 0, 0)), data, compress)
+
+        with ZipFile(target, "w") as archive:
+            # The mimetype comes first and uncompressed, readers identify the file by it
+            write(archive, "mimetype", "application/epub+zip", ZIP_STORED)
+            write(archive, "META-INF/container.xml", CONTAINER)
+            write(archive, "OEBPS/content.opf", package)
+            write(archive, "OEBPS/style.css", STYLE)
+            write(archive, "OEBPS/title.xhtml", xhtml(book["title"], title))
+            write(archive, "OEBPS/nav.xhtml", xhtml(book["title"], nav))
+            if cover:
+                # Already compressed
+                with open(cover, "rb") as file:
+                    write(archive, "OEBPS/cover.jpg", file.read(), ZIP_STORED)
+            for c, (name, chapter) in enumerate(chapters, 1):
+                write(
+                    archive,
+                    f"OEBPS/{name}",
+                    xhtml(chapter["chapter"], chapter_html(c, chapter)),
+                )
+
+
+# Available formats, by name
+RENDERERS = {
+    "epub": EpubRenderer,
+    "html": HtmlRenderer,
+    "markdown": MarkdownRenderer,
+}
+
+
+def export_path(book_id, format: str) -> str:
+    return f"media/exports/{book_id}.{RENDERERS[format].extension}"
+
+
+def render_export(book: dict, format: str) -> str:
+    # Render a book in a format, written next to its final path then moved in place so
+    # that a reader never gets a partial file. Returns the path.
+    target = export_path(book["id"], format)
+    makedirs(path.dirname(target), exist_ok=True)
+
+    with atomic_write(target, ".partial") as partial:
+        RENDERERS[format]().render(book, partial)
+    return target
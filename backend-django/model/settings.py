@@ -1,4 +1,6 @@
+from json import loads
 from os import getenv, path
+from tempfile import gettempdir
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -8,12 +10,99 @@ BASE_DIR = path.dirname(path.dirname(path.abspath(__file__)))
 
 # Access environment variables
 API_KEY = getenv("OPENAI_API_KEY")
+# Point the client to another OpenAI compatible server (e.g. a local fake one for tests)
+API_BASE_URL = getenv("OPENAI_BASE_URL") or None
 
 MEDIA_URL = "/media/"
 MEDIA_ROOT = path.join(BASE_DIR, "media")
+# Cached parts of the documents of the books (see model/docx_parts.py), kept out of
+# the served media
+DOCUMENT_PARTS_ROOT = getenv("DOCUMENT_PARTS_ROOT") or path.join(
+    BASE_DIR, "cache", "parts"
+)
 
 # Define fonts
 # TOC = Table of Contents
 TOC_FONT = "Garamond"
 TITLE_FONT = "Garamond"
 CONTENT_FONT = "Caslon"
+
+# Generation concurrency
+# Maximum number of subsection requests in flight for a single book (1 = sequential)
+GENERATION_CONCURRENCY = int(getenv("GENERATION_CONCURRENCY", 4))
+# Maximum number of subsections of a chapter written by a single request (1 = no batching)
+GENERATION_BATCH_SIZE = int(getenv("GENERATION_BATCH_SIZE", 1))
+
+# API client
+# Timeouts (in seconds) of the API requests
+OPENAI_TIMEOUT = float(getenv("OPENAI_TIMEOUT", 120))
+OPENAI_CONNECT_TIMEOUT = float(getenv("OPENAI_CONNECT_TIMEOUT", 10))
+# Connection pool shared by every API call of the process
+OPENAI_MAX_CONNECTIONS = int(getenv("OPENAI_MAX_CONNECTIONS", 32))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", 16))
+OPENAI_KEEPALIVE_EXPIRY = float(getenv("OPENAI_KEEPALIVE_EXPIRY", 60))
+# Number of times a rate limited (429) or failed (5xx, network) request is retried
+OPENAI_MAX_RETRIES = int(getenv("OPENAI_MAX_RETRIES", 5))
+# Base delay (in seconds) of the jittered exponential backoff when no Retry-After is sent
+OPENAI_RETRY_BASE_DELAY = float(getenv("OPENAI_RETRY_BASE_DELAY", 1))
+
+# Rate limits
+# Requests and tokens per minute allowed by the account, 0 to learn them from the
+# x-ratelimit-* headers of the responses
+OPENAI_RPM = int(getenv("OPENAI_RPM", 0))
+OPENAI_TPM = int(getenv("OPENAI_TPM", 0))
+# Adaptive limit of the calls in flight per model and process: grows while the calls
+# succeed, halves on a rate limit, between the minimum and the maximum
+OPENAI_INITIAL_CONCURRENCY = int(getenv("OPENAI_INITIAL_CONCURRENCY", 8))
+OPENAI_MIN_CONCURRENCY = int(getenv("OPENAI_MIN_CONCURRENCY", 1))
+OPENAI_MAX_CONCURRENCY = int(getenv("OPENAI_MAX_CONCURRENCY", OPENAI_MAX_CONNECTIONS))
+# Completion tokens expected of a call with no max_tokens, until some are measured
+OPENAI_COMPLETION_TOKENS = int(getenv("OPENAI_COMPLETION_TOKENS", 600))
+
+# Prices of the API calls, to estimate their cost in the metrics: dollars per million
+# tokens for the chat models, per image for the image models (JSON to override them)
+LLM_PRICES = loads(getenv("LLM_PRICES") or "null") or {
+    "gpt-3.5-turbo": {"prompt": 0.5, "completion": 1.5},
+}
+IMAGE_PRICES = loads(getenv("IMAGE_PRICES") or "null") or {"dall-e-2": 0.02}
+
+# LLM response cache
+# Backend used to cache the API responses: "sqlite", "memory" or "none"
+LLM_CACHE_BACKEND = getenv("LLM_CACHE_BACKEND", "sqlite")
+LLM_CACHE_PATH = getenv("LLM_CACHE_PATH", path.join(BASE_DIR, "llm_cache.sqlite3"))
+# Time to live (in seconds) of a cached response
+LLM_CACHE_TTL = float(getenv("LLM_CACHE_TTL", 7 * 24 * 3600))
+# Size caps, the least recently used responses are evicted beyond them
+LLM_CACHE_MAX_ENTRIES = int(getenv("LLM_CACHE_MAX_ENTRIES", 100_000))
+LLM_CACHE_MAX_BYTES = int(getenv("LLM_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+
+# Cover sizes (width, height), all cropped from the same image in one pass
+# The print size is saved as PNG ({id}.png), the others as JPEG ({id}_{size}.jpg)
+COVER_SIZES = {
+    "print": (1000, 1250),
+    "web": (480, 600),
+    "thumbnail": (160, 200),
+}
+COVER_JPEG_QUALITY = int(getenv("COVER_JPEG_QUALITY", 85))
+
+# PDF conversion
+# Backend used to convert the documents: "aspose", "libreoffice", "docx2pdf" or "auto"
+# (Aspose if installed, then LibreOffice on Linux, then docx2pdf), chosen once per process
+PDF_BACKEND = getenv("PDF_BACKEND", "auto")
+# Number of persistent converter workers, and of conversions waiting for one of them
+PDF_WORKERS = int(getenv("PDF_WORKERS", 2))
+PDF_QUEUE_SIZE = int(getenv("PDF_QUEUE_SIZE", 16))
+# Time limits (in seconds) of a conversion and of the start of a worker
+PDF_TIMEOUT = float(getenv("PDF_TIMEOUT", 120))
+PDF_STARTUP_TIMEOUT = float(getenv("PDF_STARTUP_TIMEOUT", 60))
+# LibreOffice executable (found on the PATH by default) and the directory of the
+# worker profiles, every worker has its own so that they never share a profile lock
+LIBREOFFICE_PATH = getenv("LIBREOFFICE_PATH") or None
+LIBREOFFICE_PROFILE_DIR = getenv("LIBREOFFICE_PROFILE_DIR") or path.join(
+    gettempdir(), "aiscript-libreoffice"
+)
+# unoserver executable (found on the PATH by default), installed for a Python that can
+# import LibreOffice's `uno`: with it every worker keeps a LibreOffice running instead
+# of starting one per conversion
+LIBREOFFICE_UNOSERVER = getenv("LIBREOFFICE_UNOSERVER") or None
+ASPOSE_LICENSE = getenv("ASPOSE_LICENSE", "aspose.lic")
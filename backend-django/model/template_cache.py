@@ -0,0 +1,29 @@
+from copy import deepcopy
+from threading import Lock
+from docx import Document
+from docxtpl import DocxTemplate
+
+
+class TemplateCache:
+    # Parses every DOCX template once per process, and hands out cheap copies of it
+    def __init__(self) -> None:
+        self._documents = {}
+        self._lock = Lock()
+
+    def get(self, path: str) -> DocxTemplate:
+        with self._lock:
+            if path not in self._documents:
+                self._documents[path] = Document(path)
+            document = self._documents[path]
+
+        # Copying the parsed document is cheaper than unzipping and parsing the file again
+        template = DocxTemplate(path)
+        template.docx = deepcopy(document)
+        return template
+
+    def clear(self) -> None:
+        with self._lock:
+            self._documents.clear()
+
+
+templates = TemplateCache()
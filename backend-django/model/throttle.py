@@ -0,0 +1,276 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from heapq import heappop, heappush
+from itertools import count
+from math import inf
+from random import uniform
+from re import findall
+from threading import Condition, Lock
+from time import monotonic, sleep
+from typing import Callable, Optional, TypeVar
+from openai import APIConnectionError, InternalServerError, RateLimitError
+
+
+from .metrics import LLM_CONCURRENCY_LIMIT, LLM_RETRIES, LLM_THROTTLE_SECONDS
+from .settings import (
+    OPENAI_MAX_RETRIES,
+    OPENAI_RETRY_BASE_DELAY,
+    OPENAI_RPM,
+    OPENAI_TPM,
+    OPENAI_INITIAL_CONCURRENCY,
+    OPENAI_MIN_CONCURRENCY,
+    OPENAI_MAX_CONCURRENCY,
+    OPENAI_COMPLETION_TOKENS,
+)
+
+
+T = TypeVar("T")
+
+# Errors worth retrying: rate limits (429), server errors (5xx), timeouts and network errors
+RETRYABLE_ERRORS = (RateLimitError, InternalServerError, APIConnectionError)
+
+
+class Backpressure:
+    # Shared cool-down gate for API calls: when one caller gets rate limited,
+    # every caller sharing the gate holds off until the cool-down expires
+    def __init__(
+        self,
+        max_retries: int = OPENAI_MAX_RETRIES,
+        base_delay: float = OPENAI_RETRY_BASE_DELAY,
+    ) -> None:
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.retries = 0
+
+        self._lock = Lock()
+        self._resume_at = 0.0
+
+    def wait(self) -> None:
+        # Block until the current cool-down (if any) is over
+        while True:
+            with self._lock:
+                delay = self._resume_at - monotonic()
+            if delay <= 0:
+                return
+            sleep(delay)
+
+    def pause(self, delay: float) -> None:
+        # Extend the cool-down, never shorten one set by another caller
+        with self._lock:
+            self._resume_at = max(self._resume_at, monotonic() + delay)
+
+    def call(self, fn: Callable[[], T]) -> T:
+        attempt = 0
+        while True:
+            self.wait()
+            try:
+                return fn()
+            except RETRYABLE_ERRORS as e:
+                if attempt >= self.max_retries:
+                    raise e
+
+                # Honour the server's Retry-After, otherwise back off exponentially with jitter
+                delay = self.retry_after(e)
+                if delay is None:
+                    delay = self.base_delay * (2**attempt) * uniform(1, 1.5)
+
+                # A rate limit holds off every caller, other errors only this one
+                if isinstance(e, RateLimitError):
+                    self.pause(delay)
+                else:
+                    sleep(delay)
+
+                attempt += 1
+                with self._lock:
+                    self.retries += 1
+                LLM_RETRIES.labels(type(e).__name__).inc()
+
+    @staticmethod
+    def retry_after(error: Exception) -> Optional[float]:
+        try:
+            return float(error.response.headers.get("retry-after"))
+        except (AttributeError, TypeError, ValueError):
+            return None
+
+
+# Priorities of the API calls, the lowest first: calls of books someone is waiting for
+# go before the calls of books generated in bulk
+INTERACTIVE, BULK = 0, 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BULK: "bulk"}
+
+# Priority of the calls made by the current job, threads started for the job must copy
+# its context (contextvars.copy_context) to inherit it
+priority = ContextVar("priority", default=INTERACTIVE)
+
+
+@contextmanager
+def prioritized(level: int):
+    token = priority.set(level)
+    try:
+        yield
+    finally:
+        priority.reset(token)
+
+
+def parse_duration(value: str) -> float:
+    # Reset durations of the rate limit headers: "20ms", "1s", "6m0s", "1h2m3.5s"
+    units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(n) * units[unit] for n, unit in findall(r"([\d.]+)(ms|s|m|h)", value))
+
+
+class Budget:
+    # Requests or tokens left under a rate limit, refilled continuously up to the limit
+    # like the API does. Unlimited until the limit is configured or read from the
+    # response headers.
+    def __init__(self, per_minute: int = 0) -> None:
+        self.limit = None
+        if per_minute:
+            self.set(per_minute, per_minute, 0)
+
+    def set(self, limit: int, remaining: int, reset: float) -> None:
+        # `reset` is the time until the budget is full again, which gives its refill rate
+        self.limit = limit
+        self.level = remaining
+        self.rate = (
+            (limit - remaining) / reset if reset > 0 and remaining < limit else limit / 60
+        )
+        self.at = monotonic()
+
+    def available(self, now: float) -> float:
+        if self.limit is None:
+            return inf
+        return min(self.limit, self.level + self.rate * (now - self.at))
+
+    def delay(self, amount: int, now: float) -> float:
+        # Seconds until `amount` is available, a request larger than the whole limit
+        # only waits for a full budget
+        if self.limit is None:
+            return 0
+        missing = min(amount, self.limit) - self.available(now)
+        return missing / self.rate if missing > 0 else 0
+
+    def take(self, amount: int, now: float) -> None:
+        if self.limit is not None:
+            self.level = self.available(now) - amount
+            self.at = now
+
+
+class RateLimiter:
+    # Admission of the API calls to a model, shared by every caller of the process:
+    # - at most `limit` calls in flight, adapted as they complete (AIMD): +1 per `limit`
+    #   successful calls, halved on a rate limit (once for the calls in flight then)
+    # - within the requests and tokens budgets, estimated before the call and corrected
+    #   with the x-ratelimit-* headers of the responses
+    # - waiting calls are admitted by priority, then in arrival order
+    def __init__(
+        self,
+        model: str,
+        rpm: int = OPENAI_RPM,
+        tpm: int = OPENAI_TPM,
+        initial: int = OPENAI_INITIAL_CONCURRENCY,
+        minimum: int = OPENAI_MIN_CONCURRENCY,
+        maximum: int = OPENAI_MAX_CONCURRENCY,
+        completion_tokens: int = OPENAI_COMPLETION_TOKENS,
+    ) -> None:
+        self.model = model
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.in_flight = 0
+        self.requests = Budget(rpm)
+        self.tokens = Budget(tpm)
+        # Moving average of the completion tokens, for the calls with no max_tokens
+        self.completion_tokens = float(completion_tokens)
+
+        self._condition = Condition()
+        self._waiting = []
+        self._order = count()
+        self._decreased_at = 0.0
+        LLM_CONCURRENCY_LIMIT.labels(model).set(self.limit)
+
+    def estimate(self, messages: list, max_tokens: int = None) -> int:
+        # About 4 characters per token, plus the tokens the API adds per message. The
+        # API counts max_tokens against the budget, else the expected completion.
+        prompt = sum(len(message.get("content") or "") for message in messages) // 4
+        return prompt + 4 * len(messages) + (max_tokens or round(self.completion_tokens))
+
+    def acquire(self, tokens: int = 0) -> float:
+        # Block until the call can be made, returns when it was admitted
+        level = priority.get()
+        entry = (level, next(self._order))
+        start = monotonic()
+        with self._condition:
+            heappush(self._waiting, entry)
+            while True:
+                delay = None
+                if self._waiting[0] == entry and self.in_flight < int(self.limit):
+                    now = monotonic()
+                    delay = max(self.requests.delay(1, now), self.tokens.delay(tokens, now))
+                    if delay <= 0:
+                        break
+                self._condition.wait(delay)
+
+            heappop(self._waiting)
+            self.in_flight += 1
+            self.requests.take(1, now)
+            self.tokens.take(tokens, now)
+            # The next call in line may be admitted as well
+            self._condition.notify_all()
+
+        LLM_THROTTLE_SECONDS.labels(PRIORITY_NAMES.get(level, str(level))).observe(
+            now - start
+        )
+        return now
+
+    def release(
+        self, admitted: float, error: Exception = None, completion_tokens: int = 0
+    ) -> None:
+        # The call admitted at `admitted` is over, failed with `error` if given
+        with self._condition:
+            self.in_flight -= 1
+            response = getattr(error, "response", None)
+            if response is not None:
+                self.update(response.headers)
+
+            if isinstance(error, RateLimitError):
+                # The calls admitted before the previous decrease were made under the
+                # higher limit, their rate limits do not halve it again
+                if admitted >= self._decreased_at:
+                    self.limit = max(self.minimum, self.limit / 2)
+                    self._decreased_at = monotonic()
+            elif error is None:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+                if completion_tokens:
+                    self.completion_tokens += 0.1 * (
+                        completion_tokens - self.completion_tokens
+                    )
+
+            LLM_CONCURRENCY_LIMIT.labels(self.model).set(self.limit)
+            self._condition.notify_all()
+
+    def update(self, headers) -> None:
+        # The budgets left as counted by the API, which also counts other processes
+        with self._condition:
+            for budget, name in ((self.requests, "requests"), (self.tokens, "tokens")):
+                try:
+                    budget.set(
+                        int(headers[f"x-ratelimit-limit-{name}"]),
+                        int(headers[f"x-ratelimit-remaining-{name}"]),
+                        parse_duration(headers.get(f"x-ratelimit-reset-{name}", "")),
+                    )
+                except (KeyError, TypeError, ValueError):
+                    continue
+            self._condition.notify_all()
+
+    def call(self, fn: Callable[[], T], tokens: int = 0) -> tuple:
+        # Make one attempt of a call returning a raw response (with its headers), once
+        # admitted. The call stays in flight until `release`, so a streamed response
+        # counts until it is read. Returns the response and when it was admitted.
+        admitted = self.acquire(tokens)
+        try:
+            response = fn()
+        except Exception as e:
+            self.release(admitted, e)
+            raise
+        self.update(response.headers)
+        return response, admitted
@@ -166,6 +166,45 @@ export class BookService implements OnModuleInit {
     );
   }
 
+  /**
+   * Polls a Django book generation job until it is finished.
+   *
+   * @param {number} jobId - The ID of the job returned by the Django server.
+   * @param {number} [interval=2000] - The delay between two polls, in milliseconds.
+   * @param {number} [timeout=1800000] - The longest wait for the job, in milliseconds.
+   * @returns {Promise<any>} - The generated book data.
+   * @throws {Error} - If the job failed, or is not finished before the timeout.
+   */
+  private async waitForBookJob(
+    jobId: number,
+    interval: number = 2000,
+    timeout: number = 30 * 60 * 1000,
+  ): Promise<any> {
+    const deadline: number = Date.now() + timeout;
+
+    while (true) {
+      // Fetch the current status of the job
+      const response: AxiosResponse = await firstValueFrom(
+        this.httpService.get(`${process.env.DJANGO_URL}/job-detail/${jobId}/`),
+      );
+      const job = response.data;
+
+      if (job.status === 'done') return job.book;
+      if (job.status === 'failed')
+        throw new Error(`Book generation job ${jobId} failed: ${job.error}`);
+
+      // A job left queued (no worker running) or stuck must not hang the request,
+      // it can still be followed with its ID
+      if (Date.now() + interval > deadline)
+        throw new Error(
+          `Book generation job ${jobId} is still ${job.status} after ${timeout} ms, poll /job-detail/${jobId}/`,
+        );
+
+      // Wait before polling again
+      await new Promise((resolve) => setTimeout(resolve, interval));
+    }
+  }
+
   /**
    * Generates a book by calling the Django server.
    *
@@ -203,8 +242,8 @@ export class BookService implements OnModuleInit {
         ),
       );
 
-      // Extract the response data
-      const responseData = response.data;
+      // The Django server queues the generation, wait for the job to finish
+      const responseData = await this.waitForBookJob(response.data.id);
 
       // Deduct the price of the book from the user's wallet
       await this.walletService.deductCreditsFromWallet(wallet.id, price);
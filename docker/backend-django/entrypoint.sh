@@ -1,10 +1,23 @@
 #!/bin/bash
 set -e
 
-# Check if migrations need to be applied
-if [ ! -f /app/.migrated ]; then
-    python manage.py migrate
-    touch /app/.migrated
+if [ "$1" = "uvicorn" ]; then
+    # The web server applies the migrations on every start, they are a no-op when the
+    # database is up to date
+    python manage.py migrate --noinput
+else
+    # The other containers (the workers) share its database, they wait for it to be
+    # migrated instead of racing it
+    until python manage.py migrate --check > /dev/null 2>&1; do
+        echo "Waiting for the database migrations..."
+        sleep 2
+    done
+fi
+
+# The web server starts the metrics shared with the workers over, the files of the
+# processes of a previous run would be added to the new ones
+if [ -n "$PROMETHEUS_MULTIPROC_DIR" ] && [ "$1" = "uvicorn" ]; then
+    rm -rf "${PROMETHEUS_MULTIPROC_DIR:?}"/*
 fi
 
 # Run the Django server